@@ -0,0 +1,240 @@
+# admission.py
+"""Contrôle d'admission : limites de concurrence et délestage
+
+Deux limiteurs par processus :
+
+- REQUESTS : requêtes traitées en même temps (RESCUEMAP_MAX_REQUESTS). Au-delà,
+  les requêtes attendent dans une file ordonnée par priorité : les lectures
+  (carte, recherche, chat) passent avant les écritures, et celles-ci avant
+  les chargements de villes ;
+- INGESTIONS : requêtes qui déclenchent un chargement (ville inconnue,
+  réinitialisation) ; peu à la fois au total (RESCUEMAP_MAX_INGESTIONS) et
+  par client (RESCUEMAP_INGESTIONS_PER_CLIENT).
+
+Une requête refusée reçoit 429 (ce client a déjà trop de chargements en
+cours) ou 503 (file pleine, ou attente trop longue), avec un en-tête
+Retry-After estimé d'après la durée moyenne des traitements. Le client est
+identifié par son adresse IP, ou par l'en-tête RESCUEMAP_CLIENT_HEADER
+derrière un proxy (ex: X-Forwarded-For). /metrics, /debug/profile et le flux
+du chat (connexion longue) ne passent pas par les limiteurs.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+import metrics
+
+MAX_REQUESTS = int(os.environ.get('RESCUEMAP_MAX_REQUESTS', 64))
+REQUEST_QUEUE = int(os.environ.get('RESCUEMAP_REQUEST_QUEUE', 256))
+REQUEST_WAIT = float(os.environ.get('RESCUEMAP_REQUEST_WAIT', 5))
+
+MAX_INGESTIONS = int(os.environ.get('RESCUEMAP_MAX_INGESTIONS', 2))
+INGESTIONS_PER_CLIENT = int(os.environ.get('RESCUEMAP_INGESTIONS_PER_CLIENT', 1))
+INGESTION_QUEUE = int(os.environ.get('RESCUEMAP_INGESTION_QUEUE', 4))
+INGESTION_WAIT = float(os.environ.get('RESCUEMAP_INGESTION_WAIT', 10))
+
+CLIENT_HEADER = os.environ.get('RESCUEMAP_CLIENT_HEADER')
+
+MAX_RETRY_AFTER = 120
+
+# Priorités (la plus petite passe en premier)
+READ, WRITE, INGEST = 0, 1, 2
+
+UNLIMITED_PATHS = ('/metrics', '/debug/profile', '/api/chat/stream')
+
+REJECTED = metrics.REGISTRY.counter(
+    'rescuemap_admission_rejected_total', 'Requêtes refusées par le contrôle d\'admission', ('limiter', 'reason'))
+WAIT_SECONDS = metrics.REGISTRY.histogram(
+    'rescuemap_admission_wait_seconds', 'Attente dans la file du contrôle d\'admission', ('limiter',))
+
+MESSAGES = {
+    'client': 'Trop de chargements en cours pour ce client',
+    'queue_full': 'Serveur surchargé, réessayez plus tard',
+    'timeout': 'Serveur surchargé, réessayez plus tard',
+}
+
+class Rejected(Exception):
+    """Requête refusée : statut HTTP (429 ou 503) et délai conseillé (secondes)"""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(MESSAGES[reason])
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+class Ticket:
+    """Place obtenue dans un limiteur, à rendre avec release()"""
+
+    def __init__(self, client):
+        self.client = client
+        self.start = time.perf_counter()
+
+class _Waiter:
+    def __init__(self, client, wake):
+        self.client = client
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+class Limiter:
+    def __init__(self, name, limit, per_client=0, max_queue=0, wait=0.0):
+        self.name = name
+        self.limit = limit
+        self.per_client = per_client
+        self.max_queue = max_queue
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        # Places données depuis le démarrage (périodes creuses, voir maintenance.py)
+        self.admitted = 0
+        # Places occupées ou attendues par client
+        self.clients = Counter()
+        self.heap = []
+        self.sequence = itertools.count()
+        # Durée moyenne d'occupation d'une place (moyenne mobile), pour Retry-After
+        self.average = 1.0
+
+    def _retry_after(self):
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(self.average * (self.queued + 1) / self.limit)))
+
+    def _reject(self, status, reason):
+        REJECTED.inc(limiter=self.name, reason=reason)
+        return Rejected(status, self._retry_after(), reason)
+
+    def _forget(self, client):
+        self.clients[client] -= 1
+        if self.clients[client] <= 0:
+            del self.clients[client]
+
+    def _enter(self, client, priority, wake):
+        """(Ticket, None) si admis tout de suite, (None, attente) sinon ; lève Rejected"""
+        with self.lock:
+            if self.per_client and self.clients[client] >= self.per_client:
+                raise self._reject(429, 'client')
+            # Pas de dépassement : une place libre revient d'abord aux requêtes en attente
+            if self.active < self.limit and not self.queued:
+                self.active += 1
+                self.admitted += 1
+                self.clients[client] += 1
+                return Ticket(client), None
+            if self.queued >= self.max_queue:
+                raise self._reject(503, 'queue_full')
+
+            waiter = _Waiter(client, wake)
+            heapq.heappush(self.heap, (priority, next(self.sequence), waiter))
+            self.queued += 1
+            self.clients[client] += 1
+            return None, waiter
+
+    def _abandon(self, waiter):
+        """Fin d'attente sans réveil ; retourne vrai si la place a été obtenue entre-temps"""
+        with self.lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self.queued -= 1
+            self._forget(waiter.client)
+            return False
+
+    def _timeout(self, waiter):
+        if self._abandon(waiter):
+            return Ticket(waiter.client)
+        with self.lock:
+            raise self._reject(503, 'timeout')
+
+    def acquire(self, client, priority=READ):
+        """Attend une place (thread) ; lève Rejected si refusée"""
+        event = threading.Event()
+        ticket, waiter = self._enter(client, priority, event.set)
+        if ticket is not None:
+            return ticket
+
+        start = time.perf_counter()
+        granted = event.wait(self.wait)
+        WAIT_SECONDS.observe(time.perf_counter() - start, limiter=self.name)
+        return Ticket(client) if granted else self._timeout(waiter)
+
+    async def acquire_async(self, client, priority=READ):
+        """Attend une place sans bloquer la boucle d'événements ; lève Rejected si refusée"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        ticket, waiter = self._enter(client, priority, wake)
+        if ticket is not None:
+            return ticket
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.wait)
+        except asyncio.TimeoutError:
+            return self._timeout(waiter)
+        except asyncio.CancelledError:
+            # Client déconnecté pendant l'attente : rendre la place si elle venait d'être donnée
+            if self._abandon(waiter):
+                self.release(Ticket(client))
+            raise
+        finally:
+            WAIT_SECONDS.observe(time.perf_counter() - start, limiter=self.name)
+        return Ticket(client)
+
+    def release(self, ticket):
+        with self.lock:
+            self.active -= 1
+            self._forget(ticket.client)
+            self.average += 0.2 * (time.perf_counter() - ticket.start - self.average)
+
+            while self.heap and self.active < self.limit:
+                _, _, waiter = heapq.heappop(self.heap)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self.queued -= 1
+                self.active += 1
+                self.admitted += 1
+                waiter.wake()
+
+    def stats(self):
+        with self.lock:
+            return {'active': self.active, 'queued': self.queued, 'limit': self.limit, 'admitted': self.admitted}
+
+REQUESTS = Limiter('requests', MAX_REQUESTS, max_queue=REQUEST_QUEUE, wait=REQUEST_WAIT)
+INGESTIONS = Limiter('ingestions', MAX_INGESTIONS, per_client=INGESTIONS_PER_CLIENT,
+                     max_queue=INGESTION_QUEUE, wait=INGESTION_WAIT)
+LIMITERS = (REQUESTS, INGESTIONS)
+
+def client_key(remote_addr, headers):
+    """Identifiant du client pour les limites par client"""
+    if CLIENT_HEADER:
+        value = headers.get(CLIENT_HEADER)
+        if value:
+            return value.split(',')[0].strip()
+    return remote_addr or 'inconnu'
+
+def request_priority(method, ingestion):
+    if ingestion:
+        return INGEST
+    return READ if method in ('GET', 'HEAD') else WRITE
+
+def is_limited(path):
+    return path not in UNLIMITED_PATHS
+
+def _collector():
+    lines = []
+    for field, documentation in (('active', 'Requêtes admises en cours'),
+                                 ('queued', "Requêtes en file d'attente"),
+                                 ('limit', 'Places du limiteur')):
+        name = f'rescuemap_admission_{field}'
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge']
+        lines += [f'{name}{{limiter="{limiter.name}"}} {limiter.stats()[field]}' for limiter in LIMITERS]
+    return lines
+
+metrics.REGISTRY.add_collector(_collector)
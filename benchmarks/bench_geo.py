@@ -0,0 +1,69 @@
+# benchmarks/bench_geo.py
+"""Micro-benchmarks de geo.py : versions NumPy contre boucles Python pures
+
+    python benchmarks/bench_geo.py --points 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import (assign_nearest_city, bounding_box, haversine_km, haversine_many,  # noqa: E402
+                 nearest_city, radius_mask)
+from server import CITIES  # noqa: E402
+
+CENTER = CITIES['Toulouse']
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def python_radius(lats, lons, radius_km):
+    south, north, west, east = bounding_box(CENTER['lat'], CENTER['lon'], radius_km)
+    return [south <= lat <= north and west <= lon <= east
+            and haversine_km(CENTER['lat'], CENTER['lon'], lat, lon) <= radius_km
+            for lat, lon in zip(lats, lons)]
+
+def run(points, seed):
+    rng = np.random.default_rng(seed)
+    # Points répartis sur la France métropolitaine
+    lats = rng.uniform(42.3, 51.1, points)
+    lons = rng.uniform(-4.8, 8.2, points)
+    py_lats = lats.tolist()
+    py_lons = lons.tolist()
+
+    cases = [
+        ('haversine',
+         lambda: [haversine_km(CENTER['lat'], CENTER['lon'], lat, lon) for lat, lon in zip(py_lats, py_lons)],
+         lambda: haversine_many(CENTER['lat'], CENTER['lon'], lats, lons)),
+        ('rayon 20 km',
+         lambda: python_radius(py_lats, py_lons, 20),
+         lambda: radius_mask(CENTER['lat'], CENTER['lon'], lats, lons, 20)),
+        (f'ville la plus proche ({len(CITIES)} centres)',
+         lambda: [nearest_city(lat, lon, CITIES) for lat, lon in zip(py_lats, py_lons)],
+         lambda: assign_nearest_city(lats, lons, CITIES)),
+    ]
+
+    print(f"📏 {points:,} points".replace(',', ' '))
+    print(f"{'opération':<34} {'Python':>10} {'NumPy':>10} {'gain':>8}")
+    for name, python_version, numpy_version in cases:
+        expected, python_seconds = timed(python_version)
+        result, numpy_seconds = timed(numpy_version)
+        # Les deux versions doivent donner le même résultat
+        if result.dtype == np.float64:
+            assert np.allclose(expected, result)
+        else:
+            assert (np.asarray(expected, dtype=result.dtype) == result).all()
+        print(f"{name:<34} {python_seconds:>9.3f}s {numpy_seconds:>9.3f}s {python_seconds / numpy_seconds:>7.0f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks géométriques")
+    parser.add_argument('--points', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    run(args.points, args.seed)
@@ -0,0 +1,309 @@
+# benchmarks/bench_http.py
+"""Benchmark de bout en bout de l'API HTTP
+
+Lance server.py (ou server_async.py) dans un processus séparé sur une base
+synthétique, avec des serveurs de géocodage et Overpass simulés, puis joue
+une charge mixte à des niveaux de concurrence croissants :
+
+- chargement de carte : /api/supermarkets d'une ville déjà chargée ;
+- recherche spatiale : /api/nearest autour d'un point ;
+- rafales de statuts : /api/update_status ;
+- scrutation du chat : /api/chat/messages ;
+- nouvelles villes : /api/load_city (géocodage + Overpass simulés).
+
+Chaque thread se présente comme un client distinct (en-tête X-Bench-Client) ;
+les requêtes refusées par le contrôle d'admission (429/503) sont comptées à
+part (`shed`), pas comme des erreurs.
+
+Les latences p50/p95/p99 et le débit par endpoint sont écrits en JSON pour
+comparer deux commits :
+
+    python benchmarks/bench_http.py --shops 100000 --concurrency 1 8 32 --duration 10 --out results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic  # noqa: E402
+
+# Part de chaque opération dans la charge mixte
+WORKLOAD = {
+    'map_load': 0.30,
+    'nearest': 0.30,
+    'update_status': 0.20,
+    'chat_poll': 0.15,
+    'new_city': 0.05,
+}
+
+STATUSES = ['safe', 'danger', 'looted', 'unknown']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Nominatim, api-adresse et Overpass simulés, réponses déterministes"""
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload):
+        time.sleep(self.latency)
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _coordinates(self, city):
+        seed = synthetic.city_seed(city)
+        return 43.0 + (seed % 7000) / 1000, -1.0 + (seed // 7000 % 8000) / 1000
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        city = parse_qs(url.query).get('q', [''])[0].split(',')[0]
+        lat, lon = self._coordinates(city)
+        if url.path.startswith('/nominatim'):
+            self._send_json([{'lat': str(lat), 'lon': str(lon)}])
+        else:
+            self._send_json({'features': [{'geometry': {'coordinates': [lon, lat]}}]})
+
+    def do_POST(self):
+        query = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        # Centre de la recherche : "around:rayon,lat,lon"
+        around = query.split('around:', 1)[1].split(')', 1)[0].split(',')
+        lat, lon = float(around[1]), float(around[2])
+        elements = synthetic.generate_city_elements(f"{lat:.4f},{lon:.4f}", {'lat': lat, 'lon': lon, 'radius': 5},
+                                                    count=40)
+        for element in elements:
+            element.pop('sample')
+        self._send_json({'elements': elements})
+
+def start_stub_upstream(latency):
+    handler = type('Handler', (StubUpstreamHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def build_database(path, shops, cities, seed):
+    print(f"🎲 Base synthétique: {shops} magasins, {cities} villes (graine {seed})")
+    dataset = synthetic.generate_dataset(shops, cities, seed)
+    synthetic.write_database(path, dataset, synthetic.generate_status_updates(dataset['ids'], shops // 10, seed))
+    return dataset
+
+def start_server(script, workdir, db_path, port, upstream_url):
+    env = dict(os.environ,
+               DB_PATH=db_path,
+               RESCUEMAP_PORT=str(port),
+               RESCUEMAP_HOST='127.0.0.1',
+               FLASK_DEBUG='false',
+               PYTHONPATH=ROOT,
+               RESCUEMAP_NOMINATIM_URL=f"{upstream_url}/nominatim",
+               RESCUEMAP_ADRESSE_URL=f"{upstream_url}/adresse",
+               RESCUEMAP_OVERPASS_URL=f"{upstream_url}/interpreter",
+               RESCUEMAP_CLIENT_HEADER='X-Bench-Client',
+               RESCUEMAP_REFRESH_PER_HOUR='0')
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, script)], cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté (voir {log.name})")
+        try:
+            requests.get(f"{base_url}/api/status", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Le serveur n'a pas démarré en 60s")
+
+class Workload:
+    """Tire les requêtes de la charge mixte de façon reproductible"""
+
+    def __init__(self, dataset, seed):
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.operations = list(WORKLOAD)
+        self.weights = np.array(list(WORKLOAD.values()))
+        self.weights = self.weights / self.weights.sum()
+        self.ids = dataset['ids']
+        self.cities = dataset['cities']
+        self.lats = dataset['lats']
+        self.lons = dataset['lons']
+        self.city_coords = dataset['city_coords']
+        self.new_cities = 0
+
+    def next_request(self):
+        with self.lock:
+            operation = self.operations[self.rng.choice(len(self.operations), p=self.weights)]
+            index = int(self.rng.integers(len(self.ids)))
+            if operation == 'map_load':
+                # Les grandes villes sont chargées plus souvent (ville d'un magasin tiré au hasard)
+                return operation, 'GET', '/api/supermarkets', {'params': {'city': self.cities[index]}}
+            if operation == 'nearest':
+                lat = float(self.lats[index] + self.rng.normal(0, 0.01))
+                lon = float(self.lons[index] + self.rng.normal(0, 0.01))
+                return operation, 'GET', '/api/nearest', {'params': {'lat': lat, 'lon': lon, 'k': 5, 'status': 'safe'}}
+            if operation == 'update_status':
+                payload = {'id': int(self.ids[index]), 'status': STATUSES[int(self.rng.integers(4))],
+                           'city': self.cities[index]}
+                return operation, 'POST', '/api/update_status', {'json': payload}
+            if operation == 'chat_poll':
+                return operation, 'GET', '/api/chat/messages', {}
+            self.new_cities += 1
+            return operation, 'GET', '/api/load_city', {'params': {'city': f"Bench-{self.new_cities:05d}"}}
+
+def run_level(base_url, workload, concurrency, duration):
+    samples = {name: [] for name in WORKLOAD}
+    errors = {name: 0 for name in WORKLOAD}
+    shed = {name: 0 for name in WORKLOAD}
+    clients = iter(range(concurrency))
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        with lock:
+            session.headers['X-Bench-Client'] = f'bench-{next(clients)}'
+        while time.perf_counter() < stop_at:
+            name, method, path, kwargs = workload.next_request()
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, timeout=60, **kwargs)
+            except requests.RequestException:
+                response = None
+            elapsed = time.perf_counter() - start
+
+            try:
+                body = response.json() if response is not None and response.status_code == 200 else None
+                ok = body is not None and not (isinstance(body, dict) and body.get('success') is False)
+            except ValueError:
+                ok = False
+            with lock:
+                samples[name].append(elapsed)
+                if response is not None and response.status_code in (429, 503):
+                    shed[name] += 1
+                elif not ok:
+                    errors[name] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name, latencies in samples.items():
+        if not latencies:
+            continue
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        endpoints[name] = {
+            'count': len(latencies),
+            'errors': errors[name],
+            'shed': shed[name],
+            'rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2),
+        }
+    total = sum(len(latencies) for latencies in samples.values())
+    return {'concurrency': concurrency, 'duration': round(elapsed, 2), 'rps': round(total / elapsed, 2),
+            'endpoints': endpoints}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix='rescuemap-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    try:
+        if args.db:
+            shutil.copy(args.db, db_path)
+            dataset = synthetic.generate_dataset(args.shops, args.cities, args.seed)
+        else:
+            dataset = build_database(db_path, args.shops, args.cities, args.seed)
+        messages = synthetic.generate_chat_messages(dataset['city_coords'], dataset['names'], 100, args.seed)
+        synthetic.write_chat_file(os.path.join(workdir, 'chat_messages.json'), messages)
+
+        stub = start_stub_upstream(args.upstream_latency)
+        upstream_url = f"http://127.0.0.1:{stub.server_address[1]}"
+        process, base_url = start_server(args.server, workdir, db_path, free_port(), upstream_url)
+        print(f"🚀 {args.server} démarré sur {base_url}")
+
+        results = {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'server': args.server,
+            'python': platform.python_version(),
+            'shops': args.shops,
+            'cities': args.cities,
+            'seed': args.seed,
+            'upstream_latency': args.upstream_latency,
+            'levels': [],
+        }
+        try:
+            workload = Workload(dataset, args.seed)
+            for concurrency in args.concurrency:
+                level = run_level(base_url, workload, concurrency, args.duration)
+                results['levels'].append(level)
+                print(f"\n⚡ Concurrence {concurrency}: {level['rps']} req/s")
+                print(f"   {'endpoint':<15} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'erreurs':>8} {'refusées':>9}")
+                for name, stats in level['endpoints'].items():
+                    print(f"   {name:<15} {stats['rps']:>8} {stats['p50_ms']:>7}ms {stats['p95_ms']:>7}ms "
+                          f"{stats['p99_ms']:>7}ms {stats['errors']:>8} {stats['shed']:>9}")
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            stub.shutdown()
+
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Résultats écrits dans {args.out}")
+    finally:
+        if args.keep:
+            print(f"📁 Répertoire de travail conservé: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de l'API HTTP RescueMap")
+    parser.add_argument('--server', default='server.py', choices=['server.py', 'server_async.py'])
+    parser.add_argument('--shops', type=int, default=100_000)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', default=None,
+                        help="Base synthétique existante (créée avec les mêmes --shops/--cities/--seed)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10.0, help="Durée de chaque palier (secondes)")
+    parser.add_argument('--upstream-latency', type=float, default=0.05,
+                        help="Latence des services externes simulés (secondes)")
+    parser.add_argument('--out', default='bench_http.json')
+    parser.add_argument('--keep', action='store_true', help="Conserver la base et le journal du serveur")
+    main(parser.parse_args())
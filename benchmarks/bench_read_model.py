@@ -0,0 +1,123 @@
+# benchmarks/bench_read_model.py
+"""Mémoire par worker et latence du modèle de lecture (read_model.py)
+
+Pour chaque taille de base synthétique, lance des processus « workers » qui
+servent toutes les villes, une fois par SQLite (query_city_supermarkets
+classique), une fois par le modèle de lecture mappé, et relève :
+
+- la mémoire privée du worker (RssAnon de /proc/self/status), celle qui est
+  multipliée par le nombre de workers ; les pages du fichier mappé (RssFile)
+  sont partagées ;
+- la latence médiane et maximale d'une ville.
+
+    python benchmarks/bench_read_model.py --shops 10000 100000 1000000 --workers 4 --out read_model.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def memory_kb():
+    """(RssAnon, RssFile) du processus courant, en ko"""
+    values = {}
+    with open('/proc/self/status') as status:
+        for line in status:
+            key, _, value = line.partition(':')
+            if key in ('RssAnon', 'RssFile'):
+                values[key] = int(value.split()[0])
+    return values.get('RssAnon', 0), values.get('RssFile', 0)
+
+def worker(db_path, model_path, passes):
+    """Sert toutes les villes `passes` fois ; retourne mémoire et latences"""
+    os.environ['DB_PATH'] = db_path
+    if model_path:
+        os.environ['RESCUEMAP_READ_MODEL'] = model_path
+    os.environ['RESCUEMAP_LOG_LEVEL'] = 'ERROR'
+
+    import server
+    from database import get_connection
+
+    conn = get_connection()
+    cities = [row[0] for row in conn.execute('SELECT DISTINCT city FROM supermarket_cities')]
+    conn.close()
+
+    server.query_city_supermarkets(cities[0])
+    before, _ = memory_kb()
+    latencies = []
+    for _ in range(passes):
+        for city in cities:
+            start = time.perf_counter()
+            server.query_city_supermarkets(city)
+            latencies.append(time.perf_counter() - start)
+    anon, file_backed = memory_kb()
+    return {'rss_anon_kb': anon, 'rss_anon_growth_kb': anon - before, 'rss_file_kb': file_backed,
+            'p50_ms': round(statistics.median(latencies) * 1000, 2), 'max_ms': round(max(latencies) * 1000, 2)}
+
+def run_size(workdir, shops, cities, workers, passes, seed):
+    import synthetic
+    import read_model
+    from migrations import migrate
+
+    db_path = os.path.join(workdir, f'bench-{shops}.db')
+    dataset = synthetic.generate_dataset(shops, cities, seed)
+    synthetic.write_database(db_path, dataset)
+    migrate(db_path)
+
+    model_path = db_path + '.readmodel'
+    start = time.perf_counter()
+    read_model.build_snapshot(model_path, db_path)
+    build_seconds = time.perf_counter() - start
+
+    result = {'shops': shops, 'cities': cities, 'workers': workers, 'build_seconds': round(build_seconds, 2),
+              'model_mb': round(os.path.getsize(model_path) / 1e6, 2)}
+    for label, path in (('sqlite', None), ('read_model', model_path)):
+        # spawn : chaque worker est un interpréteur neuf, comme sous gunicorn
+        with get_context('spawn').Pool(workers) as pool:
+            runs = pool.starmap(worker, [(db_path, path, passes)] * workers)
+        result[label] = {
+            'rss_anon_kb': max(run['rss_anon_kb'] for run in runs),
+            'rss_anon_growth_kb': max(run['rss_anon_growth_kb'] for run in runs),
+            'rss_file_kb': max(run['rss_file_kb'] for run in runs),
+            'p50_ms': round(statistics.median(run['p50_ms'] for run in runs), 2),
+            'max_ms': max(run['max_ms'] for run in runs),
+        }
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark du modèle de lecture")
+    parser.add_argument('--shops', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--passes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rescuemap-read-model-')
+    results = []
+    try:
+        for shops in args.shops:
+            print(f"🎲 {shops} magasins, {args.cities} villes...")
+            result = run_size(workdir, shops, args.cities, args.workers, args.passes, args.seed)
+            results.append(result)
+            print(f"   photographie: {result['model_mb']} Mo en {result['build_seconds']}s")
+            for label in ('sqlite', 'read_model'):
+                stats = result[label]
+                print(f"   {label:<11} RssAnon {stats['rss_anon_kb'] / 1024:>7.1f} Mo "
+                      f"(+{stats['rss_anon_growth_kb'] / 1024:.1f})  RssFile {stats['rss_file_kb'] / 1024:>7.1f} Mo  "
+                      f"p50 {stats['p50_ms']:>7} ms  max {stats['max_ms']:>7} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"\n✅ Résultats écrits dans {args.out}")
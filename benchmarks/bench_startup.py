@@ -0,0 +1,118 @@
+# benchmarks/bench_startup.py
+"""Temps de démarrage à froid des serveurs
+
+Mesure, sur plusieurs lancements, le temps entre le démarrage du processus et
+la première réponse HTTP (page d'accueil), avec une base neuve (migrations
+appliquées) puis une base à jour. Utile pour les workers relancés en boucle
+ou un Raspberry Pi qui redémarre pendant une coupure. Le script échoue si la
+médiane dépasse le budget :
+
+    python benchmarks/bench_startup.py --runs 5 --budget 1.5
+    python benchmarks/bench_startup.py --importtime   # modules les plus lents à importer
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def time_to_first_response(script, workdir, db_path, timeout=60):
+    """Secondes entre le lancement du serveur et sa première réponse sur /"""
+    port = free_port()
+    env = dict(os.environ,
+               DB_PATH=db_path,
+               RESCUEMAP_PORT=str(port),
+               RESCUEMAP_HOST='127.0.0.1',
+               FLASK_DEBUG='false',
+               PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, script)], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"{script} s'est arrêté au démarrage")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"{script} n'a pas répondu en {timeout}s")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+def import_time(module):
+    """Secondes pour `import module` dans un interpréteur neuf (hors démarrage de Python)"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, text=True)
+    return float(output)
+
+def show_import_profile(module, top=15):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    print(f"\n🐢 Imports les plus lents de {module} (cumulé, ms)")
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"   {cumulative / 1000:8.1f}  {name}")
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix='rescuemap-startup-')
+    failed = False
+    try:
+        print(f"⏱️  Démarrage de {args.server} ({args.runs} lancements, budget {args.budget}s)")
+        imports = [import_time(args.server.removesuffix('.py')) for _ in range(args.runs)]
+        print(f"   import du module       médiane {statistics.median(imports) * 1000:7.1f} ms")
+
+        cold, warm = [], []
+        for run in range(args.runs):
+            db_path = os.path.join(workdir, f'startup-{run}.db')
+            # Base neuve : toutes les migrations sont appliquées
+            cold.append(time_to_first_response(args.server, workdir, db_path))
+            # Base à jour : une seule lecture de la version du schéma
+            warm.append(time_to_first_response(args.server, workdir, db_path))
+
+        for label, samples in (('base neuve', cold), ('base à jour', warm)):
+            median = statistics.median(samples)
+            print(f"   première réponse, {label:<12} médiane {median * 1000:7.1f} ms "
+                  f"(min {min(samples) * 1000:.1f}, max {max(samples) * 1000:.1f})")
+
+        median = statistics.median(warm)
+        if median > args.budget:
+            print(f"❌ Démarrage en {median:.2f}s : budget de {args.budget}s dépassé")
+            failed = True
+        else:
+            print(f"✅ Démarrage dans le budget ({median:.2f}s <= {args.budget}s)")
+
+        if args.importtime:
+            show_import_profile(args.server.removesuffix('.py'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Temps de démarrage des serveurs RescueMap")
+    parser.add_argument('--server', default='server.py', choices=['server.py', 'server_async.py'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.5,
+                        help="Médiane maximale jusqu'à la première réponse, base à jour (secondes)")
+    parser.add_argument('--importtime', action='store_true', help="Afficher les imports les plus lents")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+# changes.py
+"""Journal des modifications par ville, pour la synchronisation des clients
+
+L'interface garde les magasins des villes visitées dans le navigateur
+(IndexedDB) et ne redemande que ce qui a changé depuis sa dernière visite.
+La table `shop_changes` porte, pour chaque couple (magasin, ville), le numéro
+de version de sa dernière modification : des triggers lui donnent un nouveau
+numéro (AUTOINCREMENT, toujours croissant) quand le magasin change, entre
+dans la ville ou en sort (réinitialisation, suppression).
+
+Un client envoie la dernière version reçue (`since`) et reçoit les magasins
+modifiés, les identifiants retirés de la ville et la nouvelle version. Les
+retraits restent dans la table (une ligne par couple) pour les clients qui
+ne se sont pas reconnectés depuis.
+"""
+
+# Modifications renvoyées au plus par réponse (le client redemande la suite)
+PAGE_SIZE = 5000
+
+# Colonnes dont la modification est transmise aux clients : une réécriture
+# à l'identique (rechargement OSM) ne change pas la version
+WATCHED_COLUMNS = ('name', 'lat', 'lon', 'type', 'address', 'status', 'last_verified', 'notes', 'city', 'osm_id')
+
+def setup_changes_schema(cursor):
+    """Crée le journal, ses triggers, et y inscrit les magasins existants"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shop_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            shop_id INTEGER NOT NULL,
+            city TEXT NOT NULL COLLATE NOCASE,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (shop_id, city)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shop_changes_city ON shop_changes (city, version)')
+
+    # Les triggers suppriment puis réinsèrent la ligne du couple (nouvelle
+    # version) : un INSERT OR REPLACE serait transformé en OR IGNORE par une
+    # instruction extérieure INSERT OR IGNORE (politique de conflit héritée)
+    bump_shop = '''
+            DELETE FROM shop_changes
+            WHERE shop_id = NEW.id AND city IN (SELECT city FROM supermarket_cities WHERE shop_id = NEW.id);
+            INSERT INTO shop_changes (shop_id, city, deleted)
+            SELECT NEW.id, city, 0 FROM supermarket_cities WHERE shop_id = NEW.id;
+    '''
+    # Nouveau magasin : chargement, ou magasin inconnu reçu par synchronisation
+    # (sync_manager.apply_row met à jour les magasins connus sur leur uid)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS shop_changes_insert
+        AFTER INSERT ON supermarkets
+        BEGIN {bump_shop} END
+    ''')
+    changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in WATCHED_COLUMNS)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS shop_changes_update
+        AFTER UPDATE ON supermarkets
+        WHEN {changed}
+        BEGIN {bump_shop} END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS shop_changes_join
+        AFTER INSERT ON supermarket_cities
+        BEGIN
+            DELETE FROM shop_changes WHERE shop_id = NEW.shop_id AND city = NEW.city;
+            INSERT INTO shop_changes (shop_id, city, deleted) VALUES (NEW.shop_id, NEW.city, 0);
+        END
+    ''')
+    # Aussi déclenché par la suppression d'un magasin (trigger supermarket_cities_delete)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS shop_changes_leave
+        AFTER DELETE ON supermarket_cities
+        BEGIN
+            DELETE FROM shop_changes WHERE shop_id = OLD.shop_id AND city = OLD.city;
+            INSERT INTO shop_changes (shop_id, city, deleted) VALUES (OLD.shop_id, OLD.city, 1);
+        END
+    ''')
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO shop_changes (shop_id, city, deleted)
+        SELECT shop_id, city, 0 FROM supermarket_cities ORDER BY shop_id
+    ''')
+
+def city_changes(cursor, city_name, since=0, limit=PAGE_SIZE):
+    """Modifications d'une ville postérieures à la version `since`
+
+    Le curseur doit retourner des sqlite3.Row. Retourne un dictionnaire :
+    version (à renvoyer comme `since` la fois suivante), shops (magasins
+    ajoutés ou modifiés), deleted (identifiants retirés de la ville), more
+    (vrai s'il reste des modifications au-delà de `limit`) et reset (vrai si
+    `since` dépasse la dernière version de la base, recréée depuis : le
+    client doit vider son cache, la réponse repart de zéro).
+    """
+    reset = False
+    if since:
+        cursor.execute('SELECT MAX(version) FROM shop_changes')
+        if since > (cursor.fetchone()[0] or 0):
+            since, reset = 0, True
+
+    cursor.execute('''
+        SELECT c.version AS change_version, c.deleted AS change_deleted, c.shop_id AS change_shop_id, s.*
+        FROM shop_changes c
+        LEFT JOIN supermarkets s ON s.id = c.shop_id AND c.deleted = 0
+        WHERE c.city = ? AND c.version > ?
+        ORDER BY c.version
+        LIMIT ?
+    ''', (city_name, since, limit + 1))
+    rows = cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    shops, deleted = [], []
+    for row in rows:
+        if row['change_deleted'] or row['id'] is None:
+            deleted.append(row['change_shop_id'])
+        else:
+            shop = dict(row)
+            for key in ('change_version', 'change_deleted', 'change_shop_id'):
+                del shop[key]
+            shops.append(shop)
+
+    version = rows[-1]['change_version'] if rows else since
+    return {'version': version, 'shops': shops, 'deleted': deleted, 'more': more, 'reset': reset}
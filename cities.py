@@ -0,0 +1,25 @@
+# cities.py
+"""Villes principales connues sans géocodage
+
+Module sans dépendance, partagé par le serveur et les outils hors ligne
+(osm_ingest.py, synthetic.py) qui ne doivent pas charger l'application Flask.
+"""
+
+# Base de données des villes principales (pour les coordonnées par défaut)
+CITIES = {
+    "Paris": {"lat": 48.8566, "lon": 2.3522, "radius": 15},
+    "Toulouse": {"lat": 43.6045, "lon": 1.4440, "radius": 20},
+    "Lyon": {"lat": 45.7640, "lon": 4.8357, "radius": 15},
+    "Marseille": {"lat": 43.2965, "lon": 5.3698, "radius": 20},
+    "Bordeaux": {"lat": 44.8378, "lon": -0.5792, "radius": 15},
+    "Lille": {"lat": 50.6292, "lon": 3.0573, "radius": 10},
+    "Nantes": {"lat": 47.2184, "lon": -1.5536, "radius": 15},
+    "Strasbourg": {"lat": 48.5734, "lon": 7.7521, "radius": 10},
+    "Montpellier": {"lat": 43.6109, "lon": 3.8772, "radius": 10},
+    "Nice": {"lat": 43.7102, "lon": 7.2620, "radius": 10},
+    "Rennes": {"lat": 48.1173, "lon": -1.6778, "radius": 10},
+    "Reims": {"lat": 49.2583, "lon": 4.0317, "radius": 8},
+    "Le Havre": {"lat": 49.4944, "lon": 0.1079, "radius": 8},
+    "Saint-Étienne": {"lat": 45.4397, "lon": 4.3872, "radius": 8},
+    "Toulon": {"lat": 43.1242, "lon": 5.9280, "radius": 8}
+}
@@ -0,0 +1,26 @@
+# database.py
+"""Accès à la base SQLite partagé par le serveur et les outils en ligne de commande"""
+import os
+import sqlite3
+
+import shards
+from metrics import TimedConnection
+
+# Chemin de la base de données (défaut: rescuemap.db)
+DB_PATH = os.environ.get('DB_PATH', 'rescuemap.db')
+
+def get_connection(db_path=None, city=None):
+    """Ouvre une connexion vers la base configurée (ou db_path) ; les requêtes sont chronométrées
+
+    En stockage réparti (RESCUEMAP_SHARD_DIR, voir shards.py), `city` désigne
+    la base de la ville.
+    """
+    if city is not None and shards.enabled():
+        return shards.connection(city)
+    return sqlite3.connect(db_path or DB_PATH, factory=TimedConnection)
+
+def setup_database_schema(db_path=None):
+    """Crée ou met à jour le schéma de la base de données (migrations en attente, voir migrations.py)"""
+    from migrations import migrate
+
+    migrate(db_path or DB_PATH)
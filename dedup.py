@@ -0,0 +1,202 @@
+# dedup.py
+"""Dédoublonnage des magasins entre villes qui se chevauchent
+
+Les villes sont chargées avec des cercles `around:` qui se recouvrent (le
+rayon de 20 km de Toulouse couvre sa banlieue) : un même magasin revenait
+une fois par ville. Chaque magasin n'est plus stocké qu'une fois :
+
+- les éléments OpenStreetMap sont identifiés par leur `osm_id` ;
+- les magasins d'exemple, ou sans identifiant, sont fusionnés avec un
+  magasin existant de même nom à moins de DUPLICATE_DISTANCE_M mètres.
+
+La table `supermarket_cities` porte l'appartenance (plusieurs villes par
+magasin) ; `supermarkets.city` reste la ville d'origine, utilisée par la
+synchronisation. Des triggers ajoutent l'appartenance à la ville d'origine
+quelle que soit l'écriture (chargement OSM, synchronisation...) ; une ville
+n'est retirée d'un magasin que par la réinitialisation de cette ville.
+"""
+import logging
+
+from geo import bounding_box, haversine_many
+from sync_manager import fetch_row, record_row_change
+
+logger = logging.getLogger('rescuemap.dedup')
+
+# Deux magasins de même nom plus proches que cette distance sont le même magasin
+DUPLICATE_DISTANCE_M = 30
+
+def setup_dedup_schema(cursor):
+    """Crée la table d'appartenance et ses triggers
+
+    À la création, l'appartenance est remplie depuis `supermarkets.city` et
+    les doublons existants sont fusionnés. Retourne le nombre de magasins
+    fusionnés (les digests de synchronisation sont alors à recalculer).
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'supermarket_cities'")
+    created = cursor.fetchone() is None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS supermarket_cities (
+            shop_id INTEGER NOT NULL,
+            city TEXT NOT NULL COLLATE NOCASE,
+            PRIMARY KEY (shop_id, city)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_supermarket_cities_city ON supermarket_cities (city)')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarket_cities_insert
+        AFTER INSERT ON supermarkets
+        WHEN NEW.city IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO supermarket_cities (shop_id, city) VALUES (NEW.id, NEW.city);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarket_cities_update
+        AFTER UPDATE OF city ON supermarkets
+        WHEN NEW.city IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO supermarket_cities (shop_id, city) VALUES (NEW.id, NEW.city);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarket_cities_delete
+        AFTER DELETE ON supermarkets
+        BEGIN
+            DELETE FROM supermarket_cities WHERE shop_id = OLD.id;
+        END
+    ''')
+
+    if not created:
+        return 0
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO supermarket_cities (shop_id, city)
+        SELECT id, city FROM supermarkets WHERE city IS NOT NULL
+    ''')
+    # Digests recalculés entièrement après la migration : pas de suivi incrémental
+    # (la colonne uid des lignes synchronisées n'existe pas encore)
+    merged = merge_duplicates(cursor, record_changes=False)
+    if merged:
+        logger.info("%d doublons fusionnés", merged)
+    return merged
+
+def add_membership(cursor, shop_id, city_name):
+    cursor.execute('INSERT OR IGNORE INTO supermarket_cities (shop_id, city) VALUES (?, ?)', (shop_id, city_name))
+
+def find_near_duplicate(cursor, lat, lon, name, exclude_id=None, untagged_only=False):
+    """Identifiant d'un magasin de même nom à moins de DUPLICATE_DISTANCE_M mètres, ou None"""
+    south, north, west, east = bounding_box(lat, lon, DUPLICATE_DISTANCE_M / 1000)
+    cursor.execute(f'''
+        SELECT s.id, s.lat, s.lon FROM supermarkets_rtree r
+        JOIN supermarkets s ON s.id = r.id
+        WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+          AND LOWER(COALESCE(s.name, '')) = LOWER(COALESCE(?, ''))
+          AND s.id IS NOT ?
+          {'AND s.osm_id IS NULL' if untagged_only else ''}
+        ORDER BY s.id
+    ''', (south, north, west, east, name, exclude_id))
+    candidates = cursor.fetchall()
+    if not candidates:
+        return None
+
+    distances = haversine_many(lat, lon, [row[1] for row in candidates], [row[2] for row in candidates])
+    for (shop_id, _, _), distance in zip(candidates, distances):
+        if distance * 1000 <= DUPLICATE_DISTANCE_M:
+            return shop_id
+    return None
+
+def find_or_insert_shop(cursor, city_name, name, lat, lon, shop_type, last_verified, osm_id=None):
+    """Rattache un magasin à une ville en réutilisant l'existant ; retourne (id, créé)"""
+    if osm_id is not None:
+        cursor.execute('SELECT id FROM supermarkets WHERE osm_id = ?', (osm_id,))
+        existing = cursor.fetchone()
+        if existing:
+            add_membership(cursor, existing[0], city_name)
+            return existing[0], False
+
+    # Sans osm_id connu : même nom au même endroit (magasin d'exemple, ou chargé
+    # avant que l'osm_id ne soit enregistré)
+    shop_id = find_near_duplicate(cursor, lat, lon, name, untagged_only=osm_id is not None)
+    if shop_id is not None:
+        if osm_id is not None:
+            old_row = fetch_row(cursor, shop_id)
+            cursor.execute('UPDATE supermarkets SET osm_id = ? WHERE id = ?', (osm_id, shop_id))
+            record_row_change(cursor, old_row, fetch_row(cursor, shop_id))
+        add_membership(cursor, shop_id, city_name)
+        return shop_id, False
+
+    cursor.execute('''
+        INSERT INTO supermarkets (name, lat, lon, type, city, last_verified, osm_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (name, lat, lon, shop_type, city_name, last_verified, osm_id))
+    shop_id = cursor.lastrowid
+    record_row_change(cursor, new_row=fetch_row(cursor, shop_id))
+    return shop_id, True
+
+def merge_shop(cursor, keep_id, duplicate_id, record_changes=True):
+    """Fusionne duplicate_id dans keep_id : villes, historique, osm_id et statut le plus récent
+
+    Avec record_changes=False, les digests de synchronisation ne sont pas mis
+    à jour (l'appelant les recalcule entièrement).
+    """
+    keep_row = fetch_row(cursor, keep_id) if record_changes else None
+    duplicate_row = fetch_row(cursor, duplicate_id) if record_changes else None
+    cursor.execute('SELECT id, status, last_verified, notes FROM supermarkets WHERE id IN (?, ?)',
+                   (keep_id, duplicate_id))
+    columns = {row[0]: dict(zip(('status', 'last_verified', 'notes'), row[1:])) for row in cursor.fetchall()}
+    keep, duplicate = columns[keep_id], columns[duplicate_id]
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO supermarket_cities (shop_id, city)
+        SELECT ?, city FROM supermarket_cities WHERE shop_id = ?
+    ''', (keep_id, duplicate_id))
+    cursor.execute('UPDATE OR IGNORE status_events SET shop_id = ? WHERE shop_id = ?', (keep_id, duplicate_id))
+    cursor.execute('DELETE FROM status_events WHERE shop_id = ?', (duplicate_id,))
+
+    cursor.execute('SELECT osm_id FROM supermarkets WHERE id = ?', (duplicate_id,))
+    osm_id = cursor.fetchone()[0]
+    cursor.execute('DELETE FROM supermarkets WHERE id = ?', (duplicate_id,))
+    if record_changes:
+        record_row_change(cursor, old_row=duplicate_row)
+
+    if osm_id is not None:
+        cursor.execute('UPDATE supermarkets SET osm_id = COALESCE(osm_id, ?) WHERE id = ?', (osm_id, keep_id))
+    if (duplicate['last_verified'] or '') > (keep['last_verified'] or ''):
+        cursor.execute('''
+            UPDATE supermarkets SET status = ?, last_verified = ?, notes = COALESCE(notes, ?)
+            WHERE id = ?
+        ''', (duplicate['status'], duplicate['last_verified'], duplicate['notes'], keep_id))
+    if record_changes:
+        record_row_change(cursor, keep_row, fetch_row(cursor, keep_id))
+
+def merge_duplicates(cursor, record_changes=True):
+    """Fusionne les magasins de même nom au même endroit (le plus ancien id est conservé)
+
+    Deux nœuds OSM distincts ne sont jamais fusionnés : au moins un des deux
+    magasins doit être sans osm_id.
+    """
+    cursor.execute('''
+        SELECT id, lat, lon, name, osm_id FROM supermarkets
+        WHERE lat IS NOT NULL AND lon IS NOT NULL ORDER BY id
+    ''')
+    shops = cursor.fetchall()
+
+    merged = 0
+    removed = set()
+    for shop_id, lat, lon, name, osm_id in shops:
+        if shop_id in removed:
+            continue
+        while True:
+            duplicate_id = find_near_duplicate(cursor, lat, lon, name, exclude_id=shop_id,
+                                               untagged_only=osm_id is not None)
+            if duplicate_id is None:
+                break
+            keep_id, duplicate_id = min(shop_id, duplicate_id), max(shop_id, duplicate_id)
+            merge_shop(cursor, keep_id, duplicate_id, record_changes)
+            removed.add(duplicate_id)
+            merged += 1
+            if duplicate_id == shop_id:
+                break
+    return merged
@@ -0,0 +1,177 @@
+# export.py
+"""Export en flux des magasins (NDJSON ou GeoJSON)
+
+Pour les grandes régions et les échanges de données avec d'autres équipes de
+secours : les magasins sont lus par lots successifs (pagination par clé,
+BATCH_SIZE lignes par requête) et écrits par morceaux d'environ
+CHUNK_BYTES. La mémoire reste la même quelle que soit la taille de l'export
+et les premiers octets partent tout de suite.
+
+Entre deux lots, aucun verrou de lecture n'est gardé : un client lent ne
+bloque pas les écritures (statuts). En contrepartie, l'export n'est pas un
+instantané : un magasin modifié pendant l'export peut apparaître dans son
+ancien ou son nouvel état.
+
+    python export.py geojson --city Toulouse --output toulouse.geojson
+    python export.py ndjson --bbox -5,41,10,51 --status looted,danger > pilles.ndjson
+"""
+import json
+import sqlite3
+import sys
+
+import shards
+from database import DB_PATH
+from metrics import TimedConnection
+
+BATCH_SIZE = 2000
+CHUNK_BYTES = 64 * 1024
+
+def open_connection(path):
+    """Connexion dédiée à l'export
+
+    Utilisable successivement depuis plusieurs threads : le serveur
+    asynchrone lit chaque morceau dans un thread du pool.
+    """
+    conn = sqlite3.connect(path, factory=TimedConnection, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def export_paths(city=None):
+    """Bases à parcourir : la base unique, le shard de la ville, ou tous les shards"""
+    if not shards.enabled():
+        return [DB_PATH]
+    if city:
+        return [shards.get_router().shard_path(city)] if shards.has_city(city) else []
+    return shards.get_router().shard_paths()
+
+def iter_shops(conn, city=None, bbox=None, statuses=None, batch_size=BATCH_SIZE):
+    """Magasins filtrés par ville, boîte (sud, nord, ouest, est) et statuts, lot par lot
+
+    Avec une ville, les lots suivent l'index des appartenances ; sans ville,
+    la clé primaire des magasins.
+    """
+    if city:
+        key = 'c.rowid'
+        source = 'supermarket_cities c JOIN supermarkets s ON s.id = c.shop_id'
+        conditions, params = ['c.city = ?'], [city]
+    else:
+        key = 's.id'
+        source = 'supermarkets s'
+        conditions, params = [], []
+    if bbox is not None:
+        south, north, west, east = bbox
+        conditions.append('s.lat BETWEEN ? AND ? AND s.lon BETWEEN ? AND ?')
+        params += [south, north, west, east]
+    if statuses:
+        conditions.append(f"s.status IN ({', '.join('?' * len(statuses))})")
+        params += statuses
+
+    query = f'''
+        SELECT {key} AS export_key, s.* FROM {source}
+        WHERE {' AND '.join(conditions + [f'{key} > ?'])}
+        ORDER BY {key}
+        LIMIT ?
+    '''
+    last = -1
+    while True:
+        cursor = conn.cursor()
+        cursor.execute(query, params + [last, batch_size])
+        rows = cursor.fetchall()
+        for row in rows:
+            shop = dict(row)
+            last = shop.pop('export_key')
+            yield shop
+        if len(rows) < batch_size:
+            return
+
+def ndjson_parts(shops):
+    for shop in shops:
+        yield json.dumps(shop, ensure_ascii=False) + '\n'
+
+def shop_feature(shop):
+    properties = {key: value for key, value in shop.items() if key not in ('lat', 'lon')}
+    geometry = None
+    if shop.get('lat') is not None and shop.get('lon') is not None:
+        geometry = {'type': 'Point', 'coordinates': [shop['lon'], shop['lat']]}
+    return {'type': 'Feature', 'id': shop['id'], 'geometry': geometry, 'properties': properties}
+
+def geojson_parts(shops):
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = '\n'
+    for shop in shops:
+        yield separator + json.dumps(shop_feature(shop), ensure_ascii=False)
+        separator = ',\n'
+    yield '\n]}\n'
+
+# format -> (morceaux de texte, type MIME, extension)
+FORMATS = {
+    'ndjson': (ndjson_parts, 'application/x-ndjson', 'ndjson'),
+    'geojson': (geojson_parts, 'application/geo+json', 'geojson'),
+}
+
+def chunked(parts, size=CHUNK_BYTES):
+    """Regroupe des morceaux de texte en blocs d'environ `size` octets"""
+    buffer, length = [], 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(buffer).encode()
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+def filtered_shops(city=None, bbox=None, statuses=None):
+    """Magasins de toutes les bases concernées ; chaque connexion est fermée après usage
+
+    En stockage réparti sans ville, les shards sont parcourus l'un après
+    l'autre : un magasin de deux villes voisines apparaît une fois par shard.
+    """
+    for path in export_paths(city):
+        conn = open_connection(path)
+        try:
+            yield from iter_shops(conn, city, bbox, statuses)
+        finally:
+            conn.close()
+
+def export_chunks(format_name, city=None, bbox=None, statuses=None):
+    """Blocs (bytes) de l'export ; à l'abandon du flux (client déconnecté), la connexion est fermée"""
+    parts, _, _ = FORMATS[format_name]
+    return chunked(parts(filtered_shops(city, bbox, statuses)))
+
+def export_filename(format_name, city=None):
+    _, _, extension = FORMATS[format_name]
+    return f"rescuemap-{shards.shard_key(city) if city else 'export'}.{extension}"
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from search import parse_bbox
+
+    parser = argparse.ArgumentParser(description="Export en flux des magasins")
+    parser.add_argument('format', choices=sorted(FORMATS))
+    parser.add_argument('--city', help="Ville (appartenance, comme /api/supermarkets)")
+    parser.add_argument('--bbox', help="Boîte ouest,sud,est,nord")
+    parser.add_argument('--status', default='', help="Statuts séparés par des virgules")
+    parser.add_argument('--output', '-o', help="Fichier de sortie (défaut: sortie standard)")
+    args = parser.parse_args()
+
+    bbox = parse_bbox(args.bbox) if args.bbox else None
+    statuses = [status for status in args.status.split(',') if status]
+
+    start = time.perf_counter()
+    written = 0
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(args.format, args.city, bbox, statuses):
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+    # Messages sur stderr : la sortie standard peut porter l'export
+    print(f"✅ {written / 1e6:.1f} Mo exportés en {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    if args.output:
+        print(f"📁 {args.output}", file=sys.stderr)
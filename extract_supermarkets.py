@@ -1,5 +1,5 @@
 # extract_supermarkets.py
-import requests
+import upstream
 import sqlite3
 import json
 import random
@@ -72,8 +72,8 @@ def download_supermarkets(city_name):
     
     try:
         print(f"📡 Téléchargement des supermarchés à {city_name}...")
-        response = requests.post(
-            "https://overpass-api.de/api/interpreter",
+        response = upstream.post(
+            upstream.OVERPASS_URL,
             data=overpass_query,
             headers={'Content-Type': 'application/x-www-form-urlencoded'},
             timeout=30
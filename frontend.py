@@ -0,0 +1,165 @@
+# frontend.py
+"""Construction et service de l'interface web
+
+Les sources sont dans frontend/ (index.html, app.css, markers.js, app.js). La
+construction copie les feuilles de style et scripts dans frontend/dist sous
+un nom contenant leur empreinte (app.3f2a9c1e.js), précompressés en gzip, et
+réécrit les références `{{ app.js }}` de index.html et du service worker
+(sw.js, `{{ version }}` y devient l'empreinte des sources). Les fichiers
+empreintés ne changent jamais de contenu : ils sont servis avec un cache d'un
+an ; seuls la page et le service worker sont revalidés (ETag) à chaque visite.
+
+La construction est relancée automatiquement quand les sources changent
+(empreinte des sources dans dist/manifest.json), ou à la main :
+
+    python frontend.py build
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend')
+DIST_DIR = os.path.join(SOURCE_DIR, 'dist')
+
+# Fichiers empreintés, référencés par {{ nom }} dans index.html
+HASHED_ASSETS = ('app.css', 'markers.js', 'app.js')
+PAGE = 'index.html'
+# Servi à la racine (/sw.js) : la portée d'un service worker est son dossier
+SERVICE_WORKER = 'sw.js'
+# Fichiers réécrits mais non empreintés
+TEMPLATES = (PAGE, SERVICE_WORKER)
+
+# Préfixe d'URL des fichiers empreintés
+ASSET_URL = '/assets/'
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+}
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+PAGE_CACHE = 'no-cache'
+
+_assets = None
+_lock = threading.Lock()
+
+def _read_source(name):
+    with open(os.path.join(SOURCE_DIR, name), 'rb') as f:
+        return f.read()
+
+def source_hash():
+    digest = hashlib.sha256()
+    for name in TEMPLATES + HASHED_ASSETS:
+        digest.update(name.encode('utf-8') + b'\0' + _read_source(name))
+    return digest.hexdigest()
+
+def hashed_name(name, content):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+def _write(dist_dir, name, content):
+    with open(os.path.join(dist_dir, name), 'wb') as f:
+        f.write(content)
+    # mtime=0 : archive identique d'une construction à l'autre
+    with open(os.path.join(dist_dir, name + '.gz'), 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+def build(dist_dir=DIST_DIR):
+    """Construit dist/ ; retourne le manifeste (empreinte des sources et noms empreintés)"""
+    os.makedirs(dist_dir, exist_ok=True)
+    files = {}
+    for name in HASHED_ASSETS:
+        content = _read_source(name)
+        files[name] = hashed_name(name, content)
+        _write(dist_dir, files[name], content)
+
+    digest = source_hash()
+    values = {name: ASSET_URL + hashed for name, hashed in files.items()}
+    values['version'] = digest[:10]
+    for name in TEMPLATES:
+        content = _read_source(name).decode('utf-8')
+        content = re.sub(r'\{\{\s*([\w.]+)\s*\}\}', lambda m: values[m.group(1)], content)
+        _write(dist_dir, name, content.encode('utf-8'))
+
+    manifest = {'source_hash': digest, 'files': files}
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Anciennes versions des fichiers empreintés
+    keep = set(files.values()) | set(TEMPLATES) | {'manifest.json'}
+    for name in os.listdir(dist_dir):
+        if name.removesuffix('.gz') not in keep:
+            os.remove(os.path.join(dist_dir, name))
+    return manifest
+
+def _load_manifest(dist_dir):
+    try:
+        with open(os.path.join(dist_dir, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class Asset:
+    def __init__(self, name, body, gzip_body, cache_control):
+        self.body = body
+        self.gzip_body = gzip_body
+        self.content_type = CONTENT_TYPES[os.path.splitext(name)[1]]
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+def load_assets(dist_dir=DIST_DIR):
+    """Fichiers servis, chargés en mémoire une fois (reconstruits si les sources ont changé)"""
+    global _assets
+    with _lock:
+        if _assets is None:
+            manifest = _load_manifest(dist_dir)
+            if manifest is None or manifest['source_hash'] != source_hash():
+                manifest = build(dist_dir)
+
+            assets = {}
+            for name in list(TEMPLATES) + list(manifest['files'].values()):
+                with open(os.path.join(dist_dir, name), 'rb') as f:
+                    body = f.read()
+                with open(os.path.join(dist_dir, name + '.gz'), 'rb') as f:
+                    gzip_body = f.read()
+                assets[name] = Asset(name, body, gzip_body, PAGE_CACHE if name in TEMPLATES else IMMUTABLE_CACHE)
+            _assets = assets
+        return _assets
+
+def _accepts_gzip(accept_encoding):
+    return any(part.split(';')[0].strip() == 'gzip' for part in (accept_encoding or '').split(','))
+
+def asset_response(name, accept_encoding=None, if_none_match=None):
+    """(statut, corps, en-têtes) pour un fichier servi, ou None s'il n'existe pas"""
+    asset = load_assets().get(name)
+    if asset is None:
+        return None
+
+    headers = {
+        'Content-Type': asset.content_type,
+        'Cache-Control': asset.cache_control,
+        'ETag': asset.etag,
+        'Vary': 'Accept-Encoding',
+    }
+    if if_none_match and asset.etag in if_none_match:
+        return 304, b'', headers
+    if _accepts_gzip(accept_encoding):
+        headers['Content-Encoding'] = 'gzip'
+        return 200, asset.gzip_body, headers
+    return 200, asset.body, headers
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Construction de l'interface web")
+    parser.add_argument('command', choices=['build'])
+    parser.parse_args()
+
+    manifest = build()
+    for name, hashed in manifest['files'].items():
+        print(f"📦 {name} -> {ASSET_URL}{hashed}")
+    print(f"✅ Interface construite dans {DIST_DIR}")
@@ -0,0 +1,564 @@
+let map;
+let userMarker;
+let currentCity = "Toulouse";
+let shopLayer;
+let lastChatMessages = [];
+let pendingChat = [];
+
+// Villes suggestions
+const CITY_SUGGESTIONS = [
+    "Paris", "Toulouse", "Lyon", "Marseille", "Bordeaux", "Lille", "Nantes", 
+    "Strasbourg", "Montpellier", "Nice", "Rennes", "Reims", "Le Havre", 
+    "Saint-Étienne", "Toulon", "Grenoble", "Angers", "Dijon", "Brest", 
+    "Le Mans", "Amiens", "Tours", "Limoges", "Clermont-Ferrand", "Villeurbanne",
+    "Besançon", "Orléans", "Metz", "Rouen", "Mulhouse", "Perpignan", "Caen"
+];
+
+function initMap() {
+    map = L.map('map').setView([43.6045, 1.4440], 13);
+
+    // crossOrigin : tuiles mises en cache par le service worker sans réponse opaque
+    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+        attribution: '© OpenStreetMap contributors',
+        crossOrigin: true
+    }).addTo(map);
+
+    shopLayer = createShopLayer(map);
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js')
+            .catch(error => console.warn('Service worker non installé:', error));
+    }
+
+    setupCityInput();
+    setupShopSearch();
+    loadSupermarkets();
+    loadChatMessages();
+    subscribeChat();
+
+    // Retour du réseau : envoi des actions en attente, puis mise à jour
+    window.addEventListener('online', () => {
+        flushOutbox().then(sent => {
+            if (sent) {
+                loadSupermarkets();
+                loadChatMessages();
+            }
+        });
+    });
+}
+
+function setupCityInput() {
+    const input = document.getElementById('cityInput');
+    const suggestions = document.getElementById('suggestions');
+
+    input.addEventListener('input', function() {
+        const value = this.value.toLowerCase();
+        if (value.length < 2) {
+            suggestions.style.display = 'none';
+            return;
+        }
+
+        const matches = CITY_SUGGESTIONS.filter(city => 
+            city.toLowerCase().includes(value)
+        ).slice(0, 5);
+
+        if (matches.length > 0) {
+            suggestions.innerHTML = matches.map(city => 
+                `<div class="suggestion-item" onclick="selectCity('${city}')">${city}</div>`
+            ).join('');
+            suggestions.style.display = 'block';
+        } else {
+            suggestions.style.display = 'none';
+        }
+    });
+
+    input.addEventListener('keypress', function(e) {
+        if (e.key === 'Enter') {
+            suggestions.style.display = 'none';
+            loadCity();
+        }
+    });
+
+    // Cacher les suggestions quand on clique ailleurs
+    document.addEventListener('click', function(e) {
+        if (!input.contains(e.target) && !suggestions.contains(e.target)) {
+            suggestions.style.display = 'none';
+        }
+    });
+}
+
+function setupShopSearch() {
+    const input = document.getElementById('shopSearch');
+    const results = document.getElementById('searchResults');
+    let timer = null;
+    let lastShops = [];
+
+    // Recherche pendant la saisie, une requête au plus toutes les 250 ms
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const query = this.value.trim();
+        if (query.length < 2) {
+            results.style.display = 'none';
+            return;
+        }
+
+        timer = setTimeout(() => {
+            fetch(`/api/search?q=${encodeURIComponent(query)}&city=${encodeURIComponent(currentCity)}&limit=8`)
+                .then(response => response.json())
+                .then(data => {
+                    // Réponse d'une saisie déjà dépassée
+                    if (input.value.trim() !== query) return;
+                    lastShops = data.success ? data.shops : [];
+                    if (lastShops.length === 0) {
+                        results.innerHTML = '<div class="suggestion-item">Aucun résultat</div>';
+                    } else {
+                        results.innerHTML = lastShops.map((shop, index) =>
+                            `<div class="suggestion-item" data-index="${index}">
+                                <strong>${escapeHtml(shop.name || 'Sans nom')}</strong><br/>
+                                <small>${escapeHtml(shop.address || shop.type || '')}</small>
+                            </div>`
+                        ).join('');
+                    }
+                    results.style.display = 'block';
+                })
+                .catch(error => console.error('Search error:', error));
+        }, 250);
+    });
+
+    results.addEventListener('click', function(e) {
+        const item = e.target.closest('[data-index]');
+        if (!item) return;
+        const shop = lastShops[item.dataset.index];
+        results.style.display = 'none';
+        map.setView([shop.lat, shop.lon], 17);
+        const marker = shopLayer.markers.get(shop.id);
+        if (marker) marker.openPopup();
+    });
+
+    document.addEventListener('click', function(e) {
+        if (!input.contains(e.target) && !results.contains(e.target)) {
+            results.style.display = 'none';
+        }
+    });
+}
+
+function selectCity(cityName) {
+    document.getElementById('cityInput').value = cityName;
+    document.getElementById('suggestions').style.display = 'none';
+    loadCity();
+}
+
+async function loadCity() {
+    const cityInput = document.getElementById('cityInput').value.trim();
+    if (!cityInput) {
+        alert('Veuillez entrer un nom de ville');
+        return;
+    }
+
+    currentCity = cityInput;
+    document.getElementById('currentCity').textContent = currentCity;
+    document.getElementById('loadStatus').innerHTML = '<div class="loading"></div> Chargement de ' + currentCity + '...';
+
+    try {
+        const response = await fetch('/api/load_city?city=' + encodeURIComponent(currentCity));
+        const result = await response.json();
+
+        if (result.success) {
+            document.getElementById('loadStatus').textContent = `✅ ${result.count} supermarchés trouvés`;
+
+            // Centrer la carte sur la nouvelle ville
+            if (result.coordinates) {
+                map.setView([result.coordinates.lat, result.coordinates.lon], 13);
+            }
+
+            loadSupermarkets();
+        } else {
+            document.getElementById('loadStatus').textContent = '❌ Erreur: ' + result.error;
+        }
+    } catch (error) {
+        console.error('Error:', error);
+
+        // Hors ligne : une ville déjà visitée reste consultable depuis le cache
+        const cached = await loadCachedCity(currentCity);
+        if (cached && cached.shops.length > 0) {
+            map.fitBounds(L.latLngBounds(cached.shops.map(shop => [shop.lat, shop.lon])));
+            loadSupermarkets();
+            return;
+        }
+        document.getElementById('loadStatus').textContent = '❌ Erreur de connexion';
+    }
+}
+
+function locateMe() {
+    if (navigator.geolocation) {
+        document.getElementById('loadStatus').textContent = '📍 Localisation en cours...';
+
+        navigator.geolocation.getCurrentPosition(
+            (position) => {
+                const lat = position.coords.latitude;
+                const lng = position.coords.longitude;
+
+                if (userMarker) map.removeLayer(userMarker);
+
+                userMarker = L.marker([lat, lng], {
+                    icon: L.divIcon({
+                        className: 'user-marker',
+                        html: '📍',
+                        iconSize: [30, 30]
+                    })
+                }).addTo(map).bindPopup('🦸 Votre position').openPopup();
+
+                map.setView([lat, lng], 15);
+
+                document.getElementById('loadStatus').textContent = '✅ Position trouvée';
+                showNearestSafe(lat, lng);
+            },
+            (error) => {
+                document.getElementById('loadStatus').textContent = '❌ Géolocalisation impossible';
+            }
+        );
+    } else {
+        alert('Géolocalisation non supportée par votre navigateur');
+    }
+}
+
+async function showNearestSafe(lat, lng) {
+    try {
+        const response = await fetch(`/api/nearest?lat=${lat}&lon=${lng}&k=3&status=safe`);
+        const result = await response.json();
+
+        if (!result.success || result.count === 0) {
+            userMarker.bindPopup('🦸 Votre position<br>Aucun magasin sûr à proximité').openPopup();
+            return;
+        }
+
+        const list = result.shops.map(shop =>
+            `✅ ${escapeHtml(shop.name || 'Sans nom')} (${escapeHtml(shop.city || '')}) - ${shop.distance_km.toFixed(1)} km`
+        ).join('<br>');
+        userMarker.bindPopup(`🦸 Votre position<br><strong>Magasins sûrs les plus proches:</strong><br>${list}`).openPopup();
+
+        const nearest = result.shops[0];
+        map.fitBounds([[lat, lng], [nearest.lat, nearest.lon]], {padding: [50, 50], maxZoom: 15});
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+// Seuls les magasins ajoutés, retirés ou modifiés touchent la carte (markers.js)
+function renderShops(shops) {
+    document.getElementById('count').textContent = shops.length;
+    renderShopLayer(shopLayer, shops);
+}
+
+async function loadSupermarkets() {
+    const city = currentCity;
+    const loadStatus = document.getElementById('loadStatus');
+
+    // Affichage immédiat depuis le cache du navigateur, puis mise à jour
+    const cached = await loadCachedCity(city);
+    if (cached) {
+        renderShops(cached.shops);
+        loadStatus.textContent = `💾 ${cached.shops.length} supermarchés (cache)`;
+    } else {
+        loadStatus.textContent = '🔄 Chargement des supermarchés...';
+    }
+
+    try {
+        // Les actions hors ligne d'abord : la synchronisation les inclut ensuite
+        await flushOutbox();
+        const { record, changed } = await syncCity(city, cached);
+        if (city !== currentCity) return;
+
+        if (changed || !cached) {
+            renderShops(record.shops);
+        }
+        loadStatus.textContent = `✅ ${record.shops.length} supermarchés chargés`;
+    } catch (error) {
+        console.error('Error:', error);
+        if (city !== currentCity) return;
+        loadStatus.textContent = cached
+            ? `📴 Hors ligne : données du ${new Date(cached.syncedAt).toLocaleString()}`
+            : '❌ Erreur de chargement';
+    }
+}
+
+function refreshSupermarkets() {
+    loadSupermarkets();
+}
+
+async function updateStatus(shopId, status) {
+    // Appliqué tout de suite sur la carte et dans le cache, envoyé dès que le réseau le permet
+    await queueOperation({type: 'status', id: shopId, status: status, city: currentCity});
+    const record = await updateCachedShop(currentCity, shopId, {status: status, last_verified: new Date().toISOString()});
+    if (record) {
+        renderShops(record.shops);
+    }
+
+    document.getElementById('loadStatus').textContent = '🔄 Mise à jour du statut...';
+    if (await flushOutbox()) {
+        document.getElementById('loadStatus').textContent = '✅ Statut mis à jour!';
+        setTimeout(loadSupermarkets, 1000);
+    } else {
+        document.getElementById('loadStatus').textContent = '📴 Hors ligne : statut envoyé au retour du réseau';
+    }
+}
+
+async function resetCity() {
+    if (!confirm(`Voulez-vous vraiment réinitialiser tous les supermarchés de ${currentCity} ?`)) {
+        return;
+    }
+
+    document.getElementById('loadStatus').innerHTML = '<div class="loading"></div> Réinitialisation...';
+
+    try {
+        const response = await fetch('/api/reset_city?city=' + encodeURIComponent(currentCity));
+        const result = await response.json();
+
+        if (result.success) {
+            document.getElementById('loadStatus').textContent = '✅ Ville réinitialisée';
+            setTimeout(loadSupermarkets, 1000);
+        } else {
+            document.getElementById('loadStatus').textContent = '❌ Erreur de réinitialisation';
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        document.getElementById('loadStatus').textContent = '❌ Erreur réseau';
+    }
+}
+
+// ===== CACHE HORS LIGNE (IndexedDB) =====
+
+// cities : magasins des villes visitées et dernière version reçue
+// outbox : actions faites hors ligne, envoyées en un lot (/api/batch)
+const DB_NAME = 'rescuemap';
+const DB_VERSION = 1;
+const BATCH_SIZE = 500;
+
+let dbPromise = null;
+let flushing = null;
+
+function openDb() {
+    if (!dbPromise) {
+        dbPromise = new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                db.createObjectStore('cities', {keyPath: 'key'});
+                db.createObjectStore('outbox', {keyPath: 'seq', autoIncrement: true});
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+    return dbPromise;
+}
+
+// Une requête sur un store, résolue à la fin de la transaction
+async function dbRequest(storeName, mode, action) {
+    const db = await openDb();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(storeName, mode);
+        const request = action(transaction.objectStore(storeName));
+        transaction.oncomplete = () => resolve(request.result);
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
+
+function cityKey(city) {
+    return city.trim().toLowerCase();
+}
+
+// Navigation privée ou navigateur sans IndexedDB : pas de cache, tout passe par le réseau
+async function loadCachedCity(city) {
+    try {
+        return await dbRequest('cities', 'readonly', store => store.get(cityKey(city))) || null;
+    } catch (error) {
+        console.warn('Cache indisponible:', error);
+        return null;
+    }
+}
+
+async function saveCachedCity(record) {
+    try {
+        await dbRequest('cities', 'readwrite', store => store.put(record));
+    } catch (error) {
+        console.warn('Cache indisponible:', error);
+    }
+}
+
+async function updateCachedShop(city, shopId, fields) {
+    const record = await loadCachedCity(city);
+    const shop = record && record.shops.find(s => s.id === shopId);
+    if (!shop) return null;
+    Object.assign(shop, fields);
+    await saveCachedCity(record);
+    return record;
+}
+
+// Télécharge les modifications de la ville depuis la dernière version reçue
+async function syncCity(city, cached) {
+    const record = cached || {key: cityKey(city), city: city, version: 0, shops: []};
+    const shops = new Map(record.shops.map(shop => [shop.id, shop]));
+    let changed = false;
+    let more = true;
+
+    while (more) {
+        const response = await fetch(`/api/changes?city=${encodeURIComponent(city)}&since=${record.version}`);
+        const data = await response.json();
+        if (!data.success) throw new Error(data.error);
+
+        // Base du serveur recréée : la version du cache n'a plus de sens
+        if (data.reset) {
+            shops.clear();
+            changed = true;
+        }
+        data.shops.forEach(shop => shops.set(shop.id, shop));
+        data.deleted.forEach(id => shops.delete(id));
+        changed = changed || data.shops.length > 0 || data.deleted.length > 0;
+        record.version = data.version;
+        more = data.more;
+    }
+
+    record.shops = Array.from(shops.values());
+    record.syncedAt = Date.now();
+    await saveCachedCity(record);
+    return { record, changed };
+}
+
+function newClientId() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+async function queueOperation(operation) {
+    try {
+        await dbRequest('outbox', 'readwrite', store => store.add({operation: operation, queuedAt: Date.now()}));
+    } catch (error) {
+        // Sans IndexedDB, l'action est envoyée directement (et perdue hors ligne)
+        console.warn('File d\'attente indisponible:', error);
+        await postBatch([{...operation, age: 0}]).catch(() => null);
+    }
+    await refreshPendingChat();
+}
+
+async function refreshPendingChat() {
+    try {
+        const queued = await dbRequest('outbox', 'readonly', store => store.getAll());
+        pendingChat = queued.map(item => item.operation).filter(operation => operation.type === 'chat');
+    } catch (error) {
+        pendingChat = [];
+    }
+}
+
+async function postBatch(operations) {
+    const response = await fetch('/api/batch', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({operations: operations})
+    });
+    const data = await response.json();
+    if (!data.success) throw new Error(data.error);
+    return data.results;
+}
+
+// Envoie les actions en attente par lots ; vrai si la file est vide ensuite
+function flushOutbox() {
+    if (!flushing) {
+        flushing = sendOutbox().finally(() => { flushing = null; });
+    }
+    return flushing;
+}
+
+async function sendOutbox() {
+    try {
+        for (;;) {
+            const pending = await dbRequest('outbox', 'readonly', store => store.getAll(null, BATCH_SIZE));
+            if (pending.length === 0) return true;
+
+            // age plutôt qu'une heure : l'horloge du téléphone peut être fausse
+            const now = Date.now();
+            await postBatch(pending.map(item => ({...item.operation, age: (now - item.queuedAt) / 1000})));
+
+            // Une action refusée (message vide...) ne passerait pas davantage plus tard
+            const range = IDBKeyRange.bound(pending[0].seq, pending[pending.length - 1].seq);
+            await dbRequest('outbox', 'readwrite', store => store.delete(range));
+        }
+    } catch (error) {
+        console.warn('Actions gardées en attente:', error);
+        return false;
+    } finally {
+        await refreshPendingChat();
+    }
+}
+
+// ===== FONCTIONS CHAT =====
+
+function loadChatMessages() {
+    fetch('/api/chat/messages')
+        .then(response => response.json())
+        .then(messages => {
+            displayChatMessages(messages);
+        })
+        .catch(error => console.error('Erreur chargement chat:', error));
+}
+
+function subscribeChat() {
+    // Flux temps réel (mode asynchrone uniquement) ; sinon le rafraîchissement périodique suffit
+    if (!window.EventSource) return;
+    const source = new EventSource('/api/chat/stream');
+    source.onmessage = (event) => displayChatMessages(JSON.parse(event.data));
+    source.onerror = () => source.close();
+}
+
+function displayChatMessages(messages) {
+    lastChatMessages = messages;
+    const chatMessages = document.getElementById('chatMessages');
+    chatMessages.innerHTML = messages.map(msg => `
+        <div class="message">
+            <strong>${msg.user || 'Utilisateur'}:</strong> ${msg.message}
+            <div class="message-time">${new Date(msg.timestamp).toLocaleString()}</div>
+        </div>
+    `).join('') + pendingChat.map(msg => `
+        <div class="message pending">
+            <strong>${escapeHtml(msg.user)}:</strong> ${escapeHtml(msg.message)}
+            <div class="message-time">⏳ En attente du réseau</div>
+        </div>
+    `).join('');
+
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+function handleChatKeyPress(event) {
+    if (event.key === 'Enter') {
+        sendMessage();
+    }
+}
+
+async function sendMessage() {
+    const input = document.getElementById('chatInput');
+    const message = input.value.trim();
+
+    if (!message) return;
+
+    // client_id : le serveur ignore un message rejoué après une coupure
+    await queueOperation({
+        type: 'chat',
+        message: message,
+        user: 'Utilisateur',
+        city: currentCity,
+        client_id: newClientId()
+    });
+    input.value = '';
+
+    if (await flushOutbox()) {
+        loadChatMessages();
+    } else {
+        displayChatMessages(lastChatMessages);
+    }
+}
+
+// Initialisation
+document.addEventListener('DOMContentLoaded', initMap);
+
+// Auto-refresh chat toutes les 30 secondes
+setInterval(loadChatMessages, 30000);
@@ -0,0 +1,117 @@
+// Couche des magasins sur la carte
+//
+// Tous les magasins sont dessinés sur un même canvas (un seul élément DOM,
+// au lieu d'un nœud SVG par magasin) et gardés par identifiant : un
+// rafraîchissement ne touche que les magasins ajoutés, retirés, déplacés ou
+// dont le statut a changé. Le contenu des popups n'est construit qu'à leur
+// ouverture.
+//
+// Chargé avant app.js ; mesuré par benchmarks/render_markers.html.
+
+const STATUS_STYLES = {
+    safe: { color: '#28a745', emoji: '✅' },
+    danger: { color: '#dc3545', emoji: '⚠️' },
+    looted: { color: '#fd7e14', emoji: '🏚️' },
+    unknown: { color: '#6c757d', emoji: '❓' }
+};
+
+function escapeHtml(text) {
+    return String(text ?? '').replace(/[&<>"']/g, c => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[c]);
+}
+
+function statusStyle(status) {
+    return STATUS_STYLES[status] || STATUS_STYLES.unknown;
+}
+
+function createShopLayer(map) {
+    return {
+        renderer: L.canvas({ padding: 0.5 }),
+        group: L.layerGroup().addTo(map),
+        markers: new Map()
+    };
+}
+
+function shopPopup(shop) {
+    const status = shop.status || 'unknown';
+    return `
+        <div style="min-width: 250px;">
+            <strong>${statusStyle(status).emoji} ${escapeHtml(shop.name)}</strong><br/>
+            <em>Type: ${escapeHtml(shop.type || 'inconnu')} | Ville: ${escapeHtml(shop.city || 'inconnue')}</em><br/>
+            Statut: <span class="status-${escapeHtml(status)}">${escapeHtml(status)}</span><br/>
+            ${shop.last_verified ? '<small>Dernière vérif: ' + new Date(shop.last_verified).toLocaleString() + '</small><br/>' : ''}
+            <div style="margin-top: 12px; text-align: center; display: flex; gap: 6px; justify-content: center; flex-wrap: wrap;">
+                <button onclick="updateStatus(${shop.id}, 'safe')" style="background: #28a745; font-size: 12px;">✅ Sûr</button>
+                <button onclick="updateStatus(${shop.id}, 'danger')" style="background: #dc3545; font-size: 12px;">⚠️ Danger</button>
+                <button onclick="updateStatus(${shop.id}, 'looted')" style="background: #fd7e14; font-size: 12px;">🏚️ Pillé</button>
+                <button onclick="updateStatus(${shop.id}, 'unknown')" style="background: #6c757d; font-size: 12px;">❓ Reset</button>
+            </div>
+        </div>
+    `;
+}
+
+function createShopMarker(layer, shop) {
+    const marker = L.circleMarker([shop.lat, shop.lon], {
+        renderer: layer.renderer,
+        radius: 10,
+        fillColor: statusStyle(shop.status).color,
+        color: '#000',
+        weight: 2,
+        fillOpacity: 0.8
+    });
+    marker.shop = shop;
+    // Fonction : Leaflet ne construit le contenu qu'à l'ouverture
+    marker.bindPopup(() => shopPopup(marker.shop));
+    return marker;
+}
+
+// Met la couche à jour ; retourne le nombre de magasins ajoutés, modifiés et retirés
+function renderShopLayer(layer, shops) {
+    const counts = { added: 0, updated: 0, removed: 0 };
+    const seen = new Set();
+
+    shops.forEach(shop => {
+        seen.add(shop.id);
+        const marker = layer.markers.get(shop.id);
+        if (!marker) {
+            const created = createShopMarker(layer, shop);
+            layer.markers.set(shop.id, created);
+            layer.group.addLayer(created);
+            counts.added++;
+            return;
+        }
+
+        const previous = marker.shop;
+        marker.shop = shop;
+        let changed = false;
+        if (previous.lat !== shop.lat || previous.lon !== shop.lon) {
+            marker.setLatLng([shop.lat, shop.lon]);
+            changed = true;
+        }
+        if (previous.status !== shop.status) {
+            marker.setStyle({ fillColor: statusStyle(shop.status).color });
+            changed = true;
+        }
+        if (changed || previous.name !== shop.name || previous.last_verified !== shop.last_verified) {
+            if (marker.isPopupOpen()) {
+                marker.getPopup().update();
+            }
+            counts.updated++;
+        }
+    });
+
+    for (const [id, marker] of layer.markers) {
+        if (!seen.has(id)) {
+            layer.group.removeLayer(marker);
+            layer.markers.delete(id);
+            counts.removed++;
+        }
+    }
+    return counts;
+}
+
+function clearShopLayer(layer) {
+    layer.group.clearLayers();
+    layer.markers.clear();
+}
@@ -0,0 +1,95 @@
+// Service worker RescueMap : l'application reste utilisable sans réseau
+//
+// - coquille (page, CSS, JS, Leaflet) : servie depuis le cache ; la page est
+//   rafraîchie en arrière-plan pour la visite suivante ;
+// - tuiles OpenStreetMap : cache d'abord, les plus anciennes retirées
+//   au-delà de MAX_TILES ;
+// - API : toujours le réseau (la page garde les magasins dans IndexedDB et
+//   met en file les actions faites hors ligne).
+//
+// Réécrit par frontend.py : les noms empreintés et la version sont insérés
+// à la construction, un nouveau déploiement installe donc un nouveau cache.
+
+const VERSION = '{{ version }}';
+const SHELL_CACHE = 'rescuemap-shell-' + VERSION;
+const TILE_CACHE = 'rescuemap-tiles';
+const MAX_TILES = 3000;
+
+const SHELL = [
+    '/',
+    '{{ app.css }}',
+    '{{ markers.js }}',
+    '{{ app.js }}',
+    'https://unpkg.com/leaflet@1.9.4/dist/leaflet.css',
+    'https://unpkg.com/leaflet@1.9.4/dist/leaflet.js'
+];
+
+let tilesAdded = 0;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // Coquilles des versions précédentes
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key.startsWith('rescuemap-shell-') && key !== SHELL_CACHE)
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+
+    if (url.hostname.endsWith('tile.openstreetmap.org')) {
+        event.respondWith(cachedTile(request));
+    } else if (request.mode === 'navigate' && url.origin === self.location.origin && url.pathname === '/') {
+        event.respondWith(cachedPage(event));
+    } else if (SHELL.includes(url.origin === self.location.origin ? url.pathname : request.url)) {
+        event.respondWith(caches.match(request).then(cached => cached || fetch(request)));
+    }
+});
+
+// Page : réponse immédiate depuis le cache, mise à jour pour la visite suivante
+function cachedPage(event) {
+    const update = fetch('/').then(response => {
+        if (response.ok) {
+            const copy = response.clone();
+            caches.open(SHELL_CACHE).then(cache => cache.put('/', copy));
+        }
+        return response;
+    });
+    event.waitUntil(update.catch(() => null));
+    return caches.match('/').then(cached => cached || update);
+}
+
+async function cachedTile(request) {
+    const cache = await caches.open(TILE_CACHE);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+
+    const response = await fetch(request);
+    if (response.ok) {
+        await cache.put(request, response.clone());
+        // Nettoyage de temps en temps : lister le cache coûte cher
+        if (++tilesAdded % 100 === 0) {
+            trimTiles(cache);
+        }
+    }
+    return response;
+}
+
+async function trimTiles(cache) {
+    // Les clés sont dans l'ordre d'insertion : les plus anciennes d'abord
+    const keys = await cache.keys();
+    await Promise.all(keys.slice(0, Math.max(0, keys.length - MAX_TILES)).map(key => cache.delete(key)));
+}
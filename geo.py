@@ -0,0 +1,158 @@
+# geo.py
+"""Utilitaires géographiques partagés (geohash, distances)
+
+Les fonctions scalaires (haversine_km, nearest_city) traitent un point ; les
+versions NumPy (haversine_many, radius_mask, assign_nearest_city...) traitent
+des tableaux entiers de magasins en une passe.
+
+NumPy est importé dans les fonctions qui l'utilisent : le module (geohash,
+bounding_box) reste léger au démarrage des serveurs.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Taille des blocs pour l'affectation aux villes (limite la matrice points × centres)
+ASSIGN_CHUNK = 65536
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash_encode(lat, lon, precision=5):
+    """Encode une coordonnée en geohash de la précision demandée"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+def geohash_bounds(cell):
+    """Boîte (sud, nord, ouest, est) d'une cellule geohash"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bits >> shift & 1:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distance orthodromique entre deux points (km)"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def nearest_city(lat, lon, cities):
+    """Nom de la ville dont le centre est le plus proche ({nom: {"lat", "lon"}})"""
+    best_name = None
+    best_distance = None
+    for name, coords in cities.items():
+        distance = haversine_km(lat, lon, coords['lat'], coords['lon'])
+        if best_distance is None or distance < best_distance:
+            best_name = name
+            best_distance = distance
+    return best_name
+
+def haversine_many(lat, lon, lats, lons):
+    """Distances orthodromiques (km) entre tableaux de points (règles de broadcast NumPy)"""
+    import numpy as np
+
+    phi1 = np.radians(lat)
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def bounding_box(lat, lon, radius_km):
+    """Boîte (sud, nord, ouest, est) contenant le cercle de rayon radius_km"""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return max(-90.0, lat - dlat), min(90.0, lat + dlat), lon - dlon, lon + dlon
+
+def bbox_mask(lats, lons, south, north, west, east):
+    """Masque des points situés dans la boîte"""
+    import numpy as np
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+
+def radius_mask(lat, lon, lats, lons, radius_km):
+    """Masque des points à moins de radius_km ; la distance exacte n'est calculée que dans la boîte"""
+    import numpy as np
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    mask = bbox_mask(lats, lons, *bounding_box(lat, lon, radius_km))
+    candidates = np.flatnonzero(mask)
+    mask[candidates] = haversine_many(lat, lon, lats[candidates], lons[candidates]) <= radius_km
+    return mask
+
+def assign_nearest_city(lats, lons, cities):
+    """Nom de la ville la plus proche pour chaque point ({nom: {"lat", "lon"}})"""
+    import numpy as np
+
+    names = list(cities)
+    center_lats = np.array([cities[name]['lat'] for name in names], dtype=np.float64)
+    center_lons = np.array([cities[name]['lon'] for name in names], dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    nearest = np.empty(len(lats), dtype=np.intp)
+    for start in range(0, len(lats), ASSIGN_CHUNK):
+        end = start + ASSIGN_CHUNK
+        distances = haversine_many(lats[start:end, None], lons[start:end, None], center_lats, center_lons)
+        nearest[start:end] = distances.argmin(axis=1)
+    return np.array(names, dtype=object)[nearest]
+
+def random_points_in_radius(lat, lon, radius_km, count, rng=None):
+    """Points uniformément répartis dans le disque de rayon radius_km (tableaux lats, lons)"""
+    import numpy as np
+
+    rng = np.random.default_rng() if rng is None else rng
+    distances = radius_km * np.sqrt(rng.random(count))
+    bearings = rng.uniform(0, 2 * math.pi, count)
+    lats = lat + distances * np.cos(bearings) / KM_PER_DEGREE
+    lons = lon + distances * np.sin(bearings) / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    return lats, lons
@@ -0,0 +1,182 @@
+# geocoder.py
+"""Géocodage des villes avec requêtes couvertes (hedged requests)
+
+Le premier service est interrogé immédiatement ; si aucune réponse valide
+n'arrive après HEDGE_DELAY secondes (ou s'il échoue), le suivant est lancé en
+parallèle, et ainsi de suite. La première réponse valide l'emporte et les
+requêtes restantes sont annulées ou ignorées : une ville inconnue se résout
+à peu près à la latence du service le plus rapide. Avec un délai de 0, tous
+les services sont interrogés en même temps.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import upstream
+
+logger = logging.getLogger('rescuemap.geocoder')
+
+# Délai avant de lancer le service suivant (secondes)
+HEDGE_DELAY = float(os.environ.get('RESCUEMAP_GEOCODER_HEDGE_DELAY', '0.3'))
+TIMEOUT = 10
+
+def nominatim_request(city_name):
+    """Paramètres de la requête Nominatim OpenStreetMap (gratuit)"""
+    return {
+        'url': upstream.NOMINATIM_URL,
+        'params': {
+            'q': f"{city_name}, France",
+            'format': 'json',
+            'limit': 1,
+            'addressdetails': 1
+        },
+        'headers': {'User-Agent': 'RescueMap/1.0'}
+    }
+
+def parse_nominatim(data):
+    if data and len(data) > 0:
+        return {
+            "lat": float(data[0]['lat']),
+            "lon": float(data[0]['lon']),
+            "radius": 10
+        }
+    return None
+
+def adresse_request(city_name):
+    """Paramètres de la requête à l'API du gouvernement français (gratuit)"""
+    return {
+        'url': upstream.ADRESSE_URL,
+        'params': {
+            'q': city_name,
+            'type': 'municipality',
+            'limit': 1
+        },
+        'headers': {}
+    }
+
+def parse_adresse(data):
+    if data.get('features') and len(data['features']) > 0:
+        coords = data['features'][0]['geometry']['coordinates']
+        return {
+            "lat": coords[1],  # latitude
+            "lon": coords[0],  # longitude
+            "radius": 10
+        }
+    return None
+
+# Services de géocodage, dans l'ordre de lancement : (nom, requête, analyse de la réponse)
+GEOCODERS = [
+    ('Nominatim', nominatim_request, parse_nominatim),
+    ('API Gouvernement', adresse_request, parse_adresse),
+]
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='geocoder')
+
+def _query(geocoder, city_name, timeout):
+    name, build_request, parse_response = geocoder
+    spec = build_request(city_name)
+    response = upstream.get(spec['url'], params=spec['params'], headers=spec['headers'], timeout=timeout)
+    if response.status_code == 200:
+        return parse_response(response.json())
+    return None
+
+def resolve(city_name, geocoders=None, hedge_delay=HEDGE_DELAY, timeout=TIMEOUT):
+    """Retourne les coordonnées du premier service qui répond, ou None"""
+    geocoders = GEOCODERS if geocoders is None else geocoders
+    deadline = time.monotonic() + timeout
+    pending = {}
+    launched = 0
+
+    def launch():
+        nonlocal launched
+        geocoder = geocoders[launched]
+        # Le contexte suit la requête dans le pool (journal des requêtes lentes)
+        pending[_executor.submit(contextvars.copy_context().run, _query, geocoder, city_name, timeout)] = geocoder[0]
+        launched += 1
+
+    try:
+        while pending or launched < len(geocoders):
+            if launched < len(geocoders) and (not pending or hedge_delay <= 0):
+                launch()
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            window = min(hedge_delay, remaining) if launched < len(geocoders) else remaining
+            done, _ = wait(pending, timeout=window, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    coordinates = future.result()
+                except Exception as e:
+                    logger.warning("Erreur %s: %s", name, e)
+                    continue
+                if coordinates:
+                    return coordinates
+
+            # Pas de réponse valide dans la fenêtre : couvrir avec le service suivant
+            if launched < len(geocoders):
+                launch()
+    finally:
+        for future in pending:
+            future.cancel()
+
+    return None
+
+async def _aquery(client, geocoder, city_name, timeout):
+    name, build_request, parse_response = geocoder
+    spec = build_request(city_name)
+    response = await upstream.get_client().arequest(client, 'GET', spec['url'], params=spec['params'],
+                                                    headers=spec['headers'], timeout=timeout)
+    if response.status_code == 200:
+        return parse_response(response.json())
+    return None
+
+async def aresolve(client, city_name, geocoders=None, hedge_delay=HEDGE_DELAY, timeout=TIMEOUT):
+    """Version asynchrone de resolve() : les requêtes perdantes sont annulées"""
+    geocoders = GEOCODERS if geocoders is None else geocoders
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pending = {}
+    launched = 0
+
+    def launch():
+        nonlocal launched
+        geocoder = geocoders[launched]
+        pending[asyncio.ensure_future(_aquery(client, geocoder, city_name, timeout))] = geocoder[0]
+        launched += 1
+
+    try:
+        while pending or launched < len(geocoders):
+            if launched < len(geocoders) and (not pending or hedge_delay <= 0):
+                launch()
+                continue
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            window = min(hedge_delay, remaining) if launched < len(geocoders) else remaining
+            done, _ = await asyncio.wait(pending, timeout=window, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    coordinates = task.result()
+                except Exception as e:
+                    logger.warning("Erreur %s: %s", name, e)
+                    continue
+                if coordinates:
+                    return coordinates
+
+            if launched < len(geocoders):
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return None
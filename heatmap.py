@@ -0,0 +1,183 @@
+# heatmap.py
+"""Agrégats par cellule de grille et par statut, pour les vues régionales
+
+"Où les magasins sont-ils pillés ?" : la table `grid_counts` compte les
+magasins de chaque statut dans les cellules d'une grille latitude/longitude,
+à plusieurs précisions (GRID_LEVELS, de 1° à 0,01°). Une vue nationale ne lit
+que quelques centaines de compteurs, jamais les magasins eux-mêmes.
+
+Des triggers tiennent les compteurs à jour à chaque écriture (statut,
+chargement, synchronisation, suppression). `grid_shops` garde pour chaque
+magasin la position et le statut comptés : une mise à jour retire ce qui
+avait été compté sans relire l'ancien état. La synchronisation met à jour les
+magasins connus sur leur uid ou leur osm_id (sync_manager.apply_row) et passe
+par les mêmes triggers ; le trigger d'insertion retire par précaution un
+comptage resté sous le même id.
+"""
+import math
+
+# Précisions disponibles : (précision, taille de cellule en degrés)
+GRID_LEVELS = (
+    (1, 1.0),     # ~100 km : vue nationale
+    (2, 0.2),     # ~20 km : département
+    (3, 0.05),    # ~5 km : agglomération
+    (4, 0.01),    # ~1 km : quartier
+)
+
+# Cellules au plus par réponse (la précision choisie automatiquement en tient compte)
+MAX_CELLS = 5000
+
+# Cellule (rang, colonne) d'un point : les coordonnées sont décalées pour
+# rester positives, CAST tronque alors comme floor()
+_ROW = 'CAST(({lat} + 90) / l.size AS INTEGER)'
+_COL = 'CAST(({lon} + 180) / l.size AS INTEGER)'
+
+def _counted_cells(shop_id):
+    """Cellules comptées pour un magasin (d'après grid_shops), à toutes les précisions"""
+    return f'''
+        SELECT l.precision, {_ROW.format(lat='g.lat')}, {_COL.format(lon='g.lon')}, g.status
+        FROM grid_shops g, grid_levels l WHERE g.shop_id = {shop_id}
+    '''
+
+def _uncount(shop_id):
+    return f'''
+        UPDATE grid_counts SET count = count - 1
+        WHERE (precision, row, col, status) IN ({_counted_cells(shop_id)});
+        DELETE FROM grid_counts
+        WHERE count <= 0 AND (precision, row, col, status) IN ({_counted_cells(shop_id)});
+        DELETE FROM grid_shops WHERE shop_id = {shop_id};
+    '''
+
+# Les insertions ne peuvent jamais être en conflit (ligne supprimée avant,
+# NOT EXISTS) : une instruction extérieure INSERT OR IGNORE/REPLACE imposerait
+# sinon sa politique de conflit aux triggers
+_COUNT_NEW = f'''
+        INSERT INTO grid_shops (shop_id, lat, lon, status)
+        SELECT NEW.id, NEW.lat, NEW.lon, COALESCE(NEW.status, 'unknown')
+        WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        UPDATE grid_counts SET count = count + 1
+        WHERE (precision, row, col, status) IN ({_counted_cells('NEW.id')});
+        INSERT INTO grid_counts (precision, row, col, status, count)
+        SELECT l.precision, {_ROW.format(lat='g.lat')}, {_COL.format(lon='g.lon')}, g.status, 1
+        FROM grid_shops g, grid_levels l
+        WHERE g.shop_id = NEW.id AND NOT EXISTS (
+            SELECT 1 FROM grid_counts c
+            WHERE c.precision = l.precision AND c.row = {_ROW.format(lat='g.lat')}
+              AND c.col = {_COL.format(lon='g.lon')} AND c.status = g.status
+        );
+'''
+
+def setup_heatmap_schema(cursor):
+    """Crée la grille, ses triggers, et y compte les magasins existants"""
+    cursor.execute('CREATE TABLE IF NOT EXISTS grid_levels (precision INTEGER PRIMARY KEY, size REAL NOT NULL)')
+    cursor.executemany('INSERT OR IGNORE INTO grid_levels (precision, size) VALUES (?, ?)', GRID_LEVELS)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grid_counts (
+            precision INTEGER NOT NULL,
+            row INTEGER NOT NULL,
+            col INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (precision, row, col, status)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grid_shops (
+            shop_id INTEGER PRIMARY KEY,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            status TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS grid_counts_insert
+        AFTER INSERT ON supermarkets
+        BEGIN {_uncount('NEW.id')} {_COUNT_NEW} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS grid_counts_update
+        AFTER UPDATE OF id, lat, lon, status ON supermarkets
+        WHEN OLD.id IS NOT NEW.id OR OLD.lat IS NOT NEW.lat OR OLD.lon IS NOT NEW.lon
+          OR OLD.status IS NOT NEW.status
+        BEGIN {_uncount('OLD.id')} {_COUNT_NEW} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS grid_counts_delete
+        AFTER DELETE ON supermarkets
+        BEGIN {_uncount('OLD.id')} END
+    ''')
+
+    cursor.execute('DELETE FROM grid_shops')
+    cursor.execute('DELETE FROM grid_counts')
+    cursor.execute('''
+        INSERT INTO grid_shops (shop_id, lat, lon, status)
+        SELECT id, lat, lon, COALESCE(status, 'unknown') FROM supermarkets
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+    ''')
+    cursor.execute(f'''
+        INSERT INTO grid_counts (precision, row, col, status, count)
+        SELECT l.precision, {_ROW.format(lat='g.lat')}, {_COL.format(lon='g.lon')}, g.status, COUNT(*)
+        FROM grid_shops g, grid_levels l
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+def cell_size(precision):
+    for level, size in GRID_LEVELS:
+        if level == precision:
+            return size
+    raise ValueError(f"Précision inconnue: {precision} (1 à {GRID_LEVELS[-1][0]})")
+
+def cell_range(bbox, size):
+    """Rangs et colonnes de cellules couvrant une boîte (sud, nord, ouest, est)"""
+    south, north, west, east = bbox
+    return (math.floor((south + 90) / size), math.floor((north + 90) / size),
+            math.floor((west + 180) / size), math.floor((east + 180) / size))
+
+def cell_count(bbox, precision):
+    first_row, last_row, first_col, last_col = cell_range(bbox, cell_size(precision))
+    return (last_row - first_row + 1) * (last_col - first_col + 1)
+
+def choose_precision(bbox):
+    """Précision la plus fine dont la grille tient dans MAX_CELLS cellules pour cette boîte"""
+    chosen = GRID_LEVELS[0][0]
+    for precision, _ in GRID_LEVELS:
+        if cell_count(bbox, precision) <= MAX_CELLS:
+            chosen = precision
+    return chosen
+
+def grid_cells(cursor, bbox, precision, statuses=None):
+    """Compteurs des cellules d'une boîte : {(rang, colonne): {statut: nombre}}"""
+    first_row, last_row, first_col, last_col = cell_range(bbox, cell_size(precision))
+    query = '''
+        SELECT row, col, status, count FROM grid_counts
+        WHERE precision = ? AND row BETWEEN ? AND ? AND col BETWEEN ? AND ?
+    '''
+    params = [precision, first_row, last_row, first_col, last_col]
+    if statuses:
+        query += f" AND status IN ({', '.join('?' * len(statuses))})"
+        params += statuses
+    cursor.execute(query, params)
+
+    cells = {}
+    for row, col, status, count in cursor.fetchall():
+        cells.setdefault((row, col), {})[status] = count
+    return cells
+
+def format_cells(cells, precision):
+    """Cellules au format de /api/heatmap : boîte, centre, compteurs par statut et total"""
+    size = cell_size(precision)
+    result = []
+    for (row, col), counts in sorted(cells.items()):
+        south, west = row * size - 90, col * size - 180
+        result.append({
+            'south': round(south, 6),
+            'west': round(west, 6),
+            'north': round(south + size, 6),
+            'east': round(west + size, 6),
+            'lat': round(south + size / 2, 6),
+            'lon': round(west + size / 2, 6),
+            'counts': counts,
+            'total': sum(counts.values()),
+        })
+    return result
@@ -0,0 +1,432 @@
+# maintenance.py
+"""Sauvegardes en ligne et entretien des bases SQLite
+
+Tâches, lancées par un thread de fond des serveurs ou à la main :
+
+- sauvegarde (toutes les RESCUEMAP_BACKUP_INTERVAL heures) : copie de chaque
+  base (principale et shards) par l'API de sauvegarde de SQLite, par étapes
+  de BACKUP_PAGES pages. Le verrou de lecture est relâché entre deux étapes :
+  les écritures continuent pendant la copie, le serveur n'est jamais arrêté.
+  Si la base change, SQLite reprend la copie depuis le début ; après
+  MAX_RESTARTS reprises, la sauvegarde est retentée plus tard. Chaque copie
+  est vérifiée (PRAGMA quick_check) : page pour page identique à la base,
+  elle révèle aussi une corruption de l'original, sans lire la base en
+  service. Les sauvegardes complètes et vérifiées sont rangées dans un
+  dossier daté de RESCUEMAP_BACKUP_DIR ; seules les RESCUEMAP_BACKUP_KEEP
+  plus récentes sont gardées ;
+- statistiques (toutes les RESCUEMAP_OPTIMIZE_INTERVAL heures, en période
+  creuse) : ANALYZE sur un échantillon (ANALYSIS_LIMIT lignes par index) puis
+  PRAGMA optimize, pour que le planificateur de requêtes suive la croissance
+  des tables après les chargements ;
+- pages libres (toutes les RESCUEMAP_VACUUM_INTERVAL heures, en période
+  creuse) : PRAGMA incremental_vacuum par petites étapes, interrompu dès
+  qu'une requête arrive. Les bases créées avant ce module doivent d'abord
+  passer en auto_vacuum INCREMENTAL (`python maintenance.py enable-vacuum`,
+  une réécriture complète, serveur arrêté de préférence).
+
+Une période est creuse quand le processus n'a admis aucune requête (voir
+admission.py) depuis RESCUEMAP_MAINTENANCE_QUIET secondes. Avec plusieurs
+processus, chaque tâche n'est lancée que par celui qui l'a réservée dans la
+table `maintenance_runs`, qui garde aussi le résultat du dernier passage.
+
+    python maintenance.py backup
+    python maintenance.py check --full
+"""
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import admission
+import metrics
+import shards
+from database import DB_PATH, get_connection
+
+logger = logging.getLogger('rescuemap.maintenance')
+
+BACKUP_DIR = os.environ.get('RESCUEMAP_BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = timedelta(hours=float(os.environ.get('RESCUEMAP_BACKUP_INTERVAL', 24)))
+BACKUP_KEEP = int(os.environ.get('RESCUEMAP_BACKUP_KEEP', 7))
+OPTIMIZE_INTERVAL = timedelta(hours=float(os.environ.get('RESCUEMAP_OPTIMIZE_INTERVAL', 6)))
+VACUUM_INTERVAL = timedelta(hours=float(os.environ.get('RESCUEMAP_VACUUM_INTERVAL', 1)))
+QUIET = float(os.environ.get('RESCUEMAP_MAINTENANCE_QUIET', 300))
+TICK = float(os.environ.get('RESCUEMAP_MAINTENANCE_TICK', 60))
+
+# Pages copiées par étape de sauvegarde (4 Mo avec des pages de 4 ko) et
+# pause laissée aux écritures entre deux étapes
+BACKUP_PAGES = 1024
+BACKUP_PAUSE = 0.01
+# Reprises depuis le début (base modifiée pendant la copie) avant abandon
+MAX_RESTARTS = 3
+# Lignes lues par index pour ANALYZE (0 : toutes)
+ANALYSIS_LIMIT = 1000
+# Pages libérées par étape, et pages libres en dessous desquelles rien n'est fait
+VACUUM_PAGES = 512
+VACUUM_MIN_PAGES = 1024
+# Nouvel essai après un échec
+RETRY_DELAY = timedelta(minutes=15)
+
+TASKS = ('backup', 'optimize', 'vacuum')
+
+SNAPSHOT_NAME = re.compile(r'^\d{8}-\d{6}$')
+
+RUNS = metrics.REGISTRY.counter(
+    'rescuemap_maintenance_runs_total', 'Passages des tâches de maintenance', ('task', 'result'))
+
+class BackupRestarted(Exception):
+    """La base a changé trop souvent pendant la copie"""
+
+class CorruptDatabase(Exception):
+    """Vérification d'intégrité en échec"""
+
+def setup_maintenance_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task TEXT PRIMARY KEY,
+            started_at TEXT,
+            finished_at TEXT,
+            result TEXT,
+            detail TEXT
+        )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO maintenance_runs (task) VALUES (?)', [(task,) for task in TASKS])
+
+def database_paths():
+    """(chemin, nom dans la sauvegarde) de chaque base : la base principale puis les shards"""
+    paths = [(DB_PATH, os.path.basename(DB_PATH))]
+    if shards.enabled():
+        paths += [(path, os.path.join('shards', os.path.basename(path)))
+                  for path in shards.get_router().shard_paths()]
+    return paths
+
+def backup_database(source, destination, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, max_restarts=MAX_RESTARTS):
+    """Copie en ligne d'une base, `pages` pages par étape (-1 : tout d'un coup) ; retourne le nombre de pages
+
+    Lève BackupRestarted si la base a été modifiée plus de `max_restarts`
+    fois pendant la copie.
+    """
+    restarts = 0
+    previous = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, previous
+        # Étape réussie sans que le reste à copier baisse : SQLite a repris
+        # depuis le début (les étapes en attente d'un verrou ne comptent pas)
+        if status == sqlite3.SQLITE_OK and previous is not None and remaining >= previous:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarted(f"{source} modifiée {restarts} fois pendant la copie")
+        if status == sqlite3.SQLITE_OK:
+            previous = remaining
+        if remaining:
+            time.sleep(pause)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(destination)
+    try:
+        src.backup(dst, pages=pages, progress=progress)
+        return dst.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+def check_integrity(path, full=False):
+    """Problèmes relevés par PRAGMA quick_check (integrity_check si full) ; liste vide si la base est saine"""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute('PRAGMA integrity_check' if full else 'PRAGMA quick_check').fetchall()
+    finally:
+        conn.close()
+    return [] if rows == [('ok',)] else [row[0] for row in rows]
+
+def list_snapshots(directory=BACKUP_DIR):
+    """Dossiers de sauvegarde complets, du plus ancien au plus récent"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names
+                  if SNAPSHOT_NAME.match(name) and os.path.isdir(os.path.join(directory, name)))
+
+def prune_snapshots(directory=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Supprime les sauvegardes au-delà des `keep` plus récentes ; retourne les dossiers supprimés
+
+    Les copies inachevées d'un processus arrêté en pleine sauvegarde
+    (dossiers .partial de plus d'un jour) sont aussi supprimées.
+    """
+    snapshots = list_snapshots(directory)
+    removed = snapshots[:-keep] if keep > 0 else []
+    abandoned_before = time.time() - 86400
+    removed += [os.path.join(directory, name) for name in os.listdir(directory)
+                if name.endswith('.partial') and os.path.getmtime(os.path.join(directory, name)) < abandoned_before]
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+def take_snapshot(directory=BACKUP_DIR, keep=BACKUP_KEEP, pages=BACKUP_PAGES):
+    """Sauvegarde et vérifie toutes les bases dans un dossier daté ; retourne son chemin
+
+    Le dossier n'apparaît sous son nom définitif qu'une fois toutes les copies
+    vérifiées : une sauvegarde interrompue ne remplace jamais une bonne.
+    """
+    target = os.path.join(directory, datetime.now().strftime('%Y%m%d-%H%M%S'))
+    partial = target + '.partial'
+    os.makedirs(partial, exist_ok=True)
+    try:
+        for path, name in database_paths():
+            if not os.path.exists(path):
+                continue
+            copy = os.path.join(partial, name)
+            os.makedirs(os.path.dirname(copy), exist_ok=True)
+            backup_database(path, copy, pages)
+            problems = check_integrity(copy)
+            if problems:
+                raise CorruptDatabase(f"{path}: {'; '.join(problems[:5])}")
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+
+    os.rename(partial, target)
+    prune_snapshots(directory, keep)
+    return target
+
+def optimize_database(path):
+    """Met à jour les statistiques du planificateur de requêtes (ANALYZE échantillonné, PRAGMA optimize)"""
+    conn = get_connection(path)
+    cursor = conn.cursor()
+    cursor.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    cursor.execute('ANALYZE')
+    cursor.execute('PRAGMA optimize')
+    conn.commit()
+    conn.close()
+
+def incremental_vacuum(path, pages=VACUUM_PAGES, min_pages=VACUUM_MIN_PAGES, interrupted=None):
+    """Rend au système les pages libres, `pages` par transaction ; retourne le nombre de pages libérées
+
+    Sans effet si la base n'est pas en auto_vacuum INCREMENTAL ou a moins de
+    `min_pages` pages libres. interrupted() est consulté entre deux étapes.
+    """
+    conn = get_connection(path)
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        conn.close()
+        return 0
+
+    cursor.execute('PRAGMA freelist_count')
+    before = free = cursor.fetchone()[0]
+    if free >= min_pages:
+        while free and not (interrupted and interrupted()):
+            # Une page libérée par ligne lue : tout lire pour aller au bout de l'étape
+            cursor.execute(f'PRAGMA incremental_vacuum({pages})')
+            cursor.fetchall()
+            cursor.execute('PRAGMA freelist_count')
+            free = cursor.fetchone()[0]
+    conn.close()
+    return before - free
+
+def enable_incremental_vacuum(path):
+    """Passe une base existante en auto_vacuum INCREMENTAL (VACUUM complet : base bloquée pendant la réécriture)"""
+    conn = get_connection(path)
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    cursor.execute('VACUUM')
+    conn.close()
+
+def claim_task(task, interval):
+    """Réserve une tâche lancée pour la dernière fois il y a plus de `interval` ; vrai si obtenue"""
+    now = datetime.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Un autre processus a pu la réserver entre-temps
+    cursor.execute('''
+        UPDATE maintenance_runs SET started_at = ?
+        WHERE task = ? AND (started_at IS NULL OR started_at < ?)
+    ''', (now.isoformat(), task, (now - interval).isoformat()))
+    conn.commit()
+    claimed = cursor.rowcount > 0
+    conn.close()
+    return claimed
+
+def record_run(task, result, detail='', retry=None, interval=None):
+    """Enregistre le résultat d'une tâche ; avec `retry`, elle redevient due dans ce délai"""
+    now = datetime.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE maintenance_runs SET finished_at = ?, result = ?, detail = ? WHERE task = ?',
+                   (now.isoformat(), result, detail, task))
+    if retry is not None:
+        cursor.execute('UPDATE maintenance_runs SET started_at = ? WHERE task = ?',
+                       ((now - interval + retry).isoformat(), task))
+    conn.commit()
+    conn.close()
+    RUNS.inc(task=task, result=result)
+
+def last_runs():
+    """Dernier passage de chaque tâche : {tâche: ligne de maintenance_runs}"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT task, started_at, finished_at, result, detail FROM maintenance_runs ORDER BY task')
+    runs = {row[0]: dict(zip(('task', 'started_at', 'finished_at', 'result', 'detail'), row))
+            for row in cursor.fetchall()}
+    conn.close()
+    return runs
+
+class Maintenance:
+    """Thread de maintenance : sauvegardes, statistiques et pages libres"""
+
+    def __init__(self, tick=TICK):
+        self.tick = tick
+        self.stopping = threading.Event()
+        self.thread = None
+        self.admitted = self._admitted()
+        self.quiet_since = time.monotonic()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='rescuemap-maintenance', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _admitted(self):
+        return sum(limiter.stats()['admitted'] for limiter in admission.LIMITERS)
+
+    def quiet(self):
+        """Vrai si aucune requête n'a été admise ni n'est en cours depuis QUIET secondes"""
+        admitted = self._admitted()
+        now = time.monotonic()
+        if admitted != self.admitted or any(limiter.stats()['active'] for limiter in admission.LIMITERS):
+            self.admitted = admitted
+            self.quiet_since = now
+        return now - self.quiet_since >= QUIET
+
+    def interrupted(self):
+        """Arrêt demandé, ou requête arrivée depuis le début de la période creuse"""
+        return self.stopping.is_set() or self._admitted() != self.admitted
+
+    def run(self):
+        while not self.stopping.wait(self.tick):
+            try:
+                self.run_due()
+            except Exception as e:
+                logger.exception("Erreur de maintenance: %s", e)
+
+    def run_due(self):
+        """Lance les tâches échues (statistiques et pages libres seulement en période creuse)"""
+        if BACKUP_INTERVAL and claim_task('backup', BACKUP_INTERVAL):
+            self.backup()
+        if self.quiet():
+            if OPTIMIZE_INTERVAL and claim_task('optimize', OPTIMIZE_INTERVAL):
+                self.optimize()
+            if VACUUM_INTERVAL and not self.interrupted() and claim_task('vacuum', VACUUM_INTERVAL):
+                self.vacuum()
+
+    def backup(self):
+        start = time.perf_counter()
+        try:
+            target = take_snapshot()
+        except BackupRestarted as e:
+            logger.warning("Sauvegarde reportée: %s", e)
+            record_run('backup', 'restarted', str(e), RETRY_DELAY, BACKUP_INTERVAL)
+            return None
+        except CorruptDatabase as e:
+            logger.error("Base corrompue, sauvegarde abandonnée: %s", e)
+            record_run('backup', 'corrupt', str(e), RETRY_DELAY, BACKUP_INTERVAL)
+            return None
+        except Exception as e:
+            logger.error("Erreur de sauvegarde: %s", e)
+            record_run('backup', 'failed', str(e), RETRY_DELAY, BACKUP_INTERVAL)
+            return None
+        duration = time.perf_counter() - start
+        logger.info("Sauvegarde %s en %.1fs", target, duration)
+        record_run('backup', 'ok', f'{target} ({duration:.1f}s)')
+        return target
+
+    def optimize(self):
+        start = time.perf_counter()
+        try:
+            for path, _ in database_paths():
+                optimize_database(path)
+        except Exception as e:
+            logger.error("Erreur de mise à jour des statistiques: %s", e)
+            record_run('optimize', 'failed', str(e), RETRY_DELAY, OPTIMIZE_INTERVAL)
+            return
+        record_run('optimize', 'ok', f'{time.perf_counter() - start:.1f}s')
+
+    def vacuum(self):
+        freed = 0
+        try:
+            for path, _ in database_paths():
+                freed += incremental_vacuum(path, interrupted=self.interrupted)
+        except Exception as e:
+            logger.error("Erreur de libération des pages: %s", e)
+            record_run('vacuum', 'failed', str(e), RETRY_DELAY, VACUUM_INTERVAL)
+            return
+        if self.interrupted():
+            # Reprise à la prochaine période creuse
+            record_run('vacuum', 'interrupted', f'{freed} pages', timedelta(0), VACUUM_INTERVAL)
+        else:
+            record_run('vacuum', 'ok', f'{freed} pages')
+
+if __name__ == '__main__':
+    import argparse
+
+    from database import setup_database_schema
+
+    parser = argparse.ArgumentParser(description="Sauvegardes et entretien des bases RescueMap")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backup_parser = subparsers.add_parser('backup', help="Sauvegarde en ligne de toutes les bases")
+    backup_parser.add_argument('--dir', default=BACKUP_DIR)
+    backup_parser.add_argument('--keep', type=int, default=BACKUP_KEEP)
+    backup_parser.add_argument('--pages', type=int, default=BACKUP_PAGES, help="Pages par étape (-1 : tout d'un coup)")
+    subparsers.add_parser('optimize', help="ANALYZE échantillonné et PRAGMA optimize")
+    subparsers.add_parser('vacuum', help="Libère les pages libres (auto_vacuum INCREMENTAL)")
+    subparsers.add_parser('enable-vacuum', help="Passe les bases en auto_vacuum INCREMENTAL (VACUUM complet)")
+    check_parser = subparsers.add_parser('check', help="Vérifie l'intégrité des bases")
+    check_parser.add_argument('--full', action='store_true', help="integrity_check au lieu de quick_check")
+    subparsers.add_parser('status', help="Derniers passages des tâches et sauvegardes présentes")
+    args = parser.parse_args()
+
+    setup_database_schema()
+    start = time.perf_counter()
+
+    if args.command == 'backup':
+        target = take_snapshot(args.dir, args.keep, args.pages)
+        record_run('backup', 'ok', f'{target} (manuelle)')
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(target) for name in names)
+        print(f"✅ Sauvegarde vérifiée: {target} ({size / 1e6:.1f} Mo en {time.perf_counter() - start:.1f}s)")
+    elif args.command == 'optimize':
+        for path, _ in database_paths():
+            optimize_database(path)
+            print(f"📊 Statistiques à jour: {path}")
+    elif args.command == 'vacuum':
+        for path, _ in database_paths():
+            print(f"🧹 {path}: {incremental_vacuum(path, min_pages=0)} pages libérées")
+    elif args.command == 'enable-vacuum':
+        for path, _ in database_paths():
+            enable_incremental_vacuum(path)
+            print(f"🧹 {path}: auto_vacuum INCREMENTAL")
+    elif args.command == 'check':
+        corrupt = False
+        for path, _ in database_paths():
+            problems = check_integrity(path, args.full)
+            corrupt = corrupt or bool(problems)
+            print(f"{'❌' if problems else '✅'} {path}" + ''.join(f"\n   {problem}" for problem in problems[:20]))
+        raise SystemExit(1 if corrupt else 0)
+    elif args.command == 'status':
+        for run in last_runs().values():
+            print(f"🔧 {run['task']:<9} {run['result'] or '-':<12} {run['finished_at'] or '-'}  {run['detail'] or ''}")
+        snapshots = list_snapshots()
+        print(f"💾 {len(snapshots)} sauvegardes dans {BACKUP_DIR}" + (f" (dernière: {snapshots[-1]})" if snapshots else ''))
+
+    if args.command in ('optimize', 'vacuum', 'enable-vacuum'):
+        print(f"✅ Terminé en {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,219 @@
+# metrics.py
+"""Métriques au format texte Prometheus et configuration des journaux
+
+Compteurs et histogrammes en mémoire, sans dépendance externe, exposés par
+`/metrics` :
+
+- rescuemap_http_request_seconds : latence des requêtes par route ;
+- rescuemap_sqlite_query_seconds : durée d'exécution des requêtes SQLite
+  (connexions ouvertes par database.get_connection) ;
+- rescuemap_upstream_request_seconds et compteurs upstream par hôte ;
+- rescuemap_cache_requests_total : succès / échecs des caches (villes déjà
+  chargées, coordonnées connues localement) ;
+- rescuemap_ingestion_seconds : durée des chargements (Overpass, exemples,
+  extraits et diffs OSM).
+
+Les journaux passent par le module logging ; le niveau se règle avec
+RESCUEMAP_LOG_LEVEL (DEBUG, INFO, WARNING...).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import profiler
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INGESTION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s %(message)s'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # clé -> [compteurs par bucket..., somme, nombre]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            values = {key: list(state) for key, state in self.values.items()}
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets + (float('inf'),), state[:len(self.buckets)] + [state[-1]]):
+                labels = _format_labels(self.labels, key, {'le': _format_value(float(bound))})
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(state[-2])}')
+            lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Fonction appelée à chaque rendu, qui retourne des lignes au format texte"""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'rescuemap_http_request_seconds', 'Latence des requêtes HTTP par route', ('method', 'route'))
+HTTP_REQUESTS = REGISTRY.counter(
+    'rescuemap_http_requests_total', 'Requêtes HTTP par route et code de réponse', ('method', 'route', 'status'))
+SQLITE_QUERY_SECONDS = REGISTRY.histogram(
+    'rescuemap_sqlite_query_seconds', "Durée d'exécution des requêtes SQLite", ('operation',))
+UPSTREAM_REQUEST_SECONDS = REGISTRY.histogram(
+    'rescuemap_upstream_request_seconds', 'Durée des appels aux services externes par hôte', ('host',))
+CACHE_REQUESTS = REGISTRY.counter(
+    'rescuemap_cache_requests_total', 'Consultations de cache (hit/miss)', ('cache', 'result'))
+INGESTION_SECONDS = REGISTRY.histogram(
+    'rescuemap_ingestion_seconds', 'Durée des chargements de magasins', ('source',), INGESTION_BUCKETS)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def render():
+    return REGISTRY.render()
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+SQL_OPERATIONS = {'select', 'insert', 'update', 'delete', 'replace', 'create', 'alter', 'drop', 'pragma', 'with'}
+
+def _sql_operation(sql):
+    keyword = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else ''
+    return keyword if keyword in SQL_OPERATIONS else 'other'
+
+class TimedCursor(sqlite3.Cursor):
+    """Curseur qui mesure la durée d'exécution de chaque requête"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            SQLITE_QUERY_SECONDS.observe(elapsed, operation=_sql_operation(sql))
+            profiler.record_query(sql, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            SQLITE_QUERY_SECONDS.observe(elapsed, operation=_sql_operation(sql))
+            profiler.record_query(sql, elapsed)
+
+class TimedConnection(sqlite3.Connection):
+    """Connexion dont les curseurs (et conn.execute) sont mesurés"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+def _upstream_collector():
+    import upstream
+
+    counters = ('requests', 'failures', 'retries', 'rejected')
+    hosts = upstream.get_client().metrics()
+    lines = []
+    for counter in counters:
+        name = f'rescuemap_upstream_{counter}_total'
+        lines += [f'# HELP {name} Appels aux services externes ({counter})', f'# TYPE {name} counter']
+        lines += [f'{name}{_format_labels(("host",), (host,))} {stats[counter]}' for host, stats in hosts.items()]
+    name = 'rescuemap_upstream_throttle_seconds_total'
+    lines += [f'# HELP {name} Attente imposée par la limitation de débit', f'# TYPE {name} counter']
+    lines += [f'{name}{_format_labels(("host",), (host,))} {stats["throttle_seconds"]!r}'
+              for host, stats in hosts.items()]
+    name = 'rescuemap_upstream_circuit_open'
+    lines += [f'# HELP {name} Disjoncteur ouvert (1) ou non (0)', f'# TYPE {name} gauge']
+    lines += [f'{name}{_format_labels(("host",), (host,))} {int(stats["breaker"] == "open")}'
+              for host, stats in hosts.items()]
+    return lines
+
+REGISTRY.add_collector(_upstream_collector)
+
+def configure_logging(level=None):
+    """Configure la journalisation du processus (niveau : RESCUEMAP_LOG_LEVEL, défaut INFO)"""
+    level = (level or os.environ.get('RESCUEMAP_LOG_LEVEL', 'INFO')).upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
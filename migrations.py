@@ -0,0 +1,190 @@
+# migrations.py
+"""Migrations du schéma SQLite, appliquées une seule fois par base
+
+Chaque migration a un numéro de version ; celles déjà appliquées sont
+enregistrées dans la table `schema_migrations`. Au démarrage, une base à
+jour ne coûte qu'une requête (la version courante) au lieu de rejouer toutes
+les créations de tables, triggers et index.
+
+Les premières migrations reprennent l'ancien schéma et restent idempotentes
+(IF NOT EXISTS) : une base créée avant l'introduction des migrations les
+rejoue sans dommage à son premier démarrage.
+
+Pour faire évoluer le schéma, ajouter une fonction à la fin de MIGRATIONS
+(ne jamais modifier une migration déjà publiée).
+"""
+import logging
+import sqlite3
+from datetime import datetime
+
+from database import DB_PATH, get_connection
+
+logger = logging.getLogger('rescuemap.migrations')
+
+# Attente maximale (ms) quand un autre processus applique déjà les migrations
+BUSY_TIMEOUT_MS = 600000
+
+def _create_supermarkets(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS supermarkets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            lat REAL,
+            lon REAL,
+            type TEXT,
+            address TEXT,
+            status TEXT DEFAULT 'unknown',
+            last_verified TEXT,
+            notes TEXT,
+            city TEXT,
+            osm_id INTEGER
+        )
+    ''')
+
+    # Bases créées par reset_database.py ou d'anciennes versions : pas de colonne osm_id
+    try:
+        cursor.execute('SELECT osm_id FROM supermarkets LIMIT 1')
+    except sqlite3.OperationalError:
+        logger.info("Ajout de la colonne 'osm_id' à la table")
+        cursor.execute('ALTER TABLE supermarkets ADD COLUMN osm_id INTEGER')
+
+    # Un nœud OSM n'est stocké qu'une fois (plusieurs NULL restent possibles)
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_supermarkets_osm_id ON supermarkets (osm_id)')
+
+def _create_sync_schema(cursor):
+    from sync_manager import setup_sync_schema
+
+    setup_sync_schema(cursor)
+
+def _create_spatial_index(cursor):
+    from spatial_index import setup_spatial_schema
+
+    setup_spatial_schema(cursor)
+
+def _create_shop_cities(cursor):
+    from dedup import setup_dedup_schema
+
+    # Des doublons fusionnés invalident les digests de synchronisation
+    return setup_dedup_schema(cursor) > 0
+
+def _create_shop_search(cursor):
+    from search import setup_search_schema
+
+    setup_search_schema(cursor)
+
+def _create_shop_changes(cursor):
+    from changes import setup_changes_schema
+
+    setup_changes_schema(cursor)
+
+def _create_city_access(cursor):
+    from scheduler import setup_access_schema
+
+    setup_access_schema(cursor)
+
+def _create_heatmap(cursor):
+    from heatmap import setup_heatmap_schema
+
+    setup_heatmap_schema(cursor)
+
+def _create_maintenance(cursor):
+    from maintenance import setup_maintenance_schema
+
+    setup_maintenance_schema(cursor)
+
+def _create_sync_identity(cursor):
+    from sync_manager import setup_identity_schema
+
+    # Les empreintes portent désormais le uid au lieu de l'id local
+    setup_identity_schema(cursor)
+    return True
+
+def _create_sync_tombstones(cursor):
+    from sync_manager import setup_tombstone_schema
+
+    setup_tombstone_schema(cursor)
+
+# (version, nom, fonction(cursor)) ; la fonction retourne True si les digests
+# de synchronisation sont à recalculer entièrement
+MIGRATIONS = [
+    (1, 'supermarkets', _create_supermarkets),
+    (2, 'sync_schema', _create_sync_schema),
+    (3, 'spatial_index', _create_spatial_index),
+    (4, 'shop_cities', _create_shop_cities),
+    (5, 'shop_search', _create_shop_search),
+    (6, 'shop_changes', _create_shop_changes),
+    (7, 'city_access', _create_city_access),
+    (8, 'heatmap', _create_heatmap),
+    (9, 'maintenance', _create_maintenance),
+    (10, 'sync_identity', _create_sync_identity),
+    (11, 'sync_tombstones', _create_sync_tombstones),
+]
+
+def current_version(cursor):
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_migrations')
+    except sqlite3.OperationalError:
+        return None
+    return cursor.fetchone()[0] or 0
+
+def migrate(db_path=None):
+    """Applique les migrations en attente ; retourne les versions appliquées"""
+    db_path = db_path or DB_PATH
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+
+    # Chemin rapide : base à jour
+    version = current_version(cursor)
+    if version is not None and version >= MIGRATIONS[-1][0]:
+        conn.close()
+        return []
+
+    cursor.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+
+    # Base neuve : pages libres rendues au système par petites étapes
+    # (maintenance.py) ; le mode ne peut plus changer une fois les tables créées
+    cursor.execute('SELECT COUNT(*) FROM sqlite_master')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+
+    applied = []
+    rebuild = False
+    for version, name, function in MIGRATIONS:
+        # Verrou d'écriture, puis nouvelle vérification : plusieurs workers
+        # peuvent démarrer en même temps
+        cursor.execute('BEGIN IMMEDIATE')
+        if current_version(cursor) >= version:
+            conn.rollback()
+            continue
+        try:
+            rebuild = bool(function(cursor)) or rebuild
+            cursor.execute('INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                           (version, name, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        logger.info("Migration %d (%s) appliquée", version, name)
+        applied.append(version)
+
+    conn.close()
+
+    if applied:
+        from sync_manager import SyncManager
+
+        # Construire l'arbre de hachage de synchronisation s'il n'existe pas
+        # encore (ou le recalculer si des doublons viennent d'être fusionnés)
+        if rebuild:
+            SyncManager(db_path).rebuild_digests()
+        else:
+            SyncManager(db_path).ensure_digests()
+    return applied
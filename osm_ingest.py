@@ -0,0 +1,297 @@
+# osm_ingest.py
+"""Ingestion hors ligne d'un extrait OpenStreetMap (.osm.pbf) avec pyosmium
+
+    python osm_ingest.py load midi-pyrenees-latest.osm.pbf --workers 4
+    python osm_ingest.py apply 2024-01-15.osc.gz
+
+Le fichier est lu une seule fois : les blocs PBF sont décompressés et décodés
+en parallèle par le pool de threads C++ de libosmium (--workers), et un
+KeyFilter('shop', 'amenity') écarte en C++ les nœuds sans ces tags, si bien
+que seuls les candidats remontent en Python. Les nœuds
+shop=supermarket/hypermarket/convenience/mall et amenity=marketplace sont
+rattachés à une ville (tag addr:city, sinon centre de ville le plus proche)
+puis chargés par lots dans `supermarkets`, sans aucun accès réseau.
+
+Les fichiers de changements (.osc / .osc.gz) sont ensuite appliqués en flux :
+créations, modifications et suppressions par osm_id, par lots, en conservant
+le statut saisi par les utilisateurs.
+"""
+import argparse
+import time
+from os import cpu_count
+
+import osmium
+from osmium.filter import KeyFilter
+
+import database
+import metrics
+from cities import CITIES
+from dedup import find_near_duplicate
+from geo import assign_nearest_city, nearest_city
+from sync_manager import SyncManager, SYNC_COLUMNS, fetch_row, record_row_change
+
+SHOP_TYPES = {'supermarket', 'hypermarket', 'convenience', 'mall'}
+
+BATCH_SIZE = 5000
+
+def shop_type(tags):
+    """Type de magasin d'un objet OSM, ou None s'il ne nous intéresse pas"""
+    shop = tags.get('shop')
+    if shop in SHOP_TYPES:
+        return shop
+    if tags.get('amenity') == 'marketplace':
+        return 'marketplace'
+    return None
+
+def format_address(tags):
+    street = ' '.join(part for part in (tags.get('addr:housenumber'), tags.get('addr:street')) if part)
+    town = ' '.join(part for part in (tags.get('addr:postcode'), tags.get('addr:city')) if part)
+    return ', '.join(part for part in (street, town) if part) or None
+
+def iter_shops(path, workers=None):
+    """Magasins d'un extrait, lus en une passe : (osm_id, lat, lon, nom, type, adresse, addr:city)"""
+    processor = osmium.FileProcessor(path, osmium.osm.NODE,
+                                     thread_pool=osmium.io.ThreadPool(workers or cpu_count() or 1))
+    for n in processor.with_filter(KeyFilter('shop', 'amenity')):
+        kind = shop_type(n.tags)
+        if kind is None or not n.location.valid():
+            continue
+        yield (
+            n.id,
+            n.location.lat,
+            n.location.lon,
+            n.tags.get('name'),
+            kind,
+            format_address(n.tags),
+            n.tags.get('addr:city'),
+        )
+
+def iter_batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def load_city_centers(cursor):
+    """Centres de villes connus : CITIES et villes déjà présentes dans la base"""
+    centers = {name: {'lat': coords['lat'], 'lon': coords['lon']} for name, coords in CITIES.items()}
+    cursor.execute('SELECT city, AVG(lat), AVG(lon) FROM supermarkets WHERE city IS NOT NULL GROUP BY LOWER(city)')
+    for city, lat, lon in cursor.fetchall():
+        if lat is not None and not any(name.lower() == city.lower() for name in centers):
+            centers[city] = {'lat': lat, 'lon': lon}
+    return centers
+
+def assign_city(lat, lon, addr_city, centers):
+    """Ville d'un magasin : tag addr:city s'il existe, sinon centre le plus proche"""
+    if addr_city:
+        return addr_city.strip().title()
+    return nearest_city(lat, lon, centers)
+
+def assign_cities(shops, centers):
+    """Villes d'une liste de magasins parsés : addr:city, sinon centre le plus proche (calcul vectorisé)"""
+    cities = [addr_city.strip().title() if addr_city else None for *_, addr_city in shops]
+    missing = [i for i, city in enumerate(cities) if city is None]
+    if missing:
+        nearest = assign_nearest_city([shops[i][1] for i in missing], [shops[i][2] for i in missing], centers)
+        for i, city in zip(missing, nearest):
+            cities[i] = city
+    return cities
+
+def adopt_untagged(cursor, rows):
+    """Donne leur osm_id aux magasins sans identifiant qui sont ces nœuds
+
+    Même règle que find_or_insert_shop (même nom à moins de
+    DUPLICATE_DISTANCE_M mètres), mais appliquée aux seuls nœuds encore
+    inconnus : l'upsert par osm_id qui suit met alors à jour le magasin
+    existant au lieu d'en créer un doublon. Le cas courant d'une base sans
+    magasin sans osm_id ne coûte qu'une requête.
+    """
+    cursor.execute('SELECT 1 FROM supermarkets WHERE osm_id IS NULL LIMIT 1')
+    if cursor.fetchone() is None:
+        return 0
+
+    known = _fetch_by_osm_ids(cursor, [row[0] for row in rows])
+    adopted = 0
+    for osm_id, lat, lon, name, *_ in rows:
+        if osm_id in known:
+            continue
+        shop_id = find_near_duplicate(cursor, lat, lon, name, untagged_only=True)
+        if shop_id is None:
+            continue
+        old_row = fetch_row(cursor, shop_id)
+        cursor.execute('UPDATE supermarkets SET osm_id = ? WHERE id = ?', (osm_id, shop_id))
+        record_row_change(cursor, old_row, fetch_row(cursor, shop_id))
+        adopted += 1
+    return adopted
+
+def upsert_shops(cursor, rows):
+    """Insère ou met à jour des magasins par osm_id en conservant le statut saisi
+
+    Un magasin qui change de ville perd son appartenance à l'ancienne ville
+    d'origine. Retourne les anciennes villes des magasins déplacés (leurs
+    digests de synchronisation sont à recalculer).
+    """
+    before = _fetch_by_osm_ids(cursor, [row[0] for row in rows])
+    # La ville n'est pas réécrite par l'upsert : sous ON CONFLICT DO UPDATE, le
+    # INSERT OR IGNORE du trigger supermarket_cities_update échouerait sur
+    # l'appartenance déjà présente. Les déménagements sont traités ensuite.
+    cursor.executemany('''
+        INSERT INTO supermarkets (osm_id, lat, lon, name, type, address, city)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(osm_id) DO UPDATE SET
+            lat = excluded.lat,
+            lon = excluded.lon,
+            name = excluded.name,
+            type = excluded.type,
+            address = excluded.address
+    ''', rows)
+
+    moved = [(row[0], before[row[0]]['city'], row[6]) for row in rows
+             if row[0] in before and before[row[0]]['city'] != row[6]]
+    for osm_id, old_city, new_city in moved:
+        cursor.execute('SELECT id FROM supermarkets WHERE osm_id = ?', (osm_id,))
+        shop_id = cursor.fetchone()[0]
+        cursor.execute('DELETE FROM supermarket_cities WHERE shop_id = ? AND city = ?', (shop_id, old_city))
+        # Le trigger ajoute l'appartenance à la nouvelle ville
+        cursor.execute('UPDATE supermarkets SET city = ? WHERE id = ?', (new_city, shop_id))
+    return {old_city for _, old_city, _ in moved if old_city}
+
+def load_extract(path, workers=None):
+    """Charge un extrait .osm.pbf dans la base ; retourne le nombre de magasins"""
+    database.setup_database_schema()
+    workers = workers or cpu_count()
+    start = time.time()
+
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    centers = load_city_centers(cursor)
+
+    total = 0
+    cities = set()
+    for shops in iter_batches(iter_shops(path, workers)):
+        rows = []
+        for (osm_id, lat, lon, name, kind, address, _), city in zip(shops, assign_cities(shops, centers)):
+            cities.add(city)
+            rows.append((osm_id, lat, lon, name or f'Magasin {city}', kind, address, city))
+
+        adopt_untagged(cursor, rows)
+        cities |= upsert_shops(cursor, rows)
+        total += len(rows)
+        print(f"   … {total} magasins chargés")
+
+    conn.commit()
+    conn.close()
+
+    # Les digests des villes touchées (anciennes comprises) sont recalculés en une passe
+    SyncManager(database.DB_PATH).rebuild_digests(cities)
+    metrics.INGESTION_SECONDS.observe(time.time() - start, source='osm_extract')
+
+    print(f"✅ {total} magasins chargés depuis {path} en {time.time() - start:.1f}s "
+          f"({len(cities)} villes, {workers} workers)")
+    return total
+
+def _fetch_by_osm_ids(cursor, osm_ids):
+    placeholders = ', '.join('?' * len(osm_ids))
+    cursor.execute(f'''
+        SELECT osm_id, {", ".join(SYNC_COLUMNS)} FROM supermarkets WHERE osm_id IN ({placeholders})
+    ''', list(osm_ids))
+    return {result[0]: dict(zip(SYNC_COLUMNS, result[1:])) for result in cursor.fetchall()}
+
+class ChangeHandler(osmium.SimpleHandler):
+    """Applique un fichier de changements OSM nœud par nœud, par lots de BATCH_SIZE"""
+
+    def __init__(self, cursor, centers):
+        super().__init__()
+        self.cursor = cursor
+        self.centers = centers
+        # osm_id -> ligne à écrire (None = suppression) ; seule la dernière version compte
+        self.pending = {}
+        self.stats = {'created': 0, 'modified': 0, 'deleted': 0}
+
+    def node(self, n):
+        kind = None if n.deleted else shop_type(n.tags)
+        if kind is None or not n.location.valid():
+            # Nœud supprimé, ou qui n'est plus un magasin : on le retire s'il était chargé
+            self.pending[n.id] = None
+        else:
+            lat, lon = n.location.lat, n.location.lon
+            city = assign_city(lat, lon, n.tags.get('addr:city'), self.centers)
+            self.pending[n.id] = (n.id, lat, lon, n.tags.get('name') or f'Magasin {city}', kind,
+                                  format_address(n.tags), city)
+
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        upserts = [row for row in self.pending.values() if row is not None]
+        adopt_untagged(self.cursor, upserts)
+
+        before = _fetch_by_osm_ids(self.cursor, self.pending)
+        deletes = [(osm_id,) for osm_id, row in self.pending.items() if row is None and osm_id in before]
+
+        self.cursor.executemany('DELETE FROM supermarkets WHERE osm_id = ?', deletes)
+        upsert_shops(self.cursor, upserts)
+
+        # Mise à jour incrémentale des digests de synchronisation
+        after = _fetch_by_osm_ids(self.cursor, [row[0] for row in upserts]) if upserts else {}
+        for osm_id in self.pending:
+            old_row, new_row = before.get(osm_id), after.get(osm_id)
+            if old_row is None and new_row is None:
+                continue
+            record_row_change(self.cursor, old_row, new_row)
+            if new_row is None:
+                self.stats['deleted'] += 1
+            elif old_row is None:
+                self.stats['created'] += 1
+            else:
+                self.stats['modified'] += 1
+
+        self.pending = {}
+
+def apply_change_file(path):
+    """Applique un fichier .osc / .osc.gz ; retourne les compteurs créés/modifiés/supprimés"""
+    database.setup_database_schema()
+    start = time.time()
+
+    conn = database.get_connection()
+    cursor = conn.cursor()
+
+    handler = ChangeHandler(cursor, load_city_centers(cursor))
+    handler.apply_file(path)
+    handler.flush()
+
+    conn.commit()
+    conn.close()
+
+    stats = handler.stats
+    metrics.INGESTION_SECONDS.observe(time.time() - start, source='osm_change')
+    print(f"✅ {path} appliqué en {time.time() - start:.1f}s: {stats['created']} créés, "
+          f"{stats['modified']} modifiés, {stats['deleted']} supprimés")
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingestion hors ligne d'extraits OpenStreetMap")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = commands.add_parser('load', help="Charger un extrait .osm.pbf")
+    load_parser.add_argument('path', help="Fichier .osm.pbf (ex: extrait Geofabrik)")
+    load_parser.add_argument('--workers', type=int, default=None, help="Threads de décodage (défaut: nb de CPU)")
+
+    apply_parser = commands.add_parser('apply', help="Appliquer un fichier de changements .osc / .osc.gz")
+    apply_parser.add_argument('path', help="Fichier de changements (ex: diff quotidien Geofabrik)")
+
+    args = parser.parse_args()
+
+    if args.command == 'load':
+        print(f"🗺️  Ingestion de {args.path} dans {database.DB_PATH}...")
+        load_extract(args.path, args.workers)
+    elif args.command == 'apply':
+        print(f"🔄 Application de {args.path} sur {database.DB_PATH}...")
+        apply_change_file(args.path)
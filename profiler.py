@@ -0,0 +1,151 @@
+# profiler.py
+"""Diagnostic en production : profilage par échantillonnage et requêtes lentes
+
+Profilage : `/debug/profile?seconds=N` échantillonne la pile de tous les
+threads du processus (sys._current_frames) pendant N secondes, sans
+redémarrer le serveur ni instrumenter le code. Le résultat est au format
+"collapsed stacks" (une pile par ligne, cadres séparés par `;`, suivie du
+nombre d'échantillons), directement utilisable par flamegraph.pl ou
+speedscope. L'endpoint n'existe que si RESCUEMAP_PROFILE_TOKEN est défini ;
+le jeton est attendu dans l'en-tête X-Profile-Token (ou le paramètre token).
+
+Requêtes lentes : chaque requête HTTP collecte les requêtes SQL et les appels
+aux services externes qu'elle déclenche ; au-delà de
+RESCUEMAP_SLOW_REQUEST_MS millisecondes (défaut 500), le détail est écrit
+dans le journal `rescuemap.slow`.
+"""
+import contextvars
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('rescuemap.slow')
+
+PROFILE_TOKEN = os.environ.get('RESCUEMAP_PROFILE_TOKEN')
+SLOW_REQUEST_MS = float(os.environ.get('RESCUEMAP_SLOW_REQUEST_MS', 500))
+
+# Durée maximale d'un profil et intervalle entre deux échantillons
+MAX_PROFILE_SECONDS = 60
+SAMPLE_INTERVAL = 0.005
+
+# Piles dont le cadre le plus profond est dans ces modules : thread en attente
+IDLE_MODULES = ('threading.py', 'selectors.py', 'socketserver.py', 'queue.py', 'base_events.py')
+
+# Appels conservés par requête (les suivants sont seulement comptés) et appels
+# détaillés dans le journal (les plus lents, dans l'ordre d'exécution)
+MAX_TRACE_EVENTS = 1000
+LOGGED_EVENTS = 20
+
+_profile_lock = threading.Lock()
+
+def profiling_enabled():
+    return bool(PROFILE_TOKEN)
+
+def check_token(token):
+    """Vrai si le profilage est activé et que le jeton est le bon"""
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return labels[::-1]
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL, include_idle=False):
+    """Échantillonne les piles de tous les threads ; retourne un Counter pile -> échantillons"""
+    own_thread = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            if not include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                continue
+            labels = [names.get(ident, f'thread-{ident}')] + _collapse(frame)
+            stacks[';'.join(label.replace(';', ',') for label in labels)] += 1
+        time.sleep(interval)
+    return stacks
+
+def profile(seconds, include_idle=False):
+    """Profil de `seconds` secondes au format collapsed ; None si un profil est déjà en cours"""
+    seconds = max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        stacks = sample_stacks(seconds, include_idle=include_idle)
+    finally:
+        _profile_lock.release()
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+class RequestTrace:
+    """Requêtes SQL et appels externes d'une requête HTTP"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []
+        self.totals = {'sql': [0, 0.0], 'upstream': [0, 0.0]}
+        self.lock = threading.Lock()
+        # Requêtes longues par nature (profilage) : jamais journalisées
+        self.ignored = False
+
+    def add(self, kind, description, seconds):
+        with self.lock:
+            self.totals[kind][0] += 1
+            self.totals[kind][1] += seconds
+            if len(self.events) < MAX_TRACE_EVENTS:
+                self.events.append((kind, description, seconds))
+
+_current_trace = contextvars.ContextVar('rescuemap_request_trace', default=None)
+
+def start_trace():
+    """Commence la collecte pour la requête courante (thread ou tâche asyncio)"""
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace, method, path, status):
+    """Termine la collecte et journalise la requête si elle dépasse le seuil"""
+    _current_trace.set(None)
+    elapsed_ms = (time.perf_counter() - trace.start) * 1000
+    if trace.ignored or elapsed_ms < SLOW_REQUEST_MS:
+        return
+
+    sql_count, sql_seconds = trace.totals['sql']
+    upstream_count, upstream_seconds = trace.totals['upstream']
+    lines = [f"Requête lente {method} {path} -> {status} en {elapsed_ms:.0f} ms "
+             f"(SQL: {sql_count} requêtes, {sql_seconds * 1000:.0f} ms ; "
+             f"externes: {upstream_count} appels, {upstream_seconds * 1000:.0f} ms)"]
+    slowest = sorted(range(len(trace.events)), key=lambda i: trace.events[i][2], reverse=True)[:LOGGED_EVENTS]
+    for i in sorted(slowest):
+        kind, description, seconds = trace.events[i]
+        lines.append(f"  {kind:<8} {seconds * 1000:8.1f} ms  {description}")
+    if len(slowest) < sql_count + upstream_count:
+        lines.append(f"  ... {sql_count + upstream_count - len(slowest)} appels plus rapides non détaillés")
+    logger.warning('\n'.join(lines))
+
+def ignore_trace():
+    """Exclut la requête courante du journal des requêtes lentes"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.ignored = True
+
+def record_query(sql, seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add('sql', ' '.join(sql.split())[:500], seconds)
+
+def record_upstream(method, url, outcome, seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add('upstream', f"{method} {url} -> {outcome}", seconds)
@@ -0,0 +1,405 @@
+# read_model.py
+"""Modèle de lecture en colonnes, partagé entre les workers par un fichier mappé
+
+Sans lui, chaque worker relit les magasins dans SQLite et les convertit en
+dictionnaires à chaque requête. Avec RESCUEMAP_READ_MODEL=chemin, les
+magasins sont photographiés dans un fichier binaire en colonnes :
+
+- id (int64), lat/lon (float32), osm_id (int64) ;
+- status et type en codes uint8 (tables de valeurs dans l'en-tête) ;
+- textes (nom, adresse, notes, ville, date de vérification, uid) en index
+  uint32 vers une table de chaînes dédoublonnées ;
+- appartenance aux villes : pour chaque ville, les positions de ses
+  magasins triés par nom.
+
+Le fichier est ouvert avec numpy.memmap : tous les workers lisent les mêmes
+pages du cache du système, sans copie. La mémoire propre à un worker ne
+dépend plus du nombre de magasins, seulement de la liste des villes et du
+surplus décrit ci-dessous.
+
+Les écritures faites depuis la photographie (statuts, villes chargées ou
+rafraîchies) sont lues dans le journal `shop_changes` (voir changes.py) et
+gardées dans un petit surplus en mémoire, prioritaire sur la photographie.
+Au-delà de REBUILD_CHANGES modifications, une nouvelle photographie est
+construite en arrière-plan et remplace atomiquement l'ancienne (os.replace) ;
+les autres workers la remappent à leur requête suivante. Un seul processus la
+construit à la fois (verrou fcntl).
+
+Désactivé en stockage réparti : chaque shard ne contient qu'une ville.
+NumPy n'est importé qu'à la première lecture (démarrage rapide).
+
+    python read_model.py build     # construit la photographie
+    python read_model.py info      # taille, magasins, villes, version
+"""
+import fcntl
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+
+import shards
+from database import DB_PATH, get_connection
+
+logger = logging.getLogger('rescuemap.read_model')
+
+READ_MODEL_PATH = os.environ.get('RESCUEMAP_READ_MODEL')
+
+# Modifications gardées dans le surplus avant une nouvelle photographie
+REBUILD_CHANGES = int(os.environ.get('RESCUEMAP_READ_MODEL_REBUILD', 10000))
+
+MAGIC = b'RMREAD02'
+ALIGNMENT = 8
+NO_STRING = 0xFFFFFFFF
+NO_OSM_ID = -2 ** 63
+
+# Colonnes de `supermarkets`, dans l'ordre de SELECT s.*
+COLUMNS = ('id', 'name', 'lat', 'lon', 'type', 'address', 'status', 'last_verified', 'notes', 'city', 'osm_id', 'uid')
+TEXT_COLUMNS = ('name', 'address', 'last_verified', 'notes', 'city', 'uid')
+CODE_COLUMNS = ('status', 'type')
+
+def enabled():
+    return bool(READ_MODEL_PATH) and not shards.enabled()
+
+def city_key(city_name):
+    """Clé d'une ville comparée comme SQLite (COLLATE NOCASE : casse ASCII seulement)"""
+    return city_name.encode().lower().decode()
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+def build_snapshot(path=None, db_path=None):
+    """Écrit la photographie de la base dans path ; retourne son en-tête
+
+    Les lectures se font dans une seule transaction : la version du journal
+    enregistrée correspond exactement aux lignes photographiées.
+    """
+    import numpy as np
+
+    path = path or READ_MODEL_PATH
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    cursor.execute('SELECT MAX(version) FROM shop_changes')
+    version = cursor.fetchone()[0] or 0
+    cursor.execute(f'SELECT {", ".join(COLUMNS)} FROM supermarkets ORDER BY id')
+    rows = cursor.fetchall()
+    cursor.execute('''
+        SELECT c.city, c.shop_id FROM supermarket_cities c
+        JOIN supermarkets s ON s.id = c.shop_id
+        ORDER BY c.city, s.name, s.id
+    ''')
+    memberships = cursor.fetchall()
+    conn.rollback()
+    conn.close()
+
+    count = len(rows)
+    strings, string_ids = [], {}
+    codes = {column: [] for column in CODE_COLUMNS}
+    code_ids = {column: {} for column in CODE_COLUMNS}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        value = str(value)
+        index = string_ids.get(value)
+        if index is None:
+            index = string_ids[value] = len(strings)
+            strings.append(value)
+        return index
+
+    def code(column, value):
+        index = code_ids[column].get(value)
+        if index is None:
+            index = code_ids[column][value] = len(codes[column])
+            codes[column].append(value)
+        return index
+
+    position = {column: i for i, column in enumerate(COLUMNS)}
+    arrays = {
+        'id': np.fromiter((row[0] for row in rows), np.int64, count),
+        'lat': np.array([row[position['lat']] for row in rows], dtype=np.float64).astype(np.float32),
+        'lon': np.array([row[position['lon']] for row in rows], dtype=np.float64).astype(np.float32),
+        'osm_id': np.fromiter((NO_OSM_ID if row[position['osm_id']] is None else row[position['osm_id']]
+                               for row in rows), np.int64, count),
+    }
+    for column in CODE_COLUMNS:
+        arrays[column] = np.fromiter((code(column, row[position[column]]) for row in rows), np.uint8, count)
+        if len(codes[column]) > 256:
+            raise ValueError(f"Trop de valeurs distinctes pour {column}")
+    for column in TEXT_COLUMNS:
+        arrays[column] = np.fromiter((intern(row[position[column]]) for row in rows), np.uint32, count)
+
+    encoded = [value.encode() for value in strings]
+    arrays['string_offsets'] = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=arrays['string_offsets'][1:])
+    arrays['string_data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    # Villes : positions des magasins (triés par nom) ; première orthographe rencontrée
+    ids = arrays['id']
+    cities, city_offsets, city_rows = [], [0], []
+    current = None
+    for city_name, shop_id in memberships:
+        key = city_key(city_name)
+        if key != current:
+            if current is not None:
+                city_offsets.append(len(city_rows))
+            cities.append(city_name)
+            current = key
+        city_rows.append(shop_id)
+    if current is not None:
+        city_offsets.append(len(city_rows))
+    arrays['city_offsets'] = np.array(city_offsets, dtype=np.int64)
+    arrays['city_rows'] = np.searchsorted(ids, np.array(city_rows, dtype=np.int64)).astype(np.uint32)
+
+    header = {'version': version, 'count': count, 'cities': cities,
+              'codes': codes, 'columns': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['columns'][name] = [array.dtype.str, offset, len(array)]
+        offset += array.nbytes + _padding(array.nbytes)
+
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b' ' * _padding(len(MAGIC) + 4 + len(header_bytes))
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for array in arrays.values():
+            output.write(array.tobytes())
+            output.write(b'\0' * _padding(array.nbytes))
+    os.replace(temporary, path)
+    return header
+
+class Snapshot:
+    """Photographie mappée en lecture seule"""
+
+    def __init__(self, path):
+        import numpy as np
+
+        with open(path, 'rb') as source:
+            if source.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} n'est pas un modèle de lecture RescueMap")
+            header_size = struct.unpack('<I', source.read(4))[0]
+            header = json.loads(source.read(header_size))
+            self.identity = os.fstat(source.fileno()).st_ino
+            # Une seule projection, partagée avec les autres processus (pages du cache)
+            self.buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(MAGIC) + 4 + header_size
+
+        self.columns = {}
+        for name, (dtype, offset, length) in header['columns'].items():
+            self.columns[name] = np.frombuffer(self.buffer, dtype=np.dtype(dtype), count=length, offset=start + offset)
+        self.strings_start = start + header['columns']['string_data'][1]
+
+        self.version = header['version']
+        self.count = header['count']
+        self.codes = header['codes']
+        self.cities = header['cities']
+        self.city_index = {city_key(city_name): i for i, city_name in enumerate(self.cities)}
+
+    def strings(self, indices):
+        """Chaînes aux index donnés (None pour NO_STRING), lues directement dans la projection"""
+        import numpy as np
+
+        missing = indices == NO_STRING
+        indices = np.where(missing, 0, indices)
+        offsets = self.columns['string_offsets']
+        starts = (offsets[indices] + self.strings_start).tolist()
+        ends = (offsets[indices + 1] + self.strings_start).tolist()
+        buffer = self.buffer
+        if not missing.any():
+            return [buffer[start:end].decode() for start, end in zip(starts, ends)]
+        return [None if absent else buffer[start:end].decode()
+                for start, end, absent in zip(starts, ends, missing.tolist())]
+
+    def city_positions(self, city_name):
+        import numpy as np
+
+        index = self.city_index.get(city_key(city_name))
+        if index is None:
+            return np.empty(0, dtype=np.uint32)
+        offsets = self.columns['city_offsets']
+        return self.columns['city_rows'][offsets[index]:offsets[index + 1]]
+
+    def shops(self, positions):
+        """Magasins aux positions données, en dictionnaires (comme SELECT s.*)"""
+        import numpy as np
+
+        columns = self.columns
+        values = {'id': columns['id'][positions].tolist()}
+        for name in ('lat', 'lon'):
+            # float32 : ~0,2 m de précision, arrondi pour ne pas afficher de bruit
+            coordinates = np.round(columns[name][positions].astype(np.float64), 6)
+            values[name] = np.where(np.isnan(coordinates), None, coordinates.astype(object)).tolist()
+        osm_ids = columns['osm_id'][positions]
+        values['osm_id'] = np.where(osm_ids == NO_OSM_ID, None, osm_ids.astype(object)).tolist()
+        for name in CODE_COLUMNS:
+            values[name] = np.array(self.codes[name], dtype=object)[columns[name][positions]].tolist()
+        for name in TEXT_COLUMNS:
+            values[name] = self.strings(columns[name][positions])
+        return [dict(zip(COLUMNS, row)) for row in zip(*(values[column] for column in COLUMNS))]
+
+class ReadModel:
+    """Photographie courante et surplus des modifications postérieures"""
+
+    def __init__(self, path, db_path=None, rebuild_changes=REBUILD_CHANGES):
+        self.path = path
+        self.db_path = db_path
+        self.rebuild_changes = rebuild_changes
+        self.lock = threading.Lock()
+        self.snapshot = None
+        # Surplus : clé de ville -> {shop_id: magasin, ou None s'il a quitté la ville}
+        self.overlay = {}
+        self.overlay_size = 0
+        self.seen = 0
+        self.rebuilding = False
+
+    def _load(self, snapshot):
+        """Installe une photographie ; le surplus ne garde que ce qu'elle ne contient pas"""
+        overlay = {}
+        size = 0
+        for key, shops in self.overlay.items():
+            kept = {shop_id: entry for shop_id, entry in shops.items() if entry[0] > snapshot.version}
+            if kept:
+                overlay[key] = kept
+                size += len(kept)
+        self.snapshot = snapshot
+        self.overlay = overlay
+        self.overlay_size = size
+        self.seen = max(self.seen, snapshot.version)
+
+    def _build(self):
+        """Construit la photographie si aucun autre processus ne le fait déjà"""
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Un autre worker la construit : attendre la sienne
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                return
+            header = build_snapshot(self.path, self.db_path)
+            logger.info("Modèle de lecture construit: %d magasins, %d villes, version %d",
+                        header['count'], len(header['cities']), header['version'])
+
+    def _rebuild_in_background(self):
+        def run():
+            try:
+                self._build()
+            except Exception as e:
+                logger.exception("Erreur de construction du modèle de lecture: %s", e)
+            finally:
+                self.rebuilding = False
+
+        self.rebuilding = True
+        threading.Thread(target=run, name='rescuemap-read-model', daemon=True).start()
+
+    def _refresh(self, cursor):
+        """Remappe une photographie plus récente et lit le journal depuis la dernière lecture"""
+        try:
+            identity = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            identity = None
+        if identity is None:
+            self.snapshot = None
+            self._build()
+            identity = os.stat(self.path).st_ino
+        if self.snapshot is None or self.snapshot.identity != identity:
+            try:
+                snapshot = Snapshot(self.path)
+            except ValueError:
+                # Photographie d'un format antérieur (ex: sans uid) : la reconstruire
+                logger.warning("Modèle de lecture %s d'un ancien format, reconstruction", self.path)
+                self._build()
+                snapshot = Snapshot(self.path)
+            self._load(snapshot)
+
+        cursor.execute('SELECT MAX(version) FROM shop_changes')
+        latest = cursor.fetchone()[0] or 0
+        if latest < self.seen:
+            # Base recréée : versions repartant de zéro
+            logger.warning("Journal des modifications réinitialisé, nouveau modèle de lecture")
+            self.overlay, self.overlay_size, self.seen = {}, 0, 0
+            self._build()
+            self._load(Snapshot(self.path))
+        if latest == self.seen:
+            return
+
+        cursor.execute('''
+            SELECT c.version AS change_version, c.deleted AS change_deleted, c.shop_id AS change_shop_id,
+                   c.city AS change_city, s.*
+            FROM shop_changes c
+            LEFT JOIN supermarkets s ON s.id = c.shop_id AND c.deleted = 0
+            WHERE c.version > ?
+            ORDER BY c.version
+        ''', (self.seen,))
+        for row in cursor:
+            shops = self.overlay.setdefault(city_key(row['change_city']), {})
+            if row['change_shop_id'] not in shops:
+                self.overlay_size += 1
+            shop = None if row['change_deleted'] or row['id'] is None else {column: row[column] for column in COLUMNS}
+            shops[row['change_shop_id']] = (row['change_version'], shop)
+            self.seen = row['change_version']
+
+        if self.overlay_size > self.rebuild_changes and not self.rebuilding:
+            self._rebuild_in_background()
+
+    def city_shops(self, city_name):
+        """Magasins d'une ville triés par nom, comme query_city_supermarkets"""
+        import numpy as np
+
+        conn = get_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            with self.lock:
+                self._refresh(cursor)
+                snapshot = self.snapshot
+                changed = dict(self.overlay.get(city_key(city_name), {}))
+        finally:
+            conn.close()
+
+        positions = snapshot.city_positions(city_name)
+        if not changed:
+            return snapshot.shops(positions)
+
+        ids = snapshot.columns['id'][positions]
+        keep = ~np.isin(ids, np.fromiter(changed, np.int64, len(changed)))
+        shops = snapshot.shops(positions[keep])
+        shops += [shop for _, shop in changed.values() if shop is not None]
+        # Même ordre que ORDER BY s.name (NULL en premier)
+        shops.sort(key=lambda shop: (shop['name'] is not None, shop['name'] or ''))
+        return shops
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = ReadModel(READ_MODEL_PATH)
+        return _model
+
+def city_shops(city_name):
+    return get_model().city_shops(city_name)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Modèle de lecture en colonnes")
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--path', default=READ_MODEL_PATH or f'{DB_PATH}.readmodel')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        header = build_snapshot(args.path, args.db)
+        print(f"✅ {header['count']} magasins, {len(header['cities'])} villes (version {header['version']})")
+        print(f"📁 {args.path} ({os.path.getsize(args.path) / 1e6:.1f} Mo)")
+    else:
+        snapshot = Snapshot(args.path)
+        print(f"📊 {snapshot.count} magasins, {len(snapshot.cities)} villes, version {snapshot.version}")
+        print(f"📁 {args.path} ({os.path.getsize(args.path) / 1e6:.1f} Mo)")
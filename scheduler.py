@@ -0,0 +1,278 @@
+# scheduler.py
+"""Préchauffage et rafraîchissement des villes en arrière-plan
+
+Les serveurs comptent les consultations de chaque ville (carte, chargement,
+synchronisation) et les enregistrent régulièrement dans la table
+`city_access`, avec une décroissance exponentielle (demi-vie
+RESCUEMAP_ACCESS_HALF_LIFE_DAYS) : une ville très consultée le mois dernier
+passe derrière celle que tout le monde regarde aujourd'hui.
+
+Un thread de fond :
+
+- au démarrage, préchauffe les RESCUEMAP_PREWARM_CITIES villes les plus
+  consultées : magasins chargés s'ils manquent (base recréée, nouveau shard)
+  et réponse /api/supermarkets déjà sérialisée ;
+- ensuite, retélécharge depuis Overpass les villes consultées dont les
+  données ont plus de RESCUEMAP_REFRESH_AGE heures, les plus consultées
+  d'abord, au plus RESCUEMAP_REFRESH_PER_HOUR par heure. La ville continue
+  d'être servie pendant le téléchargement ; ses magasins sont remplacés en
+  une transaction.
+
+Les chargements passent par le limiteur INGESTIONS (admission.py) : quand les
+visiteurs chargent déjà des villes, le thread attend le tour suivant. Avec
+plusieurs processus, chaque ville n'est rafraîchie que par celui qui l'a
+réservée dans la table. Les coordonnées obtenues par géocodage y sont aussi
+gardées : un rafraîchissement interroge Overpass autour du centre de la ville
+sans nouveau géocodage.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import admission
+import metrics
+from database import get_connection
+
+logger = logging.getLogger('rescuemap.scheduler')
+
+PREWARM_CITIES = int(os.environ.get('RESCUEMAP_PREWARM_CITIES', 10))
+REFRESH_AGE = timedelta(hours=float(os.environ.get('RESCUEMAP_REFRESH_AGE', 24)))
+REFRESH_PER_HOUR = float(os.environ.get('RESCUEMAP_REFRESH_PER_HOUR', 6))
+HALF_LIFE = timedelta(days=float(os.environ.get('RESCUEMAP_ACCESS_HALF_LIFE_DAYS', 7)))
+TICK = float(os.environ.get('RESCUEMAP_SCHEDULER_TICK', 60))
+
+# Une ville dont le score est retombé sous ce seuil n'est plus rafraîchie
+MIN_REFRESH_SCORE = 1.0
+# Nouvel essai après un échec (Overpass indisponible...)
+RETRY_DELAY = timedelta(hours=1)
+
+# Client des limiteurs d'admission pour les chargements de fond
+ADMISSION_CLIENT = 'scheduler'
+
+REFRESHES = metrics.REGISTRY.counter(
+    'rescuemap_city_refresh_total', 'Rafraîchissements de villes en arrière-plan', ('result',))
+
+_lock = threading.Lock()
+# Consultations pas encore enregistrées : nom en minuscules -> [nom, nombre]
+_pending = {}
+
+def setup_access_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS city_access (
+            city TEXT PRIMARY KEY COLLATE NOCASE,
+            hits REAL NOT NULL DEFAULT 0,
+            last_access TEXT,
+            refreshed_at TEXT,
+            lat REAL,
+            lon REAL,
+            radius REAL
+        )
+    ''')
+
+def decayed(hits, last_access, now):
+    """Score d'une ville à la date `now` (consultations pondérées par leur ancienneté)"""
+    if not last_access:
+        return hits
+    age = now - datetime.fromisoformat(last_access)
+    return hits * 0.5 ** (max(age, timedelta(0)) / HALF_LIFE)
+
+def record_access(city_name):
+    """Compte une consultation (en mémoire, enregistrée par flush_access)"""
+    city_name = city_name.strip()
+    with _lock:
+        entry = _pending.setdefault(city_name.lower(), [city_name, 0])
+        entry[1] += 1
+
+def flush_access():
+    """Enregistre les consultations en attente ; retourne le nombre de villes touchées"""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+
+    now = datetime.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    for city_name, count in pending.values():
+        cursor.execute('SELECT hits, last_access FROM city_access WHERE city = ?', (city_name,))
+        row = cursor.fetchone()
+        hits = (decayed(row[0], row[1], now) if row else 0) + count
+        cursor.execute('''
+            INSERT INTO city_access (city, hits, last_access) VALUES (?, ?, ?)
+            ON CONFLICT(city) DO UPDATE SET hits = excluded.hits, last_access = excluded.last_access
+        ''', (city_name, hits, now.isoformat()))
+    conn.commit()
+    conn.close()
+    return len(pending)
+
+def record_refresh(city_name, when=None):
+    """Note que les magasins d'une ville viennent d'être (re)chargés"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO city_access (city, refreshed_at) VALUES (?, ?)
+        ON CONFLICT(city) DO UPDATE SET refreshed_at = excluded.refreshed_at
+    ''', (city_name.strip(), (when or datetime.now()).isoformat()))
+    conn.commit()
+    conn.close()
+
+def record_coordinates(city_name, coordinates):
+    """Garde les coordonnées géocodées d'une ville"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO city_access (city, lat, lon, radius) VALUES (?, ?, ?, ?)
+        ON CONFLICT(city) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, radius = excluded.radius
+    ''', (city_name.strip(), coordinates['lat'], coordinates['lon'], coordinates.get('radius', 10)))
+    conn.commit()
+    conn.close()
+
+def known_coordinates(city_name):
+    """Coordonnées géocodées gardées pour une ville, ou None"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT lat, lon, radius FROM city_access WHERE city = ? AND lat IS NOT NULL',
+                   (city_name.strip(),))
+    row = cursor.fetchone()
+    conn.close()
+    return {'lat': row[0], 'lon': row[1], 'radius': row[2]} if row else None
+
+def top_cities(limit):
+    """Villes les plus consultées, par score décroissant"""
+    now = datetime.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT city, hits, last_access FROM city_access WHERE hits > 0')
+    scores = [(decayed(hits, last_access, now), city) for city, hits, last_access in cursor.fetchall()]
+    conn.close()
+    return [city for _, city in sorted(scores, reverse=True)[:limit]]
+
+def claim_stale_city():
+    """Réserve la ville périmée la plus consultée pour la rafraîchir ; retourne son nom ou None"""
+    now = datetime.now()
+    stale_before = (now - REFRESH_AGE).isoformat()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT city, hits, last_access FROM city_access
+        WHERE hits > 0 AND (refreshed_at IS NULL OR refreshed_at < ?)
+    ''', (stale_before,))
+    candidates = sorted(((decayed(hits, last_access, now), city) for city, hits, last_access in cursor.fetchall()),
+                        reverse=True)
+
+    claimed = None
+    for score, city_name in candidates:
+        if score < MIN_REFRESH_SCORE:
+            break
+        # Un autre processus a pu la réserver entre-temps
+        cursor.execute('''
+            UPDATE city_access SET refreshed_at = ?
+            WHERE city = ? AND (refreshed_at IS NULL OR refreshed_at < ?)
+        ''', (now.isoformat(), city_name, stale_before))
+        conn.commit()
+        if cursor.rowcount:
+            claimed = city_name
+            break
+    conn.close()
+    return claimed
+
+class Scheduler:
+    """Thread de préchauffage et de rafraîchissement
+
+    load(ville) charge une ville si elle manque, warm(ville) prépare sa
+    réponse sérialisée, refresh(ville) la retélécharge et retourne le nombre
+    de magasins, ou None si le téléchargement n'a rien donné (la ville garde
+    alors ses magasins).
+    """
+
+    def __init__(self, load, warm, refresh, tick=TICK):
+        self.load = load
+        self.warm = warm
+        self.refresh = refresh
+        self.tick = tick
+        self.stopping = threading.Event()
+        self.thread = None
+        self.next_refresh = time.monotonic()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='rescuemap-scheduler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        try:
+            self.prewarm()
+        except Exception as e:
+            logger.exception("Erreur de préchauffage: %s", e)
+
+        while not self.stopping.wait(self.tick):
+            try:
+                flush_access()
+                if REFRESH_PER_HOUR > 0 and time.monotonic() >= self.next_refresh:
+                    self.refresh_next()
+            except Exception as e:
+                logger.exception("Erreur du planificateur: %s", e)
+        flush_access()
+
+    def _admitted(self, function, city_name):
+        """Appelle function(ville) avec une place du limiteur INGESTIONS ; lève admission.Rejected"""
+        ticket = admission.INGESTIONS.acquire(ADMISSION_CLIENT, admission.INGEST)
+        try:
+            return function(city_name)
+        finally:
+            admission.INGESTIONS.release(ticket)
+
+    def prewarm(self):
+        start = time.perf_counter()
+        cities = top_cities(PREWARM_CITIES) if PREWARM_CITIES > 0 else []
+        for city_name in cities:
+            if self.stopping.is_set():
+                return
+            try:
+                self._admitted(self.load, city_name)
+                self.warm(city_name)
+            except admission.Rejected:
+                logger.info("Préchauffage de %s reporté: serveur occupé", city_name)
+            except Exception as e:
+                logger.error("Erreur de préchauffage pour %s: %s", city_name, e)
+        if cities:
+            logger.info("%d villes préchauffées en %.1fs", len(cities), time.perf_counter() - start)
+
+    def refresh_next(self):
+        """Rafraîchit la ville périmée la plus consultée, s'il y en a une"""
+        city_name = claim_stale_city()
+        if city_name is None:
+            return None
+        self.next_refresh = time.monotonic() + 3600 / REFRESH_PER_HOUR
+
+        try:
+            count = self._admitted(self.refresh, city_name)
+        except admission.Rejected:
+            # Place rendue pour le tour suivant
+            record_refresh(city_name, datetime.now() - REFRESH_AGE)
+            self.next_refresh = time.monotonic()
+            REFRESHES.inc(result='rejected')
+            return None
+        except Exception as e:
+            logger.error("Erreur de rafraîchissement pour %s: %s", city_name, e)
+            record_refresh(city_name, datetime.now() - REFRESH_AGE + RETRY_DELAY)
+            REFRESHES.inc(result='failed')
+            return None
+
+        if count is None:
+            logger.warning("Rafraîchissement de %s sans données, nouvel essai plus tard", city_name)
+            record_refresh(city_name, datetime.now() - REFRESH_AGE + RETRY_DELAY)
+            REFRESHES.inc(result='skipped')
+            return None
+
+        self.warm(city_name)
+        REFRESHES.inc(result='updated')
+        return city_name
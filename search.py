@@ -0,0 +1,115 @@
+# search.py
+"""Recherche plein texte des supermarchés (FTS5)
+
+La table virtuelle `supermarkets_fts` indexe name, address, notes et type de
+`supermarkets` et est maintenue par des triggers. Elle garde sa propre copie
+du texte : une entrée se retire par son rowid, sans l'ancien texte qu'exige
+une table de contenu externe. La synchronisation (sync_manager.apply_row)
+insère les magasins inconnus et met à jour les autres sur leur uid ou leur
+osm_id : elle passe par les mêmes triggers que les écritures locales. Le
+trigger d'insertion retire par précaution une entrée restée sous le même
+rowid. La tokenisation `unicode61 remove_diacritics 2`
+ignore accents et majuscules ("Élysée" trouve "elysee") ; les index de
+préfixes rendent rapides les recherches pendant la saisie ("lecl gar").
+
+Une recherche combine le texte, la ville et une boîte géographique en une
+seule requête : FTS5 fournit les magasins correspondants, l'index R*Tree
+filtre la boîte, et les résultats sont classés par bm25 (le nom pèse plus
+que l'adresse, le type ou les notes).
+"""
+import re
+
+# Poids bm25 des colonnes (name, address, notes, type)
+COLUMN_WEIGHTS = (10.0, 4.0, 1.0, 2.0)
+
+MAX_LIMIT = 100
+
+def setup_search_schema(cursor):
+    """Crée l'index plein texte, ses triggers, et l'alimente depuis `supermarkets`"""
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS supermarkets_fts USING fts5(
+            name, address, notes, type,
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3 4'
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_fts_insert
+        AFTER INSERT ON supermarkets
+        BEGIN
+            DELETE FROM supermarkets_fts WHERE rowid = NEW.id;
+            INSERT INTO supermarkets_fts (rowid, name, address, notes, type)
+            VALUES (NEW.id, NEW.name, NEW.address, NEW.notes, NEW.type);
+        END
+    ''')
+    # Les mises à jour de statut (les plus fréquentes) ne touchent pas l'index
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_fts_update
+        AFTER UPDATE OF id, name, address, notes, type ON supermarkets
+        BEGIN
+            DELETE FROM supermarkets_fts WHERE rowid = OLD.id;
+            INSERT INTO supermarkets_fts (rowid, name, address, notes, type)
+            VALUES (NEW.id, NEW.name, NEW.address, NEW.notes, NEW.type);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_fts_delete
+        AFTER DELETE ON supermarkets
+        BEGIN
+            DELETE FROM supermarkets_fts WHERE rowid = OLD.id;
+        END
+    ''')
+
+    cursor.execute('DELETE FROM supermarkets_fts')
+    cursor.execute('''
+        INSERT INTO supermarkets_fts (rowid, name, address, notes, type)
+        SELECT id, name, address, notes, type FROM supermarkets
+    ''')
+
+def build_match_query(text):
+    """Requête FTS5 : chaque mot saisi doit apparaître, en préfixe ("lecl gar" -> "lecl"* "gar"*)"""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+def parse_bbox(value):
+    """Boîte "ouest,sud,est,nord" (format de Leaflet toBBoxString) -> (sud, nord, ouest, est)"""
+    west, south, east, north = (float(part) for part in value.split(','))
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError('Boîte invalide')
+    return south, north, west, east
+
+def search_shops(cursor, text, city=None, bbox=None, limit=20):
+    """Magasins correspondant au texte, filtrés par ville et boîte, classés par pertinence
+
+    Le curseur doit retourner des sqlite3.Row. Chaque résultat porte un champ
+    'score' (bm25 : plus petit = plus pertinent).
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+    limit = max(1, min(int(limit), MAX_LIMIT))
+
+    joins = ''
+    conditions = ['supermarkets_fts MATCH ?']
+    params = [match]
+    if bbox is not None:
+        south, north, west, east = bbox
+        joins = 'JOIN supermarkets_rtree r ON r.id = f.rowid'
+        conditions.append('r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?')
+        params += [south, north, west, east]
+    if city:
+        conditions.append('f.rowid IN (SELECT shop_id FROM supermarket_cities WHERE city = ?)')
+        params.append(city)
+
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    cursor.execute(f'''
+        SELECT s.*, bm25(supermarkets_fts, {weights}) AS score
+        FROM supermarkets_fts f
+        JOIN supermarkets s ON s.id = f.rowid
+        {joins}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY score
+        LIMIT ?
+    ''', params + [limit])
+    return [dict(row, score=round(row['score'], 4)) for row in cursor.fetchall()]
@@ -1,57 +1,54 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import sqlite3
 import json
+import logging
 import os
-from datetime import datetime
-import requests
-import random
-from collections import deque
-
-app = Flask(__name__)
-
-# Base de données des villes principales (pour les coordonnées par défaut)
-CITIES = {
-    "Paris": {"lat": 48.8566, "lon": 2.3522, "radius": 15},
-    "Toulouse": {"lat": 43.6045, "lon": 1.4440, "radius": 20},
-    "Lyon": {"lat": 45.7640, "lon": 4.8357, "radius": 15},
-    "Marseille": {"lat": 43.2965, "lon": 5.3698, "radius": 20},
-    "Bordeaux": {"lat": 44.8378, "lon": -0.5792, "radius": 15},
-    "Lille": {"lat": 50.6292, "lon": 3.0573, "radius": 10},
-    "Nantes": {"lat": 47.2184, "lon": -1.5536, "radius": 15},
-    "Strasbourg": {"lat": 48.5734, "lon": 7.7521, "radius": 10},
-    "Montpellier": {"lat": 43.6109, "lon": 3.8772, "radius": 10},
-    "Nice": {"lat": 43.7102, "lon": 7.2620, "radius": 10},
-    "Rennes": {"lat": 48.1173, "lon": -1.6778, "radius": 10},
-    "Reims": {"lat": 49.2583, "lon": 4.0317, "radius": 8},
-    "Le Havre": {"lat": 49.4944, "lon": 0.1079, "radius": 8},
-    "Saint-Étienne": {"lat": 45.4397, "lon": 4.3872, "radius": 8},
-    "Toulon": {"lat": 43.1242, "lon": 5.9280, "radius": 8}
-}
+import threading
+import time
+from datetime import datetime, timedelta
+import upstream
+from collections import Counter, OrderedDict, deque
+from cities import CITIES
+from database import DB_PATH, get_connection, setup_database_schema
+from sync_manager import SYNC_TOKEN, SyncManager, check_peer_token, fetch_row, record_row_change
+from dedup import find_or_insert_shop
+import geocoder
+from spatial_index import find_nearest
+from search import parse_bbox, search_shops
+from heatmap import MAX_CELLS, cell_count, choose_precision, format_cells, grid_cells
+from changes import city_changes
+from geo import haversine_many
+import admission
+import export
+import frontend
+import maintenance
+import metrics
+import profiler
+import read_model
+import scheduler
+import shards
+
+# Pas de dossier static Flask : l'interface est servie par frontend.py
+app = Flask(__name__, static_folder=None)
+
+logger = logging.getLogger('rescuemap.server')
+
+# Portée de recherche par type, en fraction du rayon de la ville : les supérettes
+# et les marchés, très nombreux, ne sont gardés que près du centre
+TYPE_REACH = {'convenience': 0.7, 'marketplace': 0.5}
 
 CHAT_FILE = 'chat_messages.json'
 
-def setup_database_schema():
-    """Crée ou met à jour le schéma de la base de données"""
-    conn = sqlite3.connect('rescuemap.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS supermarkets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            lat REAL,
-            lon REAL,
-            type TEXT,
-            address TEXT,
-            status TEXT DEFAULT 'unknown',
-            last_verified TEXT,
-            notes TEXT,
-            city TEXT
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# Routes qui chargent la ville demandée si elle est inconnue, et toutes celles
+# qui peuvent déclencher un chargement (contrôle d'admission)
+CITY_LOADING_PATHS = ('/api/load_city', '/api/supermarkets', '/api/changes')
+INGESTION_PATHS = CITY_LOADING_PATHS + ('/api/reset_city',)
+
+# Actions hors ligne acceptées au plus par lot (/api/batch)
+MAX_BATCH_OPERATIONS = 500
+
+# Réponses /api/supermarkets sérialisées gardées en mémoire (villes)
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESCUEMAP_RESPONSE_CACHE', 32))
 
 def load_chat_messages():
     """Charge les messages de chat depuis le fichier JSON"""
@@ -72,92 +69,65 @@ def save_chat_messages(messages):
     with open(CHAT_FILE, 'w', encoding='utf-8') as f:
         json.dump({'messages': messages, 'last_updated': datetime.now().isoformat()}, f, ensure_ascii=False, indent=2)
 
-def get_city_coordinates(city_name):
-    """Obtient les coordonnées d'une ville avec plusieurs méthodes de fallback"""
+# Coordonnées utilisées quand une ville est introuvable
+DEFAULT_COORDINATES = {"lat": 46.603354, "lon": 1.888334, "radius": 10}  # Centre de la France
+
+def lookup_local_coordinates(city_name):
+    """Cherche une ville dans la base locale puis dans la BDD (sans appel réseau)"""
     # D'abord vérifier dans notre base de villes connues
     city_normalized = city_name.strip().title()
     
     if city_normalized in CITIES:
-        print(f"✅ Ville trouvée dans la base locale: {city_normalized}")
+        logger.debug("Ville trouvée dans la base locale: %s", city_normalized)
         return CITIES[city_normalized]
     
-    # Vérifier dans la base de données si cette ville existe déjà
     try:
-        conn = sqlite3.connect('rescuemap.db')
+        # Coordonnées déjà géocodées (centre de la ville)
+        coordinates = scheduler.known_coordinates(city_name)
+        if coordinates:
+            return coordinates
+
+        # Vérifier dans la base de données si cette ville existe déjà
+        if shards.enabled() and not shards.has_city(city_name):
+            return None
+        conn = get_connection(city=city_name)
         cursor = conn.cursor()
-        cursor.execute('SELECT lat, lon FROM supermarkets WHERE LOWER(city) = LOWER(?) LIMIT 1', (city_name,))
+        cursor.execute('''
+            SELECT s.lat, s.lon FROM supermarket_cities c
+            JOIN supermarkets s ON s.id = c.shop_id
+            WHERE c.city = ? LIMIT 1
+        ''', (city_name,))
         result = cursor.fetchone()
         conn.close()
         
         if result:
-            print(f"✅ Coordonnées trouvées dans la BDD pour: {city_name}")
+            logger.debug("Coordonnées trouvées dans la BDD pour: %s", city_name)
             return {"lat": result[0], "lon": result[1], "radius": 10}
     except:
         pass
     
+    return None
+
+def get_city_coordinates(city_name):
+    """Obtient les coordonnées d'une ville avec plusieurs méthodes de fallback"""
+    coordinates = lookup_local_coordinates(city_name)
+    metrics.record_cache('coordinates', coordinates is not None)
+    if coordinates:
+        return coordinates
+    
     # Essayer plusieurs APIs de géocodage
     coordinates = try_geocoding_apis(city_name)
     if coordinates:
-        print(f"✅ Coordonnées trouvées via API pour: {city_name}")
+        logger.info("Coordonnées trouvées via API pour: %s", city_name)
+        scheduler.record_coordinates(city_name, coordinates)
         return coordinates
     
     # Si tout échoue, demander à l'utilisateur ou utiliser une approximation
-    print(f"⚠️  Ville inconnue: {city_name}, utilisation des coordonnées par défaut")
-    return {"lat": 46.603354, "lon": 1.888334, "radius": 10}  # Centre de la France
+    logger.warning("Ville inconnue: %s, utilisation des coordonnées par défaut", city_name)
+    return dict(DEFAULT_COORDINATES)
 
-def try_geocoding_apis(city_name):
-    """Essaie plusieurs APIs de géocodage pour trouver une ville"""
-    
-    # 1. Nominatim OpenStreetMap (gratuit)
-    try:
-        response = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={
-                'q': f"{city_name}, France",
-                'format': 'json',
-                'limit': 1,
-                'addressdetails': 1
-            },
-            headers={'User-Agent': 'RescueMap/1.0'},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                return {
-                    "lat": float(data[0]['lat']),
-                    "lon": float(data[0]['lon']),
-                    "radius": 10
-                }
-    except Exception as e:
-        print(f"Erreur Nominatim: {e}")
-    
-    # 2. API du gouvernement français (gratuit)
-    try:
-        response = requests.get(
-            "https://api-adresse.data.gouv.fr/search/",
-            params={
-                'q': city_name,
-                'type': 'municipality',
-                'limit': 1
-            },
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('features') and len(data['features']) > 0:
-                coords = data['features'][0]['geometry']['coordinates']
-                return {
-                    "lat": coords[1],  # latitude
-                    "lon": coords[0],  # longitude
-                    "radius": 10
-                }
-    except Exception as e:
-        print(f"Erreur API Gouvernement: {e}")
-    
-    # 3. Recherche approximative dans les villes françaises connues
+def approximate_city_match(city_name):
+    """Recherche approximative dans les villes françaises connues"""
     try:
         city_lower = city_name.lower()
         for known_city, coords in CITIES.items():
@@ -165,39 +135,72 @@ def try_geocoding_apis(city_name):
                 known_city.lower() in city_lower or
                 city_lower.replace('-', ' ') == known_city.lower() or
                 city_lower.replace(' ', '-') == known_city.lower()):
-                print(f"🔍 Correspondance approximative: {city_name} -> {known_city}")
+                logger.info("Correspondance approximative: %s -> %s", city_name, known_city)
                 return coords
     except:
         pass
     
     return None
 
-def download_supermarkets_for_city(city_name):
-    """Télécharge les supermarchés pour une ville depuis Overpass avec fallback intelligent"""
-    city_coords = get_city_coordinates(city_name)
+def try_geocoding_apis(city_name):
+    """Interroge les APIs de géocodage en parallèle (requêtes couvertes, voir geocoder.py)"""
+    coordinates = geocoder.resolve(city_name)
+    if coordinates:
+        return coordinates
     
-    # Si on a de vraies coordonnées, essayer Overpass
-    if city_coords["lat"] != 46.603354 or city_coords["lon"] != 1.888334:  # Pas les coords par défaut
-        try:
-            # Requête Overpass basée sur les coordonnées
-            radius = city_coords.get('radius', 10) * 1000  # Convertir en mètres
-            
-            overpass_query = f"""
+    return approximate_city_match(city_name)
+
+def is_default_coordinates(city_coords):
+    return (city_coords["lat"] == DEFAULT_COORDINATES["lat"] and
+            city_coords["lon"] == DEFAULT_COORDINATES["lon"])
+
+def build_overpass_query(city_coords):
+    """Requête Overpass basée sur les coordonnées d'une ville"""
+    radius = int(city_coords.get('radius', 10) * 1000)  # Convertir en mètres
+    around = f"around:{radius},{city_coords['lat']},{city_coords['lon']}"
+    
+    return f"""
             [out:json][timeout:25];
             (
-              node["shop"="supermarket"](around:{radius},{city_coords['lat']},{city_coords['lon']});
-              node["shop"="mall"](around:{radius},{city_coords['lat']},{city_coords['lon']});
-              node["shop"="hypermarket"](around:{radius},{city_coords['lat']},{city_coords['lon']});
-              node["shop"="convenience"](around:{int(radius*0.7)},{city_coords['lat']},{city_coords['lon']});
-              node["amenity"="marketplace"](around:{int(radius*0.5)},{city_coords['lat']},{city_coords['lon']});
+              node["shop"~"^(supermarket|mall|hypermarket|convenience)$"]({around});
+              node["amenity"="marketplace"]({around});
             );
             out center;
             """
+
+def element_type(element):
+    tags = element.get('tags', {})
+    if tags.get('amenity') == 'marketplace':
+        return 'marketplace'
+    return tags.get('shop', 'unknown')
+
+def filter_by_reach(elements, city_coords):
+    """Garde les éléments situés dans la portée de leur type (TYPE_REACH) autour de la ville"""
+    elements = [element for element in elements if 'lat' in element and 'lon' in element]
+    if not elements:
+        return elements
+    
+    radius = city_coords.get('radius', 10)
+    reach = [radius * TYPE_REACH.get(element_type(element), 1.0) for element in elements]
+    distances = haversine_many(city_coords['lat'], city_coords['lon'],
+                               [element['lat'] for element in elements],
+                               [element['lon'] for element in elements])
+    return [element for element, keep in zip(elements, distances <= reach) if keep]
+
+def download_supermarkets_for_city(city_name, city_coords=None):
+    """Télécharge les supermarchés pour une ville depuis Overpass avec fallback intelligent"""
+    if city_coords is None:
+        city_coords = get_city_coordinates(city_name)
+    
+    # Si on a de vraies coordonnées, essayer Overpass
+    if not is_default_coordinates(city_coords):
+        try:
+            overpass_query = build_overpass_query(city_coords)
             
-            print(f"🔍 Recherche Overpass pour {city_name} (rayon: {radius/1000}km)")
+            logger.info("Recherche Overpass pour %s (rayon: %skm)", city_name, city_coords.get('radius', 10))
             
-            response = requests.post(
-                "https://overpass-api.de/api/interpreter",
+            response = upstream.post(
+                upstream.OVERPASS_URL,
                 data=overpass_query,
                 headers={'Content-Type': 'application/x-www-form-urlencoded'},
                 timeout=30
@@ -205,634 +208,630 @@ def download_supermarkets_for_city(city_name):
             
             if response.status_code == 200:
                 data = response.json()
-                elements = data.get('elements', [])
+                elements = filter_by_reach(data.get('elements', []), city_coords)
                 
                 if len(elements) > 0:
-                    print(f"✅ {len(elements)} supermarchés trouvés via Overpass pour {city_name}")
+                    logger.info("%d supermarchés trouvés via Overpass pour %s", len(elements), city_name)
                     return elements
                 else:
-                    print(f"⚠️  Aucun supermarché trouvé via Overpass pour {city_name}, génération d'exemples")
+                    logger.warning("Aucun supermarché trouvé via Overpass pour %s, génération d'exemples", city_name)
             else:
-                print(f"❌ Erreur Overpass HTTP {response.status_code} pour {city_name}")
+                logger.error("Erreur Overpass HTTP %d pour %s", response.status_code, city_name)
                 
         except Exception as e:
-            print(f"❌ Erreur Overpass pour {city_name}: {e}")
+            logger.error("Erreur Overpass pour %s: %s", city_name, e)
     
     # Fallback: générer des données d'exemple
-    print(f"🎲 Génération de supermarchés d'exemple pour {city_name}")
-    return generate_sample_supermarkets(city_name)
-
-def generate_sample_supermarkets(city_name):
-    """Génère des supermarchés d'exemple pour une ville avec des noms réalistes"""
-    city_coords = get_city_coordinates(city_name)
-    shops = []
-    
-    # Noms de chaînes françaises réalistes
-    shop_chains = {
-        "supermarket": ["Carrefour", "Leclerc", "Intermarché", "Super U", "Casino", "Monoprix"],
-        "hypermarket": ["Carrefour", "Leclerc", "Auchan", "Géant Casino", "Cora", "Hyper U"],
-        "convenience": ["Franprix", "Monop'", "Spar", "Vival", "Proxi", "8 à Huit", "Lidl", "Aldi"]
-    }
+    logger.info("Génération de supermarchés d'exemple pour %s", city_name)
+    return generate_sample_supermarkets(city_name, city_coords)
+
+def generate_sample_supermarkets(city_name, city_coords=None):
+    """Génère des supermarchés d'exemple pour une ville avec des noms réalistes
+
+    Le générateur est initialisé par le nom de la ville : une ville
+    réinitialisée retrouve les mêmes magasins (voir synthetic.py).
+    """
+    # Import tardif : NumPy n'est chargé qu'à la première génération
+    import synthetic
+
+    if city_coords is None:
+        city_coords = get_city_coordinates(city_name)
     
-    # Générer entre 15 et 35 magasins selon la taille de la ville
-    num_shops = random.randint(15, 35)
-    
-    for i in range(num_shops):
-        # Varier la dispersion selon le type de ville
-        if city_name.lower() in ['paris', 'lyon', 'marseille']:
-            spread = 0.15  # Grande ville, plus étalé
-        elif city_name.lower() in ['toulouse', 'bordeaux', 'lille', 'nantes']:
-            spread = 0.10  # Ville moyenne
-        else:
-            spread = 0.08  # Petite ville, plus concentré
-            
-        lat = city_coords["lat"] + random.uniform(-spread, spread)
-        lon = city_coords["lon"] + random.uniform(-spread, spread)
-        
-        # Choisir le type de magasin avec des probabilités réalistes
-        shop_types = ["supermarket"] * 50 + ["convenience"] * 30 + ["hypermarket"] * 20
-        shop_type = random.choice(shop_types)
-        
-        # Choisir une chaîne appropriée
-        chain = random.choice(shop_chains[shop_type])
-        
-        # Créer des noms réalistes
-        if shop_type == "hypermarket":
-            shop_name = f"{chain} {city_name}"
-        elif shop_type == "convenience":
-            area_suffix = random.choice(["Centre", "Gare", "République", "Mairie", "Université", ""])
-            shop_name = f"{chain} {city_name} {area_suffix}".strip()
-        else:
-            district = random.choice(["", "Nord", "Sud", "Est", "Ouest", "Centre", "Gare"])
-            shop_name = f"{chain} {city_name} {district}".strip()
-        
-        shops.append({
-            "type": "node",
-            "id": i + 10000 + abs(hash(city_name)) % 10000,
-            "lat": lat,
-            "lon": lon,
-            "tags": {"name": shop_name, "shop": shop_type}
-        })
+    shops = synthetic.generate_city_elements(city_name, city_coords)
     
-    print(f"🎯 {len(shops)} supermarchés générés pour {city_name}")
+    logger.debug("%d supermarchés générés pour %s", len(shops), city_name)
     return shops
 
-def ensure_city_data(city_name):
-    """S'assure qu'une ville a des données dans la base"""
-    conn = sqlite3.connect('rescuemap.db')
+def count_city_supermarkets(city_name):
+    """Nombre de supermarchés enregistrés pour une ville (sans créer son shard)"""
+    if shards.enabled() and not shards.has_city(city_name):
+        return 0
+
+    conn = get_connection(city=city_name)
     cursor = conn.cursor()
-    
-    # Vérifier si la ville a déjà des données
-    cursor.execute('SELECT COUNT(*) FROM supermarkets WHERE LOWER(city) = LOWER(?)', (city_name,))
+    cursor.execute('SELECT COUNT(*) FROM supermarket_cities WHERE city = ?', (city_name,))
     count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+def city_loaded(city_name):
+    """Vrai si la ville a déjà des magasins (sans créer son shard)"""
+    return count_city_supermarkets(city_name) > 0
+
+def needs_ingestion(path, args):
+    """Vrai si la requête déclenche un chargement (ville inconnue) ou une réinitialisation"""
+    if path in CITY_LOADING_PATHS:
+        return not city_loaded(args.get('city', 'Toulouse'))
+    return path in INGESTION_PATHS
+
+def insert_city_supermarkets(city_name, elements):
+    """Rattache les éléments Overpass (ou générés) à une ville, sans dupliquer les magasins connus"""
+    conn = get_connection(city=city_name)
+    cursor = conn.cursor()
+    
+    inserted = 0
+    for element in elements:
+        if 'lat' in element and 'lon' in element:
+            name = element.get('tags', {}).get('name', f'Magasin {city_name}')
+            shop_type = element.get('tags', {}).get('shop', 'unknown')
+            # Les éléments d'exemple n'ont pas de vrai identifiant OSM
+            osm_id = None if element.get('sample') else element.get('id')
+            
+            find_or_insert_shop(cursor, city_name, name, element['lat'], element['lon'], shop_type,
+                                datetime.now().isoformat(), osm_id)
+            inserted += 1
     
-    if count == 0:
-        print(f"🔄 Chargement des supermarchés pour {city_name}...")
+    conn.commit()
+    conn.close()
+    return inserted
+
+def ingestion_source(elements):
+    """Origine d'un chargement pour les métriques : Overpass ou magasins d'exemple"""
+    return 'sample' if elements and elements[0].get('sample') else 'overpass'
+
+def ensure_city_data(city_name):
+    """S'assure qu'une ville a des données dans la base"""
+    # Vérifier si la ville a déjà des données
+    loaded = count_city_supermarkets(city_name) > 0
+    metrics.record_cache('city_data', loaded)
+    if not loaded:
+        logger.info("Chargement des supermarchés pour %s...", city_name)
+        start = time.perf_counter()
         
         # Télécharger les données
         elements = download_supermarkets_for_city(city_name)
         
         # Insérer dans la base
-        inserted = 0
-        for element in elements:
-            if 'lat' in element and 'lon' in element:
-                name = element.get('tags', {}).get('name', f'Magasin {city_name}')
-                shop_type = element.get('tags', {}).get('shop', 'unknown')
-                
-                cursor.execute('''
-                    INSERT INTO supermarkets (name, lat, lon, type, city, last_verified)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (name, element['lat'], element['lon'], shop_type, city_name, datetime.now().isoformat()))
-                inserted += 1
-        
-        conn.commit()
-        print(f"✅ {inserted} supermarchés chargés pour {city_name}")
+        inserted = insert_city_supermarkets(city_name, elements)
+        metrics.INGESTION_SECONDS.observe(time.perf_counter() - start, source=ingestion_source(elements))
+        scheduler.record_refresh(city_name)
+        logger.info("%d supermarchés chargés pour %s", inserted, city_name)
+
+def replace_city_supermarkets(city_name, elements):
+    """Remplace les magasins d'une ville par un nouveau téléchargement, en une transaction
+
+    Les magasins retrouvés gardent leur statut (nom, position et type mis à
+    jour) ; ceux qui ont disparu quittent la ville. Les lectures concurrentes
+    voient l'ancienne liste jusqu'au commit. Retourne (magasins, retirés).
+    """
+    conn = get_connection(city=city_name)
+    cursor = conn.cursor()
+    cursor.execute('SELECT shop_id FROM supermarket_cities WHERE city = ?', (city_name,))
+    previous = {row[0] for row in cursor.fetchall()}
+
+    current = set()
+    now = datetime.now().isoformat()
+    for element in elements:
+        if 'lat' in element and 'lon' in element:
+            tags = element.get('tags', {})
+            name = tags.get('name', f'Magasin {city_name}')
+            shop_type = tags.get('shop', 'unknown')
+            osm_id = None if element.get('sample') else element.get('id')
+
+            shop_id, created = find_or_insert_shop(cursor, city_name, name, element['lat'], element['lon'],
+                                                   shop_type, now, osm_id)
+            if not created:
+                old_row = fetch_row(cursor, shop_id)
+                if (old_row['name'], old_row['lat'], old_row['lon'], old_row['type']) != \
+                        (name, element['lat'], element['lon'], shop_type):
+                    cursor.execute('UPDATE supermarkets SET name = ?, lat = ?, lon = ?, type = ? WHERE id = ?',
+                                   (name, element['lat'], element['lon'], shop_type, shop_id))
+                    record_row_change(cursor, old_row, fetch_row(cursor, shop_id))
+            current.add(shop_id)
+
+    removed = previous - current
+    remove_city_shops(cursor, city_name, removed)
+    conn.commit()
+    conn.close()
+    return len(current), len(removed)
+
+def refresh_city(city_name):
+    """Retélécharge une ville depuis Overpass et remplace ses magasins (tâche de fond, voir scheduler.py)
+
+    Retourne le nombre de magasins, ou None si Overpass n'a rien renvoyé :
+    la ville garde alors ses magasins.
+    """
+    start = time.perf_counter()
+    city_coords = CITIES.get(city_name.strip().title()) or scheduler.known_coordinates(city_name)
+    if city_coords is None:
+        city_coords = try_geocoding_apis(city_name)
+        if city_coords is None:
+            return None
+        scheduler.record_coordinates(city_name, city_coords)
+
+    elements = download_supermarkets_for_city(city_name, city_coords)
+    if ingestion_source(elements) == 'sample':
+        return None
+
+    count, removed = replace_city_supermarkets(city_name, elements)
+    metrics.INGESTION_SECONDS.observe(time.perf_counter() - start, source='refresh')
+    scheduler.record_refresh(city_name)
+    logger.info("%s rafraîchie: %d supermarchés, %d retirés", city_name, count, removed)
+    return count
+
+def query_city_supermarkets(city_name):
+    """Liste des supermarchés d'une ville, triés par nom"""
+    if read_model.enabled():
+        return read_model.city_shops(city_name)
+
+    conn = get_connection(city=city_name)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
     
+    cursor.execute('''
+        SELECT s.* FROM supermarket_cities c
+        JOIN supermarkets s ON s.id = c.shop_id
+        WHERE c.city = ?
+        ORDER BY s.name
+    ''', (city_name,))
+    results = [dict(row) for row in cursor.fetchall()]
     conn.close()
+    
+    return results
 
-HTML = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>RescueMap - Carte Interactive Multi-Villes</title>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
-    <style>
-        body { margin: 0; padding: 0; font-family: Arial, sans-serif; background: #f5f5f5; }
-        #map { height: 100vh; width: 100%; }
-        
-        .control-panel {
-            position: absolute; top: 10px; left: 10px; 
-            background: rgba(255, 255, 255, 0.96); padding: 20px; border-radius: 12px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.15); z-index: 1000;
-            max-width: 350px; backdrop-filter: blur(10px);
-            border: 1px solid rgba(0,0,0,0.1);
-        }
-        
-        .city-input {
-            width: 100%; padding: 12px; margin: 8px 0;
-            border: 2px solid #ddd; border-radius: 8px;
-            font-size: 16px; transition: border-color 0.3s;
-        }
-        
-        .city-input:focus {
-            outline: none; border-color: #007bff;
-            box-shadow: 0 0 0 3px rgba(0,123,255,0.1);
-        }
-        
-        .chat-panel {
-            position: absolute; bottom: 10px; right: 10px;
-            background: rgba(255, 255, 255, 0.96); border-radius: 12px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.15); z-index: 1000;
-            width: 350px; height: 400px; display: flex; flex-direction: column;
-            border: 1px solid rgba(0,0,0,0.1);
-        }
-        
-        .chat-header {
-            padding: 15px; border-bottom: 1px solid #eee;
-            background: #007bff; color: white; border-radius: 12px 12px 0 0;
-            font-weight: bold;
-        }
-        
-        .chat-messages {
-            flex: 1; overflow-y: auto; padding: 10px;
-            max-height: 280px;
-        }
-        
-        .chat-input-container {
-            padding: 10px; border-top: 1px solid #eee;
-            display: flex; gap: 5px;
-        }
-        
-        .chat-input {
-            flex: 1; padding: 10px; border: 1px solid #ddd;
-            border-radius: 6px; font-size: 14px;
-        }
-        
-        .message {
-            margin: 8px 0; padding: 8px 12px; border-radius: 8px;
-            background: #f8f9fa; border-left: 3px solid #007bff;
-        }
-        
-        .message-time {
-            font-size: 11px; color: #666; margin-top: 4px;
-        }
-        
-        .status-panel {
-            position: absolute; top: 10px; right: 380px;
-            background: rgba(255, 255, 255, 0.96); padding: 20px; border-radius: 12px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.15); z-index: 1000;
-            max-width: 300px; backdrop-filter: blur(10px);
-            border: 1px solid rgba(0,0,0,0.1);
-        }
-        
-        .status-safe { color: #28a745; font-weight: bold; }
-        .status-danger { color: #dc3545; font-weight: bold; }
-        .status-looted { color: #fd7e14; font-weight: bold; }
-        .status-unknown { color: #6c757d; font-weight: bold; }
-        
-        button { 
-            margin: 4px; padding: 12px 16px; cursor: pointer; 
-            border: none; border-radius: 8px; background: #007bff; color: white;
-            font-size: 14px; transition: all 0.3s; font-weight: 500;
-        }
-        
-        button:hover { background: #0056b3; transform: translateY(-1px); }
-        button:disabled { background: #6c757d; cursor: not-allowed; transform: none; }
-        
-        .shop-info { 
-            margin: 12px 0; padding: 12px; 
-            background: #f8f9fa; border-radius: 8px; border-left: 4px solid #007bff;
-        }
-        
-        .loading { 
-            display: inline-block; width: 16px; height: 16px;
-            border: 2px solid #f3f3f3; border-top: 2px solid #007bff;
-            border-radius: 50%; animation: spin 1s linear infinite;
-        }
-        
-        .suggestions {
-            background: white; border: 1px solid #ddd; border-radius: 0 0 8px 8px;
-            max-height: 150px; overflow-y: auto; position: absolute;
-            width: 100%; z-index: 1001; margin-top: -1px;
-        }
-        
-        .suggestion-item {
-            padding: 10px; cursor: pointer; border-bottom: 1px solid #eee;
-        }
-        
-        .suggestion-item:hover {
-            background: #f8f9fa;
-        }
-        
-        .city-input-container {
-            position: relative;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        @media (max-width: 768px) {
-            .control-panel { width: calc(100% - 20px); max-width: none; }
-            .chat-panel { width: calc(100% - 20px); height: 300px; }
-            .status-panel { position: relative; top: 0; right: 0; margin: 10px; }
-        }
-    </style>
-</head>
-<body>
-    <div class="control-panel">
-        <h3>🏙️ RescueMap Multi-Villes</h3>
-        
-        <div class="city-input-container">
-            <label for="cityInput"><strong>🌍 Entrez une ville:</strong></label>
-            <input type="text" id="cityInput" class="city-input" placeholder="Ex: Paris, Lyon, Marseille..." value="Toulouse">
-            <div id="suggestions" class="suggestions" style="display: none;"></div>
-        </div>
-        
-        <div style="margin-top: 15px; display: flex; gap: 8px; flex-wrap: wrap;">
-            <button onclick="loadCity()" style="background: #28a745;">🔍 Charger la ville</button>
-            <button onclick="locateMe()">📍 Me localiser</button>
-            <button onclick="refreshSupermarkets()">🔄 Actualiser</button>
-            <button onclick="resetCity()" style="background: #dc3545;">🗑️ Reset ville</button>
-        </div>
-        
-        <div class="shop-info">
-            <strong>📊 Statistiques:</strong><br>
-            <strong>Supermarchés:</strong> <span id="count">0</span><br>
-            <strong>Ville active:</strong> <span id="currentCity">Toulouse</span><br>
-            <strong>Statut:</strong> <span id="loadStatus">Prêt</span>
-        </div>
-    </div>
-    
-    <div class="status-panel">
-        <h4>📈 Légende des Statuts</h4>
-        <div style="margin: 8px 0;">
-            <span class="status-safe">✅ Sûr</span> - Magasin opérationnel<br>
-            <span class="status-danger">⚠️ Danger</span> - Zone à risque<br>
-            <span class="status-looted">🏚️ Pillé</span> - Magasin pillé<br>
-            <span class="status-unknown">❓ Inconnu</span> - Statut non vérifié
-        </div>
-    </div>
-    
-    <div class="chat-panel">
-        <div class="chat-header">
-            💬 Chat de Communication
-        </div>
-        <div class="chat-messages" id="chatMessages">
-            <!-- Messages will be loaded here -->
-        </div>
-        <div class="chat-input-container">
-            <input type="text" id="chatInput" class="chat-input" placeholder="Tapez votre message..." onkeypress="handleChatKeyPress(event)">
-            <button onclick="sendMessage()" style="padding: 10px 15px;">📤</button>
-        </div>
-    </div>
-    
-    <div id="map"></div>
-
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-    <script>
-        let map;
-        let userMarker;
-        let currentCity = "Toulouse";
-        let allMarkers = [];
-        
-        // Villes suggestions
-        const CITY_SUGGESTIONS = [
-            "Paris", "Toulouse", "Lyon", "Marseille", "Bordeaux", "Lille", "Nantes", 
-            "Strasbourg", "Montpellier", "Nice", "Rennes", "Reims", "Le Havre", 
-            "Saint-Étienne", "Toulon", "Grenoble", "Angers", "Dijon", "Brest", 
-            "Le Mans", "Amiens", "Tours", "Limoges", "Clermont-Ferrand", "Villeurbanne",
-            "Besançon", "Orléans", "Metz", "Rouen", "Mulhouse", "Perpignan", "Caen"
-        ];
-        
-        function initMap() {
-            map = L.map('map').setView([43.6045, 1.4440], 13);
-            
-            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-                attribution: '© OpenStreetMap contributors'
-            }).addTo(map);
-            
-            setupCityInput();
-            loadSupermarkets();
-            loadChatMessages();
-        }
-        
-        function setupCityInput() {
-            const input = document.getElementById('cityInput');
-            const suggestions = document.getElementById('suggestions');
-            
-            input.addEventListener('input', function() {
-                const value = this.value.toLowerCase();
-                if (value.length < 2) {
-                    suggestions.style.display = 'none';
-                    return;
-                }
-                
-                const matches = CITY_SUGGESTIONS.filter(city => 
-                    city.toLowerCase().includes(value)
-                ).slice(0, 5);
-                
-                if (matches.length > 0) {
-                    suggestions.innerHTML = matches.map(city => 
-                        `<div class="suggestion-item" onclick="selectCity('${city}')">${city}</div>`
-                    ).join('');
-                    suggestions.style.display = 'block';
-                } else {
-                    suggestions.style.display = 'none';
-                }
-            });
-            
-            input.addEventListener('keypress', function(e) {
-                if (e.key === 'Enter') {
-                    suggestions.style.display = 'none';
-                    loadCity();
-                }
-            });
-            
-            // Cacher les suggestions quand on clique ailleurs
-            document.addEventListener('click', function(e) {
-                if (!input.contains(e.target) && !suggestions.contains(e.target)) {
-                    suggestions.style.display = 'none';
-                }
-            });
-        }
-        
-        function selectCity(cityName) {
-            document.getElementById('cityInput').value = cityName;
-            document.getElementById('suggestions').style.display = 'none';
-            loadCity();
-        }
-        
-        async function loadCity() {
-            const cityInput = document.getElementById('cityInput').value.trim();
-            if (!cityInput) {
-                alert('Veuillez entrer un nom de ville');
-                return;
-            }
-            
-            currentCity = cityInput;
-            document.getElementById('currentCity').textContent = currentCity;
-            document.getElementById('loadStatus').innerHTML = '<div class="loading"></div> Chargement de ' + currentCity + '...';
-            
-            try {
-                const response = await fetch('/api/load_city?city=' + encodeURIComponent(currentCity));
-                const result = await response.json();
-                
-                if (result.success) {
-                    document.getElementById('loadStatus').textContent = `✅ ${result.count} supermarchés trouvés`;
-                    
-                    // Centrer la carte sur la nouvelle ville
-                    if (result.coordinates) {
-                        map.setView([result.coordinates.lat, result.coordinates.lon], 13);
-                    }
-                    
-                    loadSupermarkets();
-                } else {
-                    document.getElementById('loadStatus').textContent = '❌ Erreur: ' + result.error;
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                document.getElementById('loadStatus').textContent = '❌ Erreur de connexion';
-            }
-        }
-        
-        function locateMe() {
-            if (navigator.geolocation) {
-                document.getElementById('loadStatus').textContent = '📍 Localisation en cours...';
-                
-                navigator.geolocation.getCurrentPosition(
-                    (position) => {
-                        const lat = position.coords.latitude;
-                        const lng = position.coords.longitude;
-                        
-                        if (userMarker) map.removeLayer(userMarker);
-                        
-                        userMarker = L.marker([lat, lng], {
-                            icon: L.divIcon({
-                                className: 'user-marker',
-                                html: '📍',
-                                iconSize: [30, 30]
-                            })
-                        }).addTo(map).bindPopup('🦸 Votre position').openPopup();
-                        
-                        map.setView([lat, lng], 15);
-                        
-                        document.getElementById('loadStatus').textContent = '✅ Position trouvée';
-                    },
-                    (error) => {
-                        document.getElementById('loadStatus').textContent = '❌ Géolocalisation impossible';
-                    }
-                );
-            } else {
-                alert('Géolocalisation non supportée par votre navigateur');
-            }
-        }
-        
-        function clearMarkers() {
-            allMarkers.forEach(marker => map.removeLayer(marker));
-            allMarkers = [];
-        }
-        
-        function loadSupermarkets() {
-            document.getElementById('loadStatus').textContent = '🔄 Chargement des supermarchés...';
-            
-            fetch('/api/supermarkets?city=' + encodeURIComponent(currentCity))
-                .then(response => response.json())
-                .then(data => {
-                    document.getElementById('count').textContent = data.length;
-                    document.getElementById('loadStatus').textContent = `✅ ${data.length} supermarchés chargés`;
-                    
-                    clearMarkers();
-                    
-                    data.forEach(shop => {
-                        const status = shop.status || 'unknown';
-                        let color = '#6c757d';
-                        let emoji = '❓';
-                        
-                        if (status === 'safe') { color = '#28a745'; emoji = '✅'; }
-                        if (status === 'danger') { color = '#dc3545'; emoji = '⚠️'; }
-                        if (status === 'looted') { color = '#fd7e14'; emoji = '🏚️'; }
-                        
-                        const marker = L.circleMarker([shop.lat, shop.lon], {
-                            radius: 10,
-                            fillColor: color,
-                            color: '#000',
-                            weight: 2,
-                            fillOpacity: 0.8
-                        }).addTo(map);
-                        
-                        marker.bindPopup(`
-                            <div style="min-width: 250px;">
-                                <strong>${emoji} ${shop.name}</strong><br/>
-                                <em>Type: ${shop.type || 'inconnu'} | Ville: ${shop.city || currentCity}</em><br/>
-                                Statut: <span class="status-${status}">${status}</span><br/>
-                                ${shop.last_verified ? '<small>Dernière vérif: ' + new Date(shop.last_verified).toLocaleString() + '</small><br/>' : ''}
-                                <div style="margin-top: 12px; text-align: center; display: flex; gap: 6px; justify-content: center; flex-wrap: wrap;">
-                                    <button onclick="updateStatus(${shop.id}, 'safe')" style="background: #28a745; font-size: 12px;">✅ Sûr</button>
-                                    <button onclick="updateStatus(${shop.id}, 'danger')" style="background: #dc3545; font-size: 12px;">⚠️ Danger</button>
-                                    <button onclick="updateStatus(${shop.id}, 'looted')" style="background: #fd7e14; font-size: 12px;">🏚️ Pillé</button>
-                                    <button onclick="updateStatus(${shop.id}, 'unknown')" style="background: #6c757d; font-size: 12px;">❓ Reset</button>
-                                </div>
-                            </div>
-                        `);
-                        
-                        allMarkers.push(marker);
-                    });
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    document.getElementById('loadStatus').textContent = '❌ Erreur de chargement';
-                });
-        }
-        
-        function refreshSupermarkets() {
-            loadSupermarkets();
-        }
-        
-        async function updateStatus(shopId, status) {
-            document.getElementById('loadStatus').textContent = '🔄 Mise à jour du statut...';
-            
-            try {
-                const response = await fetch('/api/update_status', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({id: shopId, status: status, city: currentCity})
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    document.getElementById('loadStatus').textContent = '✅ Statut mis à jour!';
-                    setTimeout(loadSupermarkets, 1000);
-                } else {
-                    document.getElementById('loadStatus').textContent = '❌ Erreur de mise à jour';
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                document.getElementById('loadStatus').textContent = '❌ Erreur réseau';
-            }
-        }
-        
-        async function resetCity() {
-            if (!confirm(`Voulez-vous vraiment réinitialiser tous les supermarchés de ${currentCity} ?`)) {
-                return;
-            }
-            
-            document.getElementById('loadStatus').innerHTML = '<div class="loading"></div> Réinitialisation...';
-            
-            try {
-                const response = await fetch('/api/reset_city?city=' + encodeURIComponent(currentCity));
-                const result = await response.json();
-                
-                if (result.success) {
-                    document.getElementById('loadStatus').textContent = '✅ Ville réinitialisée';
-                    setTimeout(loadSupermarkets, 1000);
-                } else {
-                    document.getElementById('loadStatus').textContent = '❌ Erreur de réinitialisation';
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                document.getElementById('loadStatus').textContent = '❌ Erreur réseau';
-            }
-        }
-        
-        // ===== FONCTIONS CHAT =====
-        
-        function loadChatMessages() {
-            fetch('/api/chat/messages')
-                .then(response => response.json())
-                .then(messages => {
-                    displayChatMessages(messages);
-                })
-                .catch(error => console.error('Erreur chargement chat:', error));
-        }
-        
-        function displayChatMessages(messages) {
-            const chatMessages = document.getElementById('chatMessages');
-            chatMessages.innerHTML = messages.map(msg => `
-                <div class="message">
-                    <strong>${msg.user || 'Utilisateur'}:</strong> ${msg.message}
-                    <div class="message-time">${new Date(msg.timestamp).toLocaleString()}</div>
-                </div>
-            `).join('');
-            
-            chatMessages.scrollTop = chatMessages.scrollHeight;
-        }
-        
-        function handleChatKeyPress(event) {
-            if (event.key === 'Enter') {
-                sendMessage();
-            }
-        }
+def city_version(cursor, city_name):
+    """Dernière version du journal shop_changes pour une ville (0 si aucune)"""
+    cursor.execute('SELECT MAX(version) FROM shop_changes WHERE city = ?', (city_name,))
+    return cursor.fetchone()[0] or 0
+
+_responses = OrderedDict()
+_responses_lock = threading.Lock()
+
+def city_supermarkets_json(city_name):
+    """Réponse /api/supermarkets sérialisée, gardée tant que la ville ne change pas
+
+    La version du journal est lue avant les magasins : une écriture entre les
+    deux donne une réponse plus récente que sa version, recalculée à la
+    requête suivante.
+    """
+    key = city_name.strip().lower()
+    conn = get_connection(city=city_name)
+    cursor = conn.cursor()
+    version = city_version(cursor, city_name)
+    conn.close()
+
+    with _responses_lock:
+        cached = _responses.get(key)
+        if cached and cached[0] == version:
+            _responses.move_to_end(key)
+            metrics.record_cache('responses', True)
+            return cached[1]
+    metrics.record_cache('responses', False)
+
+    body = json.dumps(query_city_supermarkets(city_name)).encode()
+    with _responses_lock:
+        _responses[key] = (version, body)
+        _responses.move_to_end(key)
+        while len(_responses) > RESPONSE_CACHE_SIZE:
+            _responses.popitem(last=False)
+    return body
+
+def remove_city_shops(cursor, city_name, shop_ids):
+    """Retire des magasins d'une ville ; ceux qui n'appartiennent à aucune autre ville sont supprimés"""
+    for shop_id in shop_ids:
+        cursor.execute('DELETE FROM supermarket_cities WHERE shop_id = ? AND city = ?', (shop_id, city_name))
+        cursor.execute('SELECT 1 FROM supermarket_cities WHERE shop_id = ? LIMIT 1', (shop_id,))
+        if cursor.fetchone() is None:
+            old_row = fetch_row(cursor, shop_id)
+            cursor.execute('DELETE FROM supermarkets WHERE id = ?', (shop_id,))
+            record_row_change(cursor, old_row=old_row)
+
+def delete_city_supermarkets(city_name):
+    """Retire une ville ; les magasins qui n'appartiennent à aucune autre ville sont supprimés"""
+    if shards.enabled() and not shards.has_city(city_name):
+        return
+
+    conn = get_connection(city=city_name)
+    cursor = conn.cursor()
+    cursor.execute('SELECT shop_id FROM supermarket_cities WHERE city = ?', (city_name,))
+    remove_city_shops(cursor, city_name, [row[0] for row in cursor.fetchall()])
+    conn.commit()
+    conn.close()
+
+def set_shop_status(shop_id, status, city_name, timestamp=None):
+    """Met à jour le statut d'un supermarché et l'inscrit dans l'historique
+
+    `timestamp` : moment d'un signalement mis en file hors ligne ; il est
+    ignoré si un signalement plus récent a déjà été reçu. Retourne vrai si le
+    statut a été appliqué.
+    """
+    queued = timestamp is not None
+    timestamp = timestamp or datetime.now().isoformat()
+    params = [status, timestamp, shop_id, city_name] + ([shop_id, timestamp] if queued else [])
+    if shards.enabled() and not shards.has_city(city_name):
+        return False
+
+    conn = get_connection(city=city_name)
+    cursor = conn.cursor()
+    old_row = fetch_row(cursor, shop_id)
+    cursor.execute(f'''
+        UPDATE supermarkets 
+        SET status = ?, last_verified = ?
+        WHERE id = ? AND id IN (SELECT shop_id FROM supermarket_cities WHERE city = ?)
+        {'AND NOT EXISTS (SELECT 1 FROM status_events WHERE shop_id = ? AND timestamp > ?)' if queued else ''}
+    ''', params)
+    
+    applied = cursor.rowcount > 0
+    if applied:
+        new_row = fetch_row(cursor, shop_id)
+        record_row_change(cursor, old_row, new_row)
+        cursor.execute('''
+            INSERT OR IGNORE INTO status_events (shop_id, city, status, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', (shop_id, new_row['city'], status, new_row['last_verified']))
+    
+    conn.commit()
+    conn.close()
+    return applied
+
+def query_city_changes(city_name, since=0):
+    """Modifications d'une ville depuis la version `since` (cache du navigateur)"""
+    conn = get_connection(city=city_name)
+    conn.row_factory = sqlite3.Row
+    result = city_changes(conn.cursor(), city_name, since)
+    conn.close()
+    return result
+
+def nearest_in_database(conn, lat, lon, k, statuses):
+    conn.row_factory = sqlite3.Row
+    return find_nearest(conn.cursor(), lat, lon, k, statuses)
+
+def unique_shops(shops):
+    """Garde la première occurrence de chaque magasin (identité globale uid, sinon osm_id ou id)
+
+    En stockage réparti, un magasin de deux villes voisines est présent dans
+    les deux shards.
+    """
+    seen = set()
+    for shop in shops:
+        key = shop.get('uid') or shop.get('osm_id') or shop['id']
+        if key not in seen:
+            seen.add(key)
+            yield shop
+
+def query_nearest_supermarkets(lat, lon, k=5, statuses=None):
+    """Les k supermarchés les plus proches d'un point, toutes villes confondues"""
+    if shards.enabled():
+        # Les k plus proches de chaque shard, interrogés en parallèle, puis fusionnés sans doublons
+        per_shard = shards.get_router().fan_out(lambda conn: nearest_in_database(conn, lat, lon, k, statuses))
+        merged = sorted((shop for shops in per_shard for shop in shops), key=lambda shop: shop['distance_km'])
+        return list(unique_shops(merged))[:k]
+
+    conn = get_connection()
+    results = nearest_in_database(conn, lat, lon, k, statuses)
+    conn.close()
+    return results
+
+def parse_nearest_args(args):
+    """Paramètres de /api/nearest : lat, lon, k et statuts (séparés par des virgules)"""
+    lat = float(args['lat'])
+    lon = float(args['lon'])
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Coordonnées invalides')
+    k = int(args.get('k', 5))
+    statuses = [status for status in args.get('status', '').split(',') if status]
+    return lat, lon, k, statuses
+
+def search_in_database(conn, text, city, bbox, limit):
+    conn.row_factory = sqlite3.Row
+    return search_shops(conn.cursor(), text, city, bbox, limit)
+
+def query_search(text, city=None, bbox=None, limit=20):
+    """Recherche plein texte, éventuellement limitée à une ville et à une boîte"""
+    if shards.enabled() and not city:
+        # Recherche dans chaque shard en parallèle ; scores bm25 fusionnés (approximatif), sans doublons
+        per_shard = shards.get_router().fan_out(lambda conn: search_in_database(conn, text, city, bbox, limit))
+        merged = sorted((shop for shops in per_shard for shop in shops), key=lambda shop: shop['score'])
+        return list(unique_shops(merged))[:limit]
+    if city and shards.enabled() and not shards.has_city(city):
+        return []
+
+    conn = get_connection(city=city or None)
+    results = search_in_database(conn, text, city, bbox, limit)
+    conn.close()
+    return results
+
+def parse_search_args(args):
+    """Paramètres de /api/search : q, city, bbox (ouest,sud,est,nord) et limit"""
+    text = args.get('q', '').strip()
+    if not text:
+        raise ValueError('Paramètre q manquant')
+    bbox = parse_bbox(args['bbox']) if args.get('bbox') else None
+    return text, args.get('city') or None, bbox, int(args.get('limit', 20))
+
+def parse_heatmap_args(args):
+    """Paramètres de /api/heatmap : bbox (ouest,sud,est,nord), precision et statuts"""
+    bbox = parse_bbox(args['bbox']) if args.get('bbox') else (-90.0, 90.0, -180.0, 180.0)
+    if args.get('precision'):
+        precision = int(args['precision'])
+        if cell_count(bbox, precision) > MAX_CELLS:
+            raise ValueError('Zone trop grande pour cette précision')
+    else:
+        precision = choose_precision(bbox)
+    statuses = [status for status in args.get('status', '').split(',') if status]
+    return bbox, precision, statuses
+
+def parse_export_args(args):
+    """Paramètres de /api/export : format (ndjson ou geojson), ville, bbox et statuts"""
+    format_name = args.get('format', 'ndjson')
+    if format_name not in export.FORMATS:
+        raise ValueError(f"Format inconnu: {format_name} ({', '.join(sorted(export.FORMATS))})")
+    bbox = parse_bbox(args['bbox']) if args.get('bbox') else None
+    statuses = [status for status in args.get('status', '').split(',') if status]
+    return format_name, args.get('city') or None, bbox, statuses
+
+def query_heatmap(bbox, precision, statuses=None):
+    """Cellules de la grille d'une boîte avec leurs compteurs par statut"""
+    if shards.enabled():
+        # Compteurs de chaque shard additionnés (un magasin de deux villes voisines compte deux fois)
+        per_shard = shards.get_router().fan_out(lambda conn: grid_cells(conn.cursor(), bbox, precision, statuses))
+        cells = {}
+        for shard_cells in per_shard:
+            for cell, counts in shard_cells.items():
+                merged = cells.setdefault(cell, Counter())
+                merged.update(counts)
+        cells = {cell: dict(counts) for cell, counts in cells.items()}
+    else:
+        conn = get_connection()
+        cells = grid_cells(conn.cursor(), bbox, precision, statuses)
+        conn.close()
+    return format_cells(cells, precision)
+
+def add_chat_messages(entries):
+    """Ajoute plusieurs messages en une seule écriture du fichier ; retourne les messages enregistrés
+
+    Chaque entrée porte message, user, city et éventuellement timestamp et
+    client_id : un message déjà reçu sous le même client_id (envoi rejoué
+    après une coupure) n'est pas ajouté une seconde fois.
+    """
+    # Charger les messages existants
+    messages = load_chat_messages()
+    by_client_id = {message['client_id']: message for message in messages if message.get('client_id')}
+    
+    saved = []
+    for entry in entries:
+        client_id = entry.get('client_id')
+        if client_id in by_client_id:
+            saved.append(by_client_id[client_id])
+            continue
         
-        async function sendMessage() {
-            const input = document.getElementById('chatInput');
-            const message = input.value.trim();
-            
-            if (!message) return;
-            
-            try {
-                const response = await fetch('/api/chat/send', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        message: message,
-                        user: 'Utilisateur',
-                        city: currentCity
-                    })
-                });
-                
-                const result = await response.json();
-                
-                if (result.success) {
-                    input.value = '';
-                    loadChatMessages();
-                } else {
-                    alert('Erreur envoi message: ' + result.error);
-                }
-            } catch (error) {
-                console.error('Erreur:', error);
-                alert('Erreur de connexion');
-            }
+        new_message = {
+            'id': len(messages) + 1,
+            'user': entry['user'],
+            'message': entry['message'],
+            'city': entry['city'],
+            'timestamp': entry.get('timestamp') or datetime.now().isoformat()
         }
-        
-        // Initialisation
-        document.addEventListener('DOMContentLoaded', initMap);
-        
-        // Auto-refresh chat toutes les 30 secondes
-        setInterval(loadChatMessages, 30000);
-    </script>
-</body>
-</html>
-'''
+        if client_id:
+            new_message['client_id'] = client_id
+            by_client_id[client_id] = new_message
+        messages.append(new_message)
+        saved.append(new_message)
+    
+    # Sauvegarder (garde automatiquement les 100 derniers)
+    save_chat_messages(messages)
+    return saved
+
+def add_chat_message(message_text, user, city):
+    """Ajoute un message au chat et retourne le message enregistré"""
+    return add_chat_messages([{'message': message_text, 'user': user, 'city': city}])[0]
+
+def timestamp_from_age(age):
+    """Horodatage d'une action faite il y a `age` secondes (None si non précisé)
+
+    Le client envoie l'ancienneté de l'action plutôt que son heure : son
+    horloge peut différer de celle du serveur.
+    """
+    if age is None:
+        return None
+    return (datetime.now() - timedelta(seconds=max(0.0, float(age)))).isoformat()
+
+def apply_batch(operations):
+    """Applique les actions mises en file par un client hors ligne ; retourne un résultat par action
+
+    Actions : {'type': 'status', 'id', 'status', 'city', 'age'} et
+    {'type': 'chat', 'message', 'user', 'city', 'client_id', 'age'}. Les
+    messages sont écrits ensemble, en une écriture du fichier de chat.
+    """
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f'Au plus {MAX_BATCH_OPERATIONS} actions par lot')
+    
+    results = [None] * len(operations)
+    chat = []
+    for index, operation in enumerate(operations):
+        try:
+            kind = operation.get('type')
+            if kind == 'status':
+                applied = set_shop_status(operation['id'], operation['status'], operation.get('city', 'Toulouse'),
+                                          timestamp_from_age(operation.get('age')))
+                results[index] = {'success': True, 'applied': applied}
+            elif kind == 'chat':
+                message_text = operation.get('message', '').strip()
+                if not message_text:
+                    raise ValueError('Message vide')
+                chat.append((index, {
+                    'message': message_text,
+                    'user': operation.get('user', 'Utilisateur'),
+                    'city': operation.get('city', 'Inconnue'),
+                    'client_id': operation.get('client_id'),
+                    'timestamp': timestamp_from_age(operation.get('age')),
+                }))
+            else:
+                raise ValueError(f'Action inconnue : {kind}')
+        except Exception as e:
+            results[index] = {'success': False, 'error': str(e)}
+    
+    if chat:
+        saved = add_chat_messages([entry for _, entry in chat])
+        for (index, _), message in zip(chat, saved):
+            results[index] = {'success': True, 'message_id': message['id']}
+    return results
+
+def count_cities_and_statuses(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT city, COUNT(*) FROM supermarket_cities GROUP BY city')
+    cities_count = cursor.fetchall()
+    
+    cursor.execute('SELECT status, COUNT(*) FROM supermarkets GROUP BY status')
+    status_count = cursor.fetchall()
+    return cities_count, status_count
+
+def collect_status():
+    """Statistiques globales (villes, statuts, chat)"""
+    if shards.enabled():
+        # Un comptage par shard, en parallèle
+        per_shard = shards.get_router().fan_out(count_cities_and_statuses)
+    else:
+        conn = get_connection()
+        per_shard = [count_cities_and_statuses(conn)]
+        conn.close()
+    
+    cities_count = Counter()
+    status_count = Counter()
+    for cities, statuses in per_shard:
+        cities_count.update(dict(cities))
+        status_count.update(dict(statuses))
+    
+    # Charger les stats du chat
+    messages = load_chat_messages()
+    
+    return {
+        'status': 'online', 
+        'cities': dict(cities_count),
+        'status_distribution': dict(status_count),
+        'chat_messages': len(messages),
+        'upstream': upstream.get_client().metrics(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+@app.before_request
+def start_request_timer():
+    request.start_time = time.perf_counter()
+    request.trace = profiler.start_trace()
+
+def rejection_response(rejected):
+    response = jsonify({'success': False, 'error': str(rejected)})
+    response.status_code = rejected.status
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
+
+@app.before_request
+def admit_request():
+    """Contrôle d'admission : chargements limités, lectures servies en premier"""
+    request.admission = []
+    if not admission.is_limited(request.path):
+        return None
+    
+    client = admission.client_key(request.remote_addr, request.headers)
+    ingestion = request.path in INGESTION_PATHS and needs_ingestion(request.path, request.args)
+    priority = admission.request_priority(request.method, ingestion)
+    try:
+        # Limite des chargements d'abord : un client déjà en train de charger
+        # est refusé sans attendre dans la file générale
+        if ingestion:
+            request.admission.append((admission.INGESTIONS, admission.INGESTIONS.acquire(client, priority)))
+        request.admission.append((admission.REQUESTS, admission.REQUESTS.acquire(client, priority)))
+    except admission.Rejected as rejected:
+        return rejection_response(rejected)
+
+@app.teardown_request
+def release_admission(exception=None):
+    for limiter, ticket in reversed(getattr(request, 'admission', [])):
+        limiter.release(ticket)
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - request.start_time,
+                                         method=request.method, route=route)
+    metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    profiler.finish_trace(request.trace, request.method, request.full_path.rstrip('?'), response.status_code)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métriques au format texte Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def profile_response(result):
+    filename = f"rescuemap-{os.getpid()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return result, {'Content-Disposition': f'attachment; filename="{filename}"'}
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Profil des threads du processus au format collapsed (flamegraph)"""
+    profiler.ignore_trace()
+    if not profiler.profiling_enabled():
+        return jsonify({'success': False, 'error': 'Profilage désactivé'}), 404
+    if not profiler.check_token(request.headers.get('X-Profile-Token') or request.args.get('token')):
+        return jsonify({'success': False, 'error': 'Jeton invalide'}), 403
+
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Paramètre seconds invalide'}), 400
+    result = profiler.profile(seconds, include_idle=request.args.get('idle') == '1')
+    if result is None:
+        return jsonify({'success': False, 'error': 'Un profil est déjà en cours'}), 409
+
+    body, headers = profile_response(result)
+    return Response(body, mimetype='text/plain', headers=headers)
+
+def serve_asset(name):
+    result = frontend.asset_response(name, request.headers.get('Accept-Encoding'),
+                                     request.headers.get('If-None-Match'))
+    if result is None:
+        return jsonify({'success': False, 'error': 'Fichier introuvable'}), 404
+    status, body, headers = result
+    return Response(body, status=status, headers=headers)
 
 @app.route('/')
 def index():
-    return HTML
+    return serve_asset(frontend.PAGE)
+
+@app.route('/sw.js')
+def service_worker():
+    # Servi à la racine : sa portée couvre toute l'application
+    return serve_asset(frontend.SERVICE_WORKER)
+
+@app.route('/assets/<name>')
+def assets(name):
+    """Fichiers empreintés de l'interface (cache d'un an)"""
+    return serve_asset(name)
 
 @app.route('/api/supermarkets')
 def get_supermarkets():
     try:
         city = request.args.get('city', 'Toulouse')
+        scheduler.record_access(city)
         
         # S'assurer que la ville a des données
         ensure_city_data(city)
         
-        conn = sqlite3.connect('rescuemap.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM supermarkets WHERE LOWER(city) = LOWER(?) ORDER BY name', (city,))
-        results = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return jsonify(results)
+        return Response(city_supermarkets_json(city), mimetype='application/json')
     
     except Exception as e:
-        print(f"Erreur API supermarkets: {e}")
+        logger.exception("Erreur API supermarkets: %s", e)
         return jsonify([])
 
 @app.route('/api/load_city')
@@ -840,13 +839,10 @@ def load_city():
     """Charge les données pour une ville spécifique"""
     try:
         city = request.args.get('city', 'Toulouse')
+        scheduler.record_access(city)
         ensure_city_data(city)
         
-        conn = sqlite3.connect('rescuemap.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM supermarkets WHERE LOWER(city) = LOWER(?)', (city,))
-        count = cursor.fetchone()[0]
-        conn.close()
+        count = count_city_supermarkets(city)
         
         # Obtenir les coordonnées de la ville
         coordinates = get_city_coordinates(city)
@@ -867,11 +863,7 @@ def reset_city():
     try:
         city = request.args.get('city', 'Toulouse')
         
-        conn = sqlite3.connect('rescuemap.db')
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM supermarkets WHERE LOWER(city) = LOWER(?)', (city,))
-        conn.commit()
-        conn.close()
+        delete_city_supermarkets(city)
         
         # Recharger les données
         ensure_city_data(city)
@@ -889,22 +881,86 @@ def update_status():
         status = data.get('status')
         city = data.get('city', 'Toulouse')
         
-        conn = sqlite3.connect('rescuemap.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE supermarkets 
-            SET status = ?, last_verified = ?
-            WHERE id = ? AND LOWER(city) = LOWER(?)
-        ''', (status, datetime.now().isoformat(), shop_id, city))
-        
-        conn.commit()
-        conn.close()
+        set_shop_status(shop_id, status, city)
         
         return jsonify({'success': True})
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/nearest')
+def nearest():
+    """Supermarchés les plus proches d'une position (ex: ?lat=43.6&lon=1.44&k=5&status=safe)"""
+    try:
+        lat, lon, k, statuses = parse_nearest_args(request.args)
+        shops = query_nearest_supermarkets(lat, lon, k, statuses)
+        return jsonify({'success': True, 'lat': lat, 'lon': lon, 'count': len(shops), 'shops': shops})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/search')
+def search():
+    """Recherche plein texte (ex: ?q=leclerc gare&city=Toulouse&bbox=1.3,43.5,1.5,43.7)"""
+    try:
+        text, city, bbox, limit = parse_search_args(request.args)
+        shops = query_search(text, city, bbox, limit)
+        return jsonify({'success': True, 'query': text, 'count': len(shops), 'shops': shops})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/heatmap')
+def get_heatmap():
+    """Magasins par statut dans les cellules d'une grille (ex: ?bbox=-5,41,10,51&precision=2&status=looted)"""
+    try:
+        bbox, precision, statuses = parse_heatmap_args(request.args)
+        cells = query_heatmap(bbox, precision, statuses)
+        return jsonify({'success': True, 'precision': precision, 'count': len(cells), 'cells': cells})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/export')
+def export_supermarkets():
+    """Export en flux des magasins (ex: ?format=geojson&city=Toulouse ou ?format=ndjson&bbox=-5,41,10,51)"""
+    try:
+        format_name, city, bbox, statuses = parse_export_args(request.args)
+        _, mimetype, _ = export.FORMATS[format_name]
+        # stream_with_context : la requête (place d'admission, métriques) dure jusqu'au dernier octet
+        chunks = stream_with_context(export.export_chunks(format_name, city, bbox, statuses))
+        return Response(chunks, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{export.export_filename(format_name, city)}"'})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/changes')
+def get_changes():
+    """Modifications d'une ville depuis une version (ex: ?city=Toulouse&since=1200)"""
+    try:
+        city = request.args.get('city', 'Toulouse')
+        since = int(request.args.get('since', 0))
+        scheduler.record_access(city)
+        
+        # Première visite : la ville est chargée comme pour /api/supermarkets
+        ensure_city_data(city)
+        
+        return jsonify({'success': True, 'city': city, **query_city_changes(city, since)})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """Applique en une requête les actions mises en file hors ligne (statuts, messages)"""
+    try:
+        data = request.get_json()
+        return jsonify({'success': True, 'results': apply_batch(data.get('operations', []))})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/chat/messages')
 def get_chat_messages():
     """Récupère les messages de chat"""
@@ -926,22 +982,7 @@ def send_chat_message():
         if not message_text:
             return jsonify({'success': False, 'error': 'Message vide'})
         
-        # Charger les messages existants
-        messages = load_chat_messages()
-        
-        # Ajouter le nouveau message
-        new_message = {
-            'id': len(messages) + 1,
-            'user': user,
-            'message': message_text,
-            'city': city,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        messages.append(new_message)
-        
-        # Sauvegarder (garde automatiquement les 100 derniers)
-        save_chat_messages(messages)
+        new_message = add_chat_message(message_text, user, city)
         
         return jsonify({'success': True, 'message_id': new_message['id']})
     
@@ -952,36 +993,71 @@ def send_chat_message():
 def api_status():
     """Status de l'API et statistiques"""
     try:
-        conn = sqlite3.connect('rescuemap.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT city, COUNT(*) FROM supermarkets GROUP BY city')
-        cities_count = cursor.fetchall()
-        
-        cursor.execute('SELECT status, COUNT(*) FROM supermarkets GROUP BY status')
-        status_count = cursor.fetchall()
-        
-        conn.close()
+        return jsonify(collect_status())
+    except Exception as e:
+        return jsonify({'status': 'error', 'error': str(e)})
+
+def local_sync_manager():
+    """SyncManager de la base unique : la synchronisation n'existe pas en stockage réparti"""
+    if shards.enabled():
+        raise RuntimeError("Synchronisation indisponible en stockage réparti (RESCUEMAP_SHARD_DIR)")
+    return SyncManager(DB_PATH)
+
+@app.route('/api/sync/digest')
+def sync_digest():
+    """Expose l'arbre de hachage : racine et villes, buckets d'une ville ou lignes d'un bucket"""
+    try:
+        city = request.args.get('city')
+        cell = request.args.get('cell')
+        manager = local_sync_manager()
         
-        # Charger les stats du chat
-        messages = load_chat_messages()
+        if city is not None and cell is not None:
+            return jsonify({'city': city, 'cell': cell, 'rows': manager.get_bucket_rows(city, cell)})
+        if city is not None:
+            return jsonify({'city': city, 'buckets': manager.get_bucket_digests(city)})
         
-        return jsonify({
-            'status': 'online', 
-            'cities': dict(cities_count),
-            'status_distribution': dict(status_count),
-            'chat_messages': len(messages),
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify({'root': manager.get_root(), 'cities': manager.get_city_digests()})
     except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)})
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/sync/rows', methods=['POST'])
+def sync_rows():
+    """Renvoie les lignes demandées par un nœud pair"""
+    try:
+        data = request.get_json()
+        rows = local_sync_manager().export_rows(data.get('uids', []))
+        return jsonify({'success': True, 'rows': rows})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/sync/import', methods=['POST'])
+def sync_import():
+    """Applique les lignes poussées par un nœud pair (jeton partagé X-Sync-Token)"""
+    if not SYNC_TOKEN:
+        return jsonify({'success': False, 'error': 'Import désactivé (RESCUEMAP_SYNC_TOKEN)'}), 404
+    if not check_peer_token(request.headers.get('X-Sync-Token')):
+        return jsonify({'success': False, 'error': 'Jeton invalide'}), 403
+
+    try:
+        data = request.get_json()
+        local_sync_manager().import_changes({'changes': data.get('changes', [])})
+        return jsonify({'success': True, 'count': len(data.get('changes', []))})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
 
 if __name__ == '__main__':
+    metrics.configure_logging()
+    
     # Initialiser la base de données
     setup_database_schema()
     
+    port = int(os.environ.get('RESCUEMAP_PORT', 5000))
+    host = os.environ.get('RESCUEMAP_HOST', '0.0.0.0')
+    debug = os.environ.get('FLASK_DEBUG', 'True').lower() in ('1', 'true', 'yes')
+    
     print("🏙️  RescueMap Multi-Villes Amélioré - Chat Intégré")
     print("=" * 55)
-    print("🌐 Serveur accessible sur: http://localhost:5000")
+    print(f"🌐 Serveur accessible sur: http://localhost:{port}")
     print("📝 Fonctionnalités:")
     print("   • Saisie libre des villes")
     print("   • Chat en temps réel (100 derniers messages)")
@@ -989,4 +1065,9 @@ if __name__ == '__main__':
     print("   • Géolocalisation utilisateur")
     print("🚀 Prêt pour l'utilisation!")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # En debug, le processus parent du rechargeur ne sert pas de requêtes
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scheduler.Scheduler(ensure_city_data, city_supermarkets_json, refresh_city).start()
+        maintenance.Maintenance().start()
+    
+    app.run(host=host, port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,475 @@
+# server_async.py
+"""Mode de service asynchrone (ASGI) de RescueMap
+
+Mêmes routes que server.py, servies par Starlette. Les appels aux services
+externes (Nominatim, api-adresse, Overpass) passent par un client httpx
+asynchrone partagé et les accès SQLite par le pool de threads d'asyncio : un
+seul processus porte des centaines de chargements de villes en vol et des
+connexions longues (flux du chat) sans bloquer un thread par requête.
+
+    python server_async.py
+    uvicorn server_async:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, QueryParams
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import admission
+import export
+import frontend
+import geocoder
+import maintenance
+import metrics
+import profiler
+import scheduler
+import server
+import upstream
+
+logger = logging.getLogger('rescuemap.server_async')
+
+# Intervalle de vérification du fichier de chat pour le flux SSE (secondes)
+CHAT_POLL_INTERVAL = 1.0
+
+http_client = None
+
+# Chargements de villes en cours : une seule requête Overpass par ville
+_city_loads = {}
+
+async def try_geocoding_apis(city_name):
+    """Version asynchrone de server.try_geocoding_apis (requêtes couvertes annulables)"""
+    coordinates = await geocoder.aresolve(http_client, city_name)
+    if coordinates:
+        return coordinates
+
+    return server.approximate_city_match(city_name)
+
+async def get_city_coordinates(city_name):
+    """Version asynchrone de server.get_city_coordinates"""
+    coordinates = await asyncio.to_thread(server.lookup_local_coordinates, city_name)
+    metrics.record_cache('coordinates', coordinates is not None)
+    if coordinates:
+        return coordinates
+
+    coordinates = await try_geocoding_apis(city_name)
+    if coordinates:
+        logger.info("Coordonnées trouvées via API pour: %s", city_name)
+        await asyncio.to_thread(scheduler.record_coordinates, city_name, coordinates)
+        return coordinates
+
+    logger.warning("Ville inconnue: %s, utilisation des coordonnées par défaut", city_name)
+    return dict(server.DEFAULT_COORDINATES)
+
+async def download_supermarkets_for_city(city_name):
+    """Version asynchrone de server.download_supermarkets_for_city"""
+    city_coords = await get_city_coordinates(city_name)
+
+    if not server.is_default_coordinates(city_coords):
+        try:
+            logger.info("Recherche Overpass pour %s (rayon: %skm)", city_name, city_coords.get('radius', 10))
+
+            response = await upstream.get_client().arequest(
+                http_client, 'POST', upstream.OVERPASS_URL,
+                content=server.build_overpass_query(city_coords),
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                timeout=30
+            )
+
+            if response.status_code == 200:
+                elements = server.filter_by_reach(response.json().get('elements', []), city_coords)
+
+                if len(elements) > 0:
+                    logger.info("%d supermarchés trouvés via Overpass pour %s", len(elements), city_name)
+                    return elements
+                else:
+                    logger.warning("Aucun supermarché trouvé via Overpass pour %s, génération d'exemples", city_name)
+            else:
+                logger.error("Erreur Overpass HTTP %d pour %s", response.status_code, city_name)
+
+        except Exception as e:
+            logger.error("Erreur Overpass pour %s: %s", city_name, e)
+
+    logger.info("Génération de supermarchés d'exemple pour %s", city_name)
+    return server.generate_sample_supermarkets(city_name, city_coords)
+
+async def _load_city(city_name):
+    if await asyncio.to_thread(server.count_city_supermarkets, city_name) > 0:
+        return
+
+    logger.info("Chargement des supermarchés pour %s...", city_name)
+    start = time.perf_counter()
+    elements = await download_supermarkets_for_city(city_name)
+    inserted = await asyncio.to_thread(server.insert_city_supermarkets, city_name, elements)
+    metrics.INGESTION_SECONDS.observe(time.perf_counter() - start, source=server.ingestion_source(elements))
+    await asyncio.to_thread(scheduler.record_refresh, city_name)
+    logger.info("%d supermarchés chargés pour %s", inserted, city_name)
+
+async def ensure_city_data(city_name):
+    """S'assure qu'une ville a des données ; les requêtes simultanées partagent le même chargement"""
+    loaded = await asyncio.to_thread(server.count_city_supermarkets, city_name) > 0
+    metrics.record_cache('city_data', loaded)
+    if loaded:
+        return
+
+    key = city_name.strip().lower()
+    task = _city_loads.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_city(city_name))
+        _city_loads[key] = task
+        task.add_done_callback(lambda _: _city_loads.pop(key, None))
+
+    # shield : un client qui se déconnecte n'annule pas le chargement des autres
+    await asyncio.shield(task)
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return {}
+
+def serve_asset(request, name):
+    result = frontend.asset_response(name, request.headers.get('accept-encoding'),
+                                     request.headers.get('if-none-match'))
+    if result is None:
+        return JSONResponse({'success': False, 'error': 'Fichier introuvable'}, status_code=404)
+    status, body, headers = result
+    return Response(body, status_code=status, headers=headers)
+
+async def index(request):
+    return serve_asset(request, frontend.PAGE)
+
+async def service_worker(request):
+    return serve_asset(request, frontend.SERVICE_WORKER)
+
+async def assets(request):
+    return serve_asset(request, request.path_params['name'])
+
+async def get_supermarkets(request):
+    try:
+        city = request.query_params.get('city', 'Toulouse')
+        scheduler.record_access(city)
+        await ensure_city_data(city)
+        return Response(await asyncio.to_thread(server.city_supermarkets_json, city), media_type='application/json')
+    except Exception as e:
+        logger.exception("Erreur API supermarkets: %s", e)
+        return JSONResponse([])
+
+async def load_city(request):
+    try:
+        city = request.query_params.get('city', 'Toulouse')
+        scheduler.record_access(city)
+        await ensure_city_data(city)
+
+        count = await asyncio.to_thread(server.count_city_supermarkets, city)
+        coordinates = await get_city_coordinates(city)
+
+        return JSONResponse({
+            'success': True,
+            'count': count,
+            'city': city,
+            'coordinates': coordinates
+        })
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def reset_city(request):
+    try:
+        city = request.query_params.get('city', 'Toulouse')
+        await asyncio.to_thread(server.delete_city_supermarkets, city)
+        await ensure_city_data(city)
+        return JSONResponse({'success': True, 'city': city})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def update_status(request):
+    try:
+        data = await _json_body(request)
+        await asyncio.to_thread(server.set_shop_status, data.get('id'), data.get('status'),
+                                data.get('city', 'Toulouse'))
+        return JSONResponse({'success': True})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def nearest(request):
+    try:
+        lat, lon, k, statuses = server.parse_nearest_args(request.query_params)
+        shops = await asyncio.to_thread(server.query_nearest_supermarkets, lat, lon, k, statuses)
+        return JSONResponse({'success': True, 'lat': lat, 'lon': lon, 'count': len(shops), 'shops': shops})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def search(request):
+    try:
+        text, city, bbox, limit = server.parse_search_args(request.query_params)
+        shops = await asyncio.to_thread(server.query_search, text, city, bbox, limit)
+        return JSONResponse({'success': True, 'query': text, 'count': len(shops), 'shops': shops})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def get_heatmap(request):
+    try:
+        bbox, precision, statuses = server.parse_heatmap_args(request.query_params)
+        cells = await asyncio.to_thread(server.query_heatmap, bbox, precision, statuses)
+        return JSONResponse({'success': True, 'precision': precision, 'count': len(cells), 'cells': cells})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def export_supermarkets(request):
+    try:
+        format_name, city, bbox, statuses = server.parse_export_args(request.query_params)
+        _, media_type, _ = export.FORMATS[format_name]
+        # Itérateur synchrone : starlette lit chaque bloc dans un thread du pool
+        return StreamingResponse(export.export_chunks(format_name, city, bbox, statuses), media_type=media_type, headers={
+            'Content-Disposition': f'attachment; filename="{export.export_filename(format_name, city)}"'})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def get_changes(request):
+    try:
+        city = request.query_params.get('city', 'Toulouse')
+        since = int(request.query_params.get('since', 0))
+        scheduler.record_access(city)
+        await ensure_city_data(city)
+        changes = await asyncio.to_thread(server.query_city_changes, city, since)
+        return JSONResponse({'success': True, 'city': city, **changes})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def batch(request):
+    try:
+        data = await _json_body(request)
+        results = await asyncio.to_thread(server.apply_batch, data.get('operations', []))
+        return JSONResponse({'success': True, 'results': results})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def get_chat_messages(request):
+    try:
+        return JSONResponse(await asyncio.to_thread(server.load_chat_messages))
+    except Exception:
+        return JSONResponse([])
+
+async def send_chat_message(request):
+    try:
+        data = await _json_body(request)
+        message_text = data.get('message', '').strip()
+
+        if not message_text:
+            return JSONResponse({'success': False, 'error': 'Message vide'})
+
+        new_message = await asyncio.to_thread(server.add_chat_message, message_text,
+                                              data.get('user', 'Utilisateur'), data.get('city', 'Inconnue'))
+        return JSONResponse({'success': True, 'message_id': new_message['id']})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def chat_stream(request):
+    """Flux Server-Sent Events : renvoie les messages à chaque modification du chat"""
+    async def events():
+        last_mtime = None
+        while not await request.is_disconnected():
+            mtime = os.path.getmtime(server.CHAT_FILE) if os.path.exists(server.CHAT_FILE) else None
+            if mtime != last_mtime:
+                last_mtime = mtime
+                messages = await asyncio.to_thread(server.load_chat_messages)
+                yield f"data: {json.dumps(messages, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(CHAT_POLL_INTERVAL)
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+async def api_status(request):
+    try:
+        return JSONResponse(await asyncio.to_thread(server.collect_status))
+    except Exception as e:
+        return JSONResponse({'status': 'error', 'error': str(e)})
+
+def _sync_digest(city, cell):
+    manager = server.local_sync_manager()
+    if city is not None and cell is not None:
+        return {'city': city, 'cell': cell, 'rows': manager.get_bucket_rows(city, cell)}
+    if city is not None:
+        return {'city': city, 'buckets': manager.get_bucket_digests(city)}
+    return {'root': manager.get_root(), 'cities': manager.get_city_digests()}
+
+async def sync_digest(request):
+    try:
+        return JSONResponse(await asyncio.to_thread(_sync_digest, request.query_params.get('city'),
+                                                    request.query_params.get('cell')))
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def sync_rows(request):
+    try:
+        data = await _json_body(request)
+        rows = await asyncio.to_thread(server.local_sync_manager().export_rows, data.get('uids', []))
+        return JSONResponse({'success': True, 'rows': rows})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def sync_import(request):
+    if not server.SYNC_TOKEN:
+        return JSONResponse({'success': False, 'error': 'Import désactivé (RESCUEMAP_SYNC_TOKEN)'}, status_code=404)
+    if not server.check_peer_token(request.headers.get('X-Sync-Token')):
+        return JSONResponse({'success': False, 'error': 'Jeton invalide'}, status_code=403)
+
+    try:
+        data = await _json_body(request)
+        changes = data.get('changes', [])
+        await asyncio.to_thread(server.local_sync_manager().import_changes, {'changes': changes})
+        return JSONResponse({'success': True, 'count': len(changes)})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+async def debug_profile(request):
+    profiler.ignore_trace()
+    if not profiler.profiling_enabled():
+        return JSONResponse({'success': False, 'error': 'Profilage désactivé'}, status_code=404)
+    if not profiler.check_token(request.headers.get('X-Profile-Token') or request.query_params.get('token')):
+        return JSONResponse({'success': False, 'error': 'Jeton invalide'}, status_code=403)
+
+    try:
+        seconds = float(request.query_params.get('seconds', 10))
+    except ValueError:
+        return JSONResponse({'success': False, 'error': 'Paramètre seconds invalide'}, status_code=400)
+    # L'échantillonnage tourne dans un thread : la boucle d'événements reste observable
+    result = await asyncio.to_thread(profiler.profile, seconds, request.query_params.get('idle') == '1')
+    if result is None:
+        return JSONResponse({'success': False, 'error': 'Un profil est déjà en cours'}, status_code=409)
+
+    body, headers = server.profile_response(result)
+    return Response(body, media_type='text/plain', headers=headers)
+
+class MetricsMiddleware:
+    """Mesure la latence de chaque requête HTTP par route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {'code': 500}
+        trace = profiler.start_trace()
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Le routeur renseigne scope['endpoint'] : on retrouve le modèle de la route
+            route = ROUTE_TEMPLATES.get(scope.get('endpoint'), 'unmatched')
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope['method'], route=route)
+            metrics.HTTP_REQUESTS.inc(method=scope['method'], route=route, status=status['code'])
+            path = scope['path'] + ('?' + scope['query_string'].decode('latin-1') if scope['query_string'] else '')
+            profiler.finish_trace(trace, scope['method'], path, status['code'])
+
+class AdmissionMiddleware:
+    """Contrôle d'admission (voir admission.py) : 429 ou 503 avec Retry-After sous la charge"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not admission.is_limited(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope['path']
+        ingestion = False
+        if path in server.INGESTION_PATHS:
+            ingestion = await asyncio.to_thread(server.needs_ingestion, path, QueryParams(scope['query_string']))
+        priority = admission.request_priority(scope['method'], ingestion)
+        client = admission.client_key(scope['client'][0] if scope.get('client') else None, Headers(scope=scope))
+
+        tickets = []
+        try:
+            try:
+                if ingestion:
+                    tickets.append((admission.INGESTIONS, await admission.INGESTIONS.acquire_async(client, priority)))
+                tickets.append((admission.REQUESTS, await admission.REQUESTS.acquire_async(client, priority)))
+            except admission.Rejected as rejected:
+                response = JSONResponse({'success': False, 'error': str(rejected)}, status_code=rejected.status,
+                                        headers={'Retry-After': str(rejected.retry_after)})
+                await response(scope, receive, send)
+                return
+
+            await self.app(scope, receive, send)
+        finally:
+            for limiter, ticket in reversed(tickets):
+                limiter.release(ticket)
+
+@asynccontextmanager
+async def lifespan(app):
+    global http_client
+    await asyncio.to_thread(server.setup_database_schema)
+    http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=200, max_keepalive_connections=50))
+    # Thread de fond : fonctions synchrones de server.py (client HTTP partagé d'upstream.py)
+    background = scheduler.Scheduler(server.ensure_city_data, server.city_supermarkets_json,
+                                      server.refresh_city).start()
+    upkeep = maintenance.Maintenance().start()
+    try:
+        yield
+    finally:
+        background.stop(timeout=5)
+        upkeep.stop(timeout=5)
+        await http_client.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/sw.js', service_worker),
+        Route('/assets/{name}', assets),
+        Route('/api/supermarkets', get_supermarkets),
+        Route('/api/load_city', load_city),
+        Route('/api/reset_city', reset_city),
+        Route('/api/update_status', update_status, methods=['POST']),
+        Route('/api/nearest', nearest),
+        Route('/api/search', search),
+        Route('/api/heatmap', get_heatmap),
+        Route('/api/export', export_supermarkets),
+        Route('/api/changes', get_changes),
+        Route('/api/batch', batch, methods=['POST']),
+        Route('/api/chat/messages', get_chat_messages),
+        Route('/api/chat/send', send_chat_message, methods=['POST']),
+        Route('/api/chat/stream', chat_stream),
+        Route('/api/status', api_status),
+        Route('/api/sync/digest', sync_digest),
+        Route('/api/sync/rows', sync_rows, methods=['POST']),
+        Route('/api/sync/import', sync_import, methods=['POST']),
+        Route('/metrics', prometheus_metrics),
+        Route('/debug/profile', debug_profile),
+    ],
+    middleware=[Middleware(MetricsMiddleware), Middleware(AdmissionMiddleware)],
+    lifespan=lifespan,
+)
+
+ROUTE_TEMPLATES = {route.endpoint: route.path for route in app.routes}
+
+if __name__ == '__main__':
+    import uvicorn
+
+    metrics.configure_logging()
+    port = int(os.environ.get('RESCUEMAP_PORT', 5000))
+    host = os.environ.get('RESCUEMAP_HOST', '0.0.0.0')
+
+    print("🏙️  RescueMap Multi-Villes - Mode asynchrone (ASGI)")
+    print(f"🌐 Serveur accessible sur: http://localhost:{port}")
+    uvicorn.run(app, host=host, port=port)
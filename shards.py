@@ -0,0 +1,283 @@
+# shards.py
+"""Stockage optionnel réparti en une base SQLite par ville (ou par région)
+
+Activé par RESCUEMAP_SHARD_DIR : chaque ville est stockée dans
+`<dossier>/<ville>.db`. La réinitialisation d'une ville ou un chargement
+massif ne verrouillent que le fichier de cette ville, et une ville très
+sollicitée peut être déplacée (le fichier copié) sur son propre nœud.
+
+Le routage ville -> shard se fait par le nom normalisé de la ville (sans
+accents ni majuscules). Le fichier optionnel `<dossier>/shards.json`
+regroupe des villes dans un même shard (par région) ou place un shard
+ailleurs :
+
+    {"Toulouse": "occitanie", "Blagnac": "occitanie", "Paris": "/mnt/ssd/paris.db"}
+
+Les connexions sont ouvertes à la demande et gardées dans un pool commun au
+processus (au plus RESCUEMAP_SHARD_CONNECTIONS connexions libres, les moins
+récemment rendues sont fermées) : le serveur de développement de Werkzeug
+crée un thread par requête, un cache par thread ne resservirait jamais. Une
+connexion prêtée n'est utilisée que par un thread à la fois ; `close()`
+annule la transaction en cours et la rend au pool. Les requêtes sur toutes
+les villes (/api/status, /api/nearest) interrogent les shards en parallèle.
+Lire une ville dont le shard n'existe pas ne crée pas de fichier.
+
+Limites : un magasin présent dans deux villes de shards différents est
+stocké dans chacun (les statuts ne sont partagés qu'à l'intérieur d'un
+shard), les identifiants ne sont uniques que dans un shard, et la
+synchronisation entre nœuds (sync_manager) ne fonctionne qu'en base unique.
+
+Découper une base existante :
+
+    python shards.py split rescuemap.db --dir shards/
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import TimedConnection
+
+SHARD_DIR = os.environ.get('RESCUEMAP_SHARD_DIR')
+
+# Connexions libres gardées dans le pool, et threads des requêtes réparties
+MAX_CONNECTIONS = int(os.environ.get('RESCUEMAP_SHARD_CONNECTIONS', 16))
+FAN_OUT_WORKERS = int(os.environ.get('RESCUEMAP_SHARD_WORKERS', 8))
+
+MAP_FILE = 'shards.json'
+
+def enabled():
+    return bool(SHARD_DIR)
+
+def shard_key(city_name):
+    """Nom de fichier d'une ville : minuscules, sans accents ni caractères spéciaux"""
+    normalized = unicodedata.normalize('NFKD', city_name.strip().lower())
+    ascii_name = normalized.encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '-', ascii_name).strip('-') or 'sans-nom'
+
+class PooledConnection:
+    """Connexion d'un shard prêtée par le pool : close() la rend au lieu de la fermer"""
+
+    def __init__(self, router, path, conn):
+        object.__setattr__(self, '_router', router)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        conn.rollback()
+        conn.row_factory = None
+        self._router.release(self._path, conn)
+
+class ShardRouter:
+    def __init__(self, directory, mapping=None, max_connections=MAX_CONNECTIONS):
+        self.directory = directory
+        self.max_connections = max_connections
+        if mapping is None:
+            mapping = self._load_mapping()
+        self.mapping = {shard_key(city): target for city, target in mapping.items()}
+        # Connexions libres par shard ; l'ordre est celui des dernières restitutions
+        self.idle = OrderedDict()
+        self.lock = threading.Lock()
+        # Shards déjà migrés dans ce processus
+        self.migrated = set()
+        self.executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='shard')
+
+    def _load_mapping(self):
+        try:
+            with open(os.path.join(self.directory, MAP_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def shard_path(self, city_name):
+        target = self.mapping.get(shard_key(city_name), shard_key(city_name))
+        if target.endswith('.db'):
+            return target
+        return os.path.join(self.directory, f'{shard_key(target)}.db')
+
+    def shard_paths(self):
+        """Tous les shards existants"""
+        paths = {os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.endswith('.db')}
+        paths.update(target for target in self.mapping.values() if target.endswith('.db') and os.path.exists(target))
+        return sorted(paths)
+
+    def exists(self, city_name):
+        return os.path.exists(self.shard_path(city_name))
+
+    def _ensure_schema(self, path):
+        with self.lock:
+            if path in self.migrated:
+                return
+        from migrations import migrate
+
+        migrate(path)
+        with self.lock:
+            self.migrated.add(path)
+
+    def open(self, path):
+        """Connexion vers un shard, prise dans le pool ou ouverte (shard créé au besoin)"""
+        with self.lock:
+            connections = self.idle.get(path)
+            if connections:
+                conn = connections.pop()
+                if not connections:
+                    del self.idle[path]
+                return PooledConnection(self, path, conn)
+
+        self._ensure_schema(path)
+        # Rendue au pool, la connexion peut être reprise par un autre thread
+        conn = sqlite3.connect(path, factory=TimedConnection, check_same_thread=False)
+        return PooledConnection(self, path, conn)
+
+    def release(self, path, conn):
+        """Rend une connexion au pool ; au-delà de max_connections, les plus anciennes sont fermées"""
+        evicted = []
+        with self.lock:
+            self.idle.setdefault(path, []).append(conn)
+            self.idle.move_to_end(path)
+            idle_count = sum(len(connections) for connections in self.idle.values())
+            while idle_count > self.max_connections:
+                oldest_path, connections = next(iter(self.idle.items()))
+                evicted.append(connections.pop(0))
+                if not connections:
+                    del self.idle[oldest_path]
+                idle_count -= 1
+        for old in evicted:
+            old.close()
+
+    def connection(self, city_name):
+        return self.open(self.shard_path(city_name))
+
+    def fan_out(self, function):
+        """Applique function(conn) à chaque shard en parallèle ; retourne la liste des résultats"""
+        def run(path):
+            conn = self.open(path)
+            try:
+                return function(conn)
+            finally:
+                conn.close()
+
+        return list(self.executor.map(run, self.shard_paths()))
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            os.makedirs(SHARD_DIR, exist_ok=True)
+            _router = ShardRouter(SHARD_DIR)
+        return _router
+
+def connection(city_name):
+    return get_router().connection(city_name)
+
+def has_city(city_name):
+    """Vrai si le shard de la ville existe déjà (sans le créer)"""
+    return get_router().exists(city_name)
+
+def split_database(source, directory, mapping=None):
+    """Répartit une base unique en shards ; retourne {shard: nombre de magasins}"""
+    from sync_manager import SyncManager, SYNC_COLUMNS
+
+    os.makedirs(directory, exist_ok=True)
+    router = ShardRouter(directory, mapping)
+    # Ids conservés : supermarket_cities et status_events les référencent
+    columns = ', '.join(('id',) + SYNC_COLUMNS)
+
+    source_conn = sqlite3.connect(source)
+    source_cursor = source_conn.cursor()
+    source_cursor.execute('SELECT DISTINCT city FROM supermarket_cities')
+    cities = [row[0] for row in source_cursor.fetchall()]
+
+    by_shard = {}
+    for city in cities:
+        by_shard.setdefault(router.shard_path(city), []).append(city)
+
+    counts = {}
+    for path, shard_cities in by_shard.items():
+        conn = router.open(path)
+        cursor = conn.cursor()
+        placeholders = ', '.join('?' * len(shard_cities))
+        source_cursor.execute(f'''
+            SELECT DISTINCT {columns} FROM supermarkets
+            WHERE id IN (SELECT shop_id FROM supermarket_cities WHERE city IN ({placeholders}))
+        ''', shard_cities)
+        rows = source_cursor.fetchall()
+        values = ', '.join('?' * (len(SYNC_COLUMNS) + 1))
+        cursor.executemany(f'INSERT OR IGNORE INTO supermarkets ({columns}) VALUES ({values})', rows)
+
+        source_cursor.execute(f'SELECT shop_id, city FROM supermarket_cities WHERE city IN ({placeholders})',
+                              shard_cities)
+        cursor.executemany('INSERT OR IGNORE INTO supermarket_cities (shop_id, city) VALUES (?, ?)',
+                           source_cursor.fetchall())
+        # Le trigger d'insertion rattache aussi la ville d'origine : seules les
+        # villes routées vers ce shard y restent
+        cursor.execute(f'DELETE FROM supermarket_cities WHERE city NOT IN ({placeholders})', shard_cities)
+
+        source_cursor.execute(f'''
+            SELECT shop_id, city, status, timestamp FROM status_events
+            WHERE shop_id IN (SELECT shop_id FROM supermarket_cities WHERE city IN ({placeholders}))
+        ''', shard_cities)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO status_events (shop_id, city, status, timestamp) VALUES (?, ?, ?, ?)
+        ''', source_cursor.fetchall())
+        conn.commit()
+        conn.close()
+
+        SyncManager(path).rebuild_digests()
+        counts[os.path.basename(path)] = len(rows)
+
+    source_conn.close()
+    return counts
+
+def shard_stats(directory):
+    """(fichier, taille en octets, magasins, villes) pour chaque shard"""
+    router = ShardRouter(directory)
+    stats = []
+    for path in router.shard_paths():
+        conn = sqlite3.connect(path)
+        shops, cities = conn.execute('''
+            SELECT (SELECT COUNT(*) FROM supermarkets), (SELECT COUNT(DISTINCT city) FROM supermarket_cities)
+        ''').fetchone()
+        conn.close()
+        stats.append((os.path.basename(path), os.path.getsize(path), shops, cities))
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stockage réparti par ville")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    split_parser = commands.add_parser('split', help="Répartir une base unique en shards")
+    split_parser.add_argument('source', help="Base existante (ex: rescuemap.db)")
+    split_parser.add_argument('--dir', default=SHARD_DIR or 'shards', help="Dossier des shards")
+
+    list_parser = commands.add_parser('list', help="Lister les shards")
+    list_parser.add_argument('--dir', default=SHARD_DIR or 'shards', help="Dossier des shards")
+
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        print(f"🔀 Répartition de {args.source} dans {args.dir}...")
+        counts = split_database(args.source, args.dir)
+        print(f"✅ {len(counts)} shards, {sum(counts.values())} magasins")
+    elif args.command == 'list':
+        for name, size, shops, cities in shard_stats(args.dir):
+            print(f"🗄️  {name:<30} {size / 1024:>10.0f} Ko {shops:>8} magasins {cities:>4} villes")
@@ -0,0 +1,128 @@
+# spatial_index.py
+"""Index spatial R*Tree des supermarchés et recherche des k plus proches
+
+La table virtuelle `supermarkets_rtree` (module rtree de SQLite) contient la
+boîte (réduite à un point) de chaque magasin et est maintenue par des
+triggers sur `supermarkets`. Une recherche parcourt des boîtes de plus en
+plus grandes autour du point demandé, puis reclasse les candidats par
+distance exacte (haversine) : seuls les magasins à moins du rayon de la
+boîte sont certains d'être bien classés, on élargit donc jusqu'à en avoir k.
+La recherche ignore le découpage par ville. Quand le statut demandé est rare
+(peu de magasins pillés, par exemple), les candidats sont lus directement par
+l'index sur `status` et classés sans passer par les boîtes.
+"""
+import logging
+
+from geo import bounding_box, haversine_many
+
+logger = logging.getLogger('rescuemap.spatial_index')
+
+# Rayon de la première boîte de recherche et rayon maximal (km)
+INITIAL_RADIUS_KM = 2.0
+MAX_RADIUS_KM = 500.0
+
+MAX_K = 100
+
+# En dessous de ce nombre de magasins au statut demandé, on les classe tous directement
+SMALL_STATUS_SET = 5000
+
+def setup_spatial_schema(cursor):
+    """Crée l'index R*Tree, ses triggers, et l'alimente s'il est incomplet"""
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS supermarkets_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_rtree_insert
+        AFTER INSERT ON supermarkets
+        WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO supermarkets_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_rtree_update
+        AFTER UPDATE OF id, lat, lon ON supermarkets
+        BEGIN
+            DELETE FROM supermarkets_rtree WHERE id = OLD.id;
+            INSERT INTO supermarkets_rtree
+            SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+            WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_rtree_delete
+        AFTER DELETE ON supermarkets
+        BEGIN
+            DELETE FROM supermarkets_rtree WHERE id = OLD.id;
+        END
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_supermarkets_status ON supermarkets (status)')
+
+    # Bases existantes : remplir l'index une fois
+    cursor.execute('SELECT COUNT(*) FROM supermarkets WHERE lat IS NOT NULL AND lon IS NOT NULL')
+    expected = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM supermarkets_rtree')
+    if cursor.fetchone()[0] != expected:
+        logger.info("Construction de l'index spatial")
+        cursor.execute('DELETE FROM supermarkets_rtree')
+        cursor.execute('''
+            INSERT INTO supermarkets_rtree
+            SELECT id, lat, lat, lon, lon FROM supermarkets WHERE lat IS NOT NULL AND lon IS NOT NULL
+        ''')
+
+def _rank(rows, lat, lon, max_distance, k):
+    """Les k lignes les plus proches à moins de max_distance, triées par distance"""
+    import numpy as np
+
+    if not rows:
+        return []
+    distances = haversine_many(lat, lon,
+                               np.fromiter((row['lat'] for row in rows), np.float64, len(rows)),
+                               np.fromiter((row['lon'] for row in rows), np.float64, len(rows)))
+    order = np.flatnonzero(distances <= max_distance)
+    order = order[np.argsort(distances[order], kind='stable')][:k]
+    return [dict(rows[i], distance_km=round(float(distances[i]), 3)) for i in order]
+
+def find_nearest(cursor, lat, lon, k=5, statuses=None, max_radius_km=MAX_RADIUS_KM):
+    """Les k magasins les plus proches (avec 'distance_km'), filtrés par statut
+
+    Le curseur doit retourner des sqlite3.Row.
+    """
+    k = max(1, min(int(k), MAX_K))
+    status_filter = ''
+    status_params = []
+    if statuses:
+        placeholders = ', '.join('?' * len(statuses))
+        status_params = list(statuses)
+
+        cursor.execute(f'SELECT COUNT(*) FROM supermarkets WHERE status IN ({placeholders})', status_params)
+        if cursor.fetchone()[0] <= SMALL_STATUS_SET:
+            cursor.execute(f'''
+                SELECT * FROM supermarkets
+                WHERE status IN ({placeholders}) AND lat IS NOT NULL AND lon IS NOT NULL
+            ''', status_params)
+            return _rank(cursor.fetchall(), lat, lon, max_radius_km, k)
+
+        # Le "+" empêche SQLite de préférer l'index sur status à l'index spatial
+        status_filter = f"AND +s.status IN ({placeholders})"
+
+    radius = INITIAL_RADIUS_KM
+    while True:
+        radius = min(radius, max_radius_km)
+        south, north, west, east = bounding_box(lat, lon, radius)
+        cursor.execute(f'''
+            SELECT s.* FROM supermarkets_rtree r
+            JOIN supermarkets s ON s.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ?
+              AND r.max_lon >= ? AND r.min_lon <= ?
+              {status_filter}
+        ''', [south, north, west, east] + status_params)
+
+        shops = _rank(cursor.fetchall(), lat, lon, radius, k)
+        if len(shops) >= k or radius >= max_radius_km:
+            return shops
+
+        radius *= 4
@@ -0,0 +1,289 @@
+# sync_bundle.py
+"""Fichiers de synchronisation hors ligne (transfert par clé USB)
+
+Format d'un bundle :
+    MAGIC
+    en-tête    : longueur (4 octets) + JSON (nœud, watermark, colonnes)
+    chunks     : b'CHNK' + n° de chunk + longueur + SHA-256 + NDJSON compressé zlib
+    fin        : b'DONE' + nombre de chunks + nombre d'enregistrements + SHA-256 global
+
+Chaque chunk est appliqué dans sa propre transaction avec la progression
+(table sync_imports) : un import interrompu reprend au chunk suivant.
+
+Les magasins et leur historique de statuts sont désignés par leur uid
+(identité globale, voir sync_manager.py), jamais par l'id local. Les
+magasins supprimés depuis le watermark sont transmis comme pierres tombales
+(uid et date de suppression) : un pair qui n'importe que des bundles
+incrémentaux les supprime aussi.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import uuid
+import zlib
+from datetime import datetime
+
+from sync_manager import SyncManager, SYNC_COLUMNS, apply_row, apply_tombstone, get_node_id, setup_sync_schema
+
+MAGIC = b'RESCUEMAP-BUNDLE\x01\n'
+# Version de l'en-tête (2 : magasins et statuts désignés par uid ; 3 : pierres tombales)
+FORMAT = 3
+# Un bundle de format 2 ne contient simplement pas de suppressions
+SUPPORTED_FORMATS = (2, 3)
+CHUNK_HEADER = struct.Struct('>4sII')
+TRAILER = struct.Struct('>4sII')
+DIGEST_SIZE = 32
+
+# Nombre d'enregistrements par chunk : borne la mémoire à l'export et à l'import
+CHUNK_RECORDS = 500
+
+EVENT_COLUMNS = ('shop_uid', 'city', 'status', 'timestamp')
+TOMBSTONE_COLUMNS = ('uid', 'deleted_at')
+CHAT_COLUMNS = ('user', 'message', 'city', 'timestamp')
+
+class BundleError(Exception):
+    """Bundle corrompu, tronqué ou de format inconnu"""
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def _iter_records(cursor, since, chat_file):
+    """Parcourt les modifications depuis `since` sans tout charger en mémoire"""
+    if _table_exists(cursor, 'supermarkets'):
+        query = f'SELECT {", ".join(SYNC_COLUMNS)} FROM supermarkets'
+        cursor.execute(query + (' WHERE last_verified > ?' if since else ''), (since,) if since else ())
+        while True:
+            rows = cursor.fetchmany(CHUNK_RECORDS)
+            if not rows:
+                break
+            for row in rows:
+                yield ['s', list(row)]
+
+    query = '''
+        SELECT s.uid, e.city, e.status, e.timestamp
+        FROM status_events e JOIN supermarkets s ON s.id = e.shop_id
+    '''
+    cursor.execute(query + (' WHERE e.timestamp > ?' if since else ''), (since,) if since else ())
+    while True:
+        rows = cursor.fetchmany(CHUNK_RECORDS)
+        if not rows:
+            break
+        for row in rows:
+            yield ['e', list(row)]
+
+    if _table_exists(cursor, 'sync_tombstones'):
+        # Un magasin recréé depuis (même uid) n'est plus supprimé
+        query = '''
+            SELECT t.uid, t.deleted_at FROM sync_tombstones t
+            WHERE NOT EXISTS (SELECT 1 FROM supermarkets s WHERE s.uid = t.uid)
+        '''
+        cursor.execute(query + (' AND t.deleted_at > ?' if since else ''), (since,) if since else ())
+        while True:
+            rows = cursor.fetchmany(CHUNK_RECORDS)
+            if not rows:
+                break
+            for row in rows:
+                yield ['d', list(row)]
+
+    for message in _load_chat(chat_file):
+        if not since or message.get('timestamp', '') > since:
+            yield ['c', [message.get(column) for column in CHAT_COLUMNS]]
+
+def _load_chat(chat_file):
+    if chat_file and os.path.exists(chat_file):
+        try:
+            with open(chat_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('messages', [])
+        except (OSError, ValueError):
+            return []
+    return []
+
+def _write_chunk(f, seq, records, overall):
+    payload = zlib.compress(
+        '\n'.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) for record in records).encode('utf-8'),
+        9
+    )
+    digest = hashlib.sha256(payload).digest()
+    f.write(CHUNK_HEADER.pack(b'CHNK', seq, len(payload)))
+    f.write(digest)
+    f.write(payload)
+    overall.update(digest)
+
+def export_bundle(db_path, out_path, since=None, peer=None, chat_file='chat_messages.json'):
+    """Écrit un bundle des modifications depuis `since` (ou le watermark de `peer`)"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    setup_sync_schema(cursor)
+
+    if peer and since is None:
+        cursor.execute('SELECT exported_until FROM sync_peers WHERE peer = ?', (peer,))
+        result = cursor.fetchone()
+        since = result[0] if result else None
+
+    created = datetime.now().isoformat()
+    header = {
+        'format': FORMAT,
+        'bundle_id': uuid.uuid4().hex,
+        'node': get_node_id(cursor),
+        'created': created,
+        'since': since,
+        'columns': {'s': SYNC_COLUMNS, 'e': EVENT_COLUMNS, 'd': TOMBSTONE_COLUMNS, 'c': CHAT_COLUMNS},
+    }
+    conn.commit()
+
+    tmp_path = out_path + '.part'
+    overall = hashlib.sha256()
+    seq = 0
+    total = 0
+    with open(tmp_path, 'wb') as f:
+        encoded = json.dumps(header).encode('utf-8')
+        f.write(MAGIC)
+        f.write(struct.pack('>I', len(encoded)))
+        f.write(encoded)
+
+        # Curseur dédié aux lectures en flux (fetchmany)
+        records = []
+        for record in _iter_records(conn.cursor(), since, chat_file):
+            records.append(record)
+            if len(records) >= CHUNK_RECORDS:
+                _write_chunk(f, seq, records, overall)
+                seq += 1
+                total += len(records)
+                records = []
+        if records:
+            _write_chunk(f, seq, records, overall)
+            seq += 1
+            total += len(records)
+
+        f.write(TRAILER.pack(b'DONE', seq, total))
+        f.write(overall.digest())
+
+    os.replace(tmp_path, out_path)
+
+    if peer:
+        cursor.execute('''
+            INSERT INTO sync_peers (peer, exported_until) VALUES (?, ?)
+            ON CONFLICT(peer) DO UPDATE SET exported_until = excluded.exported_until
+        ''', (peer, created))
+        conn.commit()
+    conn.close()
+
+    return {'bundle_id': header['bundle_id'], 'since': since, 'chunks': seq, 'records': total}
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise BundleError("Bundle tronqué")
+    return data
+
+def _apply_chat(chat_file, messages):
+    existing = _load_chat(chat_file)
+    seen = {(m.get('timestamp'), m.get('user'), m.get('message')) for m in existing}
+    next_id = max((m.get('id', 0) for m in existing), default=0) + 1
+
+    for message in messages:
+        key = (message['timestamp'], message['user'], message['message'])
+        if key in seen:
+            continue
+        seen.add(key)
+        existing.append(dict(message, id=next_id))
+        next_id += 1
+
+    existing.sort(key=lambda m: m.get('timestamp') or '')
+    existing = existing[-100:]
+    with open(chat_file, 'w', encoding='utf-8') as f:
+        json.dump({'messages': existing, 'last_updated': datetime.now().isoformat()}, f, ensure_ascii=False, indent=2)
+
+def import_bundle(db_path, in_path, chat_file='chat_messages.json'):
+    """Applique un bundle en flux, chunk par chunk, en reprenant là où un import précédent s'est arrêté"""
+    # Les digests doivent refléter les lignes existantes avant les mises à jour incrémentales
+    SyncManager(db_path).ensure_digests()
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    setup_sync_schema(cursor)
+    conn.commit()
+
+    # Une erreur (chunk corrompu, coupure) ne laisse pas la base verrouillée
+    try:
+        with open(in_path, 'rb') as f:
+            if _read_exact(f, len(MAGIC)) != MAGIC:
+                raise BundleError("Ce fichier n'est pas un bundle RescueMap")
+            header_size = struct.unpack('>I', _read_exact(f, 4))[0]
+            header = json.loads(_read_exact(f, header_size))
+            if header.get('format') not in SUPPORTED_FORMATS:
+                raise BundleError(f"Version de bundle non prise en charge: {header.get('format')}")
+            columns = header['columns']
+
+            cursor.execute('SELECT last_chunk FROM sync_imports WHERE bundle_id = ?', (header['bundle_id'],))
+            result = cursor.fetchone()
+            resume_after = result[0] if result else -1
+
+            overall = hashlib.sha256()
+            applied = 0
+            while True:
+                tag, seq, size = CHUNK_HEADER.unpack(_read_exact(f, CHUNK_HEADER.size))
+                if tag == b'DONE':
+                    chunk_count, total = seq, size
+                    if overall.digest() != _read_exact(f, DIGEST_SIZE):
+                        raise BundleError("Somme de contrôle globale invalide")
+                    break
+                if tag != b'CHNK':
+                    raise BundleError(f"Chunk inattendu: {tag!r}")
+
+                digest = _read_exact(f, DIGEST_SIZE)
+                overall.update(digest)
+                if seq <= resume_after:
+                    # Chunk déjà appliqué lors d'un import précédent
+                    f.seek(size, os.SEEK_CUR)
+                    continue
+
+                payload = _read_exact(f, size)
+                if hashlib.sha256(payload).digest() != digest:
+                    raise BundleError(f"Chunk {seq} corrompu")
+
+                shops, events, tombstones, messages = [], [], [], []
+                for line in zlib.decompress(payload).decode('utf-8').split('\n'):
+                    kind, values = json.loads(line)
+                    record = dict(zip(columns[kind], values))
+                    if kind == 's':
+                        shops.append(record)
+                    elif kind == 'e':
+                        events.append(record)
+                    elif kind == 'd':
+                        tombstones.append(record)
+                    elif kind == 'c':
+                        messages.append(record)
+
+                for row in shops:
+                    apply_row(cursor, row)
+                # Les magasins d'un bundle précèdent leurs statuts : le uid est déjà connu localement
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO status_events (shop_id, city, status, timestamp)
+                    SELECT id, ?, ?, ? FROM supermarkets WHERE uid = ?
+                ''', [(event['city'], event['status'], event['timestamp'], event['shop_uid']) for event in events])
+                for tombstone in tombstones:
+                    apply_tombstone(cursor, tombstone['uid'], tombstone['deleted_at'])
+                if messages and chat_file:
+                    # Fusion idempotente : rejouer ce chunk après une coupure ne duplique rien
+                    _apply_chat(chat_file, messages)
+                cursor.execute('''
+                    INSERT INTO sync_imports (bundle_id, last_chunk) VALUES (?, ?)
+                    ON CONFLICT(bundle_id) DO UPDATE SET last_chunk = excluded.last_chunk
+                ''', (header['bundle_id'], seq))
+                conn.commit()
+                applied += 1
+
+        cursor.execute('''
+            INSERT INTO sync_peers (peer, imported_until) VALUES (?, ?)
+            ON CONFLICT(peer) DO UPDATE SET imported_until = excluded.imported_until
+        ''', (header['node'], header['created']))
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {'bundle_id': header['bundle_id'], 'node': header['node'], 'chunks': chunk_count,
+            'applied_chunks': applied, 'records': total}
@@ -1,46 +1,583 @@
 # sync_manager.py
-import sqlite3
+"""Synchronisation entre nœuds : arbre de hachage (anti-entropie) et import des lignes
+
+Un magasin est identifié entre nœuds par son `uid`, jamais par son `id`
+local (AUTOINCREMENT, différent d'un nœud à l'autre selon l'ordre des
+chargements) : `osm:<osm_id>` pour un élément OpenStreetMap, sinon
+`<node_id>:<id>` (identifiant du nœud qui l'a créé, table sync_meta). Le uid
+est attribué par trigger à l'insertion et ne change plus ; une ligne reçue
+garde le uid de son nœud d'origine.
+
+Une suppression laisse une pierre tombale (table sync_tombstones : uid et
+date) transmise par les bundles ; elle l'emporte sur les versions plus
+anciennes du magasin.
+"""
 import hashlib
+import hmac
 import json
+import os
+import sqlite3
+import uuid
 from datetime import datetime
 
+from geo import geohash_bounds, geohash_encode
+
+# Colonnes prises en compte pour la comparaison entre nœuds (sans l'id local)
+SYNC_COLUMNS = ('uid', 'osm_id', 'name', 'lat', 'lon', 'type', 'address', 'status',
+                'last_verified', 'notes', 'city')
+
+# Jeton partagé entre nœuds pairs, exigé par /api/sync/import (import désactivé sans jeton)
+SYNC_TOKEN = os.environ.get('RESCUEMAP_SYNC_TOKEN')
+
+# Précision geohash des buckets (cellules d'environ 39 x 20 km)
+BUCKET_PRECISION = 4
+
+EMPTY_DIGEST = '0' * 40
+
+def setup_sync_schema(cursor):
+    """Crée la table des digests de l'arbre de hachage"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_buckets (
+            city TEXT,
+            cell TEXT,
+            digest TEXT,
+            row_count INTEGER,
+            PRIMARY KEY (city, cell)
+        )
+    ''')
+
+    # Historique des changements de statut (échangé dans les bundles)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS status_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shop_id INTEGER,
+            city TEXT,
+            status TEXT,
+            timestamp TEXT,
+            UNIQUE (shop_id, status, timestamp)
+        )
+    ''')
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS sync_meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    # Watermarks par nœud pair et progression des imports de bundles
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            peer TEXT PRIMARY KEY,
+            exported_until TEXT,
+            imported_until TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_imports (
+            bundle_id TEXT PRIMARY KEY,
+            last_chunk INTEGER
+        )
+    ''')
+
+def get_node_id(cursor):
+    """Identifiant de ce nœud (créé au premier appel)"""
+    cursor.execute("SELECT value FROM sync_meta WHERE key = 'node_id'")
+    result = cursor.fetchone()
+    if result:
+        return result[0]
+    node_id = uuid.uuid4().hex
+    cursor.execute("INSERT INTO sync_meta (key, value) VALUES ('node_id', ?)", (node_id,))
+    return node_id
+
+def setup_identity_schema(cursor):
+    """Ajoute l'identité globale `uid` des magasins, son trigger, et la remplit"""
+    cursor.execute('PRAGMA table_info(supermarkets)')
+    if 'uid' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE supermarkets ADD COLUMN uid TEXT')
+    node_id = get_node_id(cursor)
+    cursor.execute('''
+        UPDATE supermarkets
+        SET uid = CASE WHEN osm_id IS NOT NULL THEN 'osm:' || osm_id ELSE ? || ':' || id END
+        WHERE uid IS NULL
+    ''', (node_id,))
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_supermarkets_uid ON supermarkets (uid)')
+
+    # Ne touche qu'à uid : les triggers des autres colonnes ne sont pas déclenchés
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS supermarkets_uid_insert
+        AFTER INSERT ON supermarkets
+        WHEN NEW.uid IS NULL
+        BEGIN
+            UPDATE supermarkets
+            SET uid = CASE WHEN NEW.osm_id IS NOT NULL THEN 'osm:' || NEW.osm_id
+                      ELSE (SELECT value FROM sync_meta WHERE key = 'node_id') || ':' || NEW.id END
+            WHERE id = NEW.id;
+        END
+    ''')
+
+def setup_tombstone_schema(cursor):
+    """Crée la table des magasins supprimés et le trigger qui la remplit"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_tombstones (
+            uid TEXT PRIMARY KEY,
+            deleted_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted_at ON sync_tombstones (deleted_at)')
+    # Même format que datetime.now().isoformat() (heure locale), comparable à last_verified ;
+    # SQLite s'arrête à la milliseconde : '999' place la suppression après tout ce qui
+    # s'est passé dans la même milliseconde. DELETE puis INSERT : pas de politique de
+    # conflit héritée de l'instruction extérieure
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS sync_tombstones_delete
+        AFTER DELETE ON supermarkets
+        WHEN OLD.uid IS NOT NULL
+        BEGIN
+            DELETE FROM sync_tombstones WHERE uid = OLD.uid;
+            INSERT INTO sync_tombstones (uid, deleted_at)
+            VALUES (OLD.uid, strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime') || '999');
+        END
+    ''')
+
+def city_key(city):
+    """Ville normalisée des buckets (minuscules Unicode : LOWER() de SQLite ne traite que l'ASCII)"""
+    return (city or '').strip().lower()
+
+def bucket_key(row):
+    """Retourne le bucket (ville, cellule geohash) d'un supermarché"""
+    city = city_key(row.get('city'))
+    if row.get('lat') is None or row.get('lon') is None:
+        return city, ''
+    return city, geohash_encode(row['lat'], row['lon'], BUCKET_PRECISION)
+
+def row_digest(row):
+    """Empreinte SHA-1 du contenu synchronisé d'un supermarché"""
+    payload = json.dumps([row.get(column) for column in SYNC_COLUMNS],
+                         ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _xor_digests(a, b):
+    return format(int(a, 16) ^ int(b, 16), '040x')
+
+def _hash_children(children):
+    """Digest d'un nœud interne à partir de ses enfants triés"""
+    h = hashlib.sha1()
+    for key, digest in sorted(children.items()):
+        h.update(f"{key}:{digest}\n".encode('utf-8'))
+    return h.hexdigest()
+
+def _newer(row, other):
+    """Vrai si `row` doit remplacer `other` (dernière vérification, puis empreinte)"""
+    if other is None:
+        return True
+    return ((row['last_verified'] or '', row_digest(row)) >
+            (other['last_verified'] or '', row_digest(other)))
+
+def fetch_row(cursor, shop_id):
+    """Lit un supermarché sous forme de dict (None s'il n'existe pas)"""
+    cursor.execute(f'SELECT {", ".join(SYNC_COLUMNS)} FROM supermarkets WHERE id = ?', (shop_id,))
+    result = cursor.fetchone()
+    return dict(zip(SYNC_COLUMNS, result)) if result else None
+
+def find_shop(cursor, row):
+    """Id local du magasin reçu `row` : même uid, sinon même osm_id ; None s'il est nouveau"""
+    cursor.execute('SELECT id FROM supermarkets WHERE uid = ?', (row['uid'],))
+    result = cursor.fetchone()
+    if result is None and row.get('osm_id') is not None:
+        cursor.execute('SELECT id FROM supermarkets WHERE osm_id = ?', (row['osm_id'],))
+        result = cursor.fetchone()
+    return result[0] if result else None
+
+def apply_row(cursor, row):
+    """Écrit un magasin reçu d'un autre nœud ; retourne vrai si la base a changé
+
+    Upsert sur l'identité globale, jamais sur l'id local. La ligne la plus
+    récente l'emporte. Un même nœud OSM connu sous deux uid (osm_id attribué
+    après coup à un magasin d'exemple) garde le plus petit des deux, sur
+    chaque nœud : les arbres convergent.
+    """
+    shop_id = find_shop(cursor, row)
+    if shop_id is None:
+        # Supprimé ici après cette version : ne pas le recréer
+        cursor.execute('SELECT deleted_at FROM sync_tombstones WHERE uid = ?', (row['uid'],))
+        tombstone = cursor.fetchone()
+        if tombstone and tombstone[0] >= (row.get('last_verified') or ''):
+            return False
+        cursor.execute(f'''
+            INSERT INTO supermarkets ({", ".join(SYNC_COLUMNS)})
+            VALUES ({", ".join('?' * len(SYNC_COLUMNS))})
+        ''', [row.get(column) for column in SYNC_COLUMNS])
+        record_row_change(cursor, new_row=fetch_row(cursor, cursor.lastrowid))
+        return True
+
+    current = fetch_row(cursor, shop_id)
+    source = row if _newer(row, current) else current
+    values = {column: source.get(column) for column in SYNC_COLUMNS}
+    values['uid'] = min(row['uid'], current['uid'])
+    if values == current:
+        return False
+
+    if values['osm_id'] is not None:
+        # osm_id déjà porté par un autre magasin local : c'est le même, on les fusionne
+        cursor.execute('SELECT id FROM supermarkets WHERE osm_id = ? AND id != ?', (values['osm_id'], shop_id))
+        duplicate = cursor.fetchone()
+        if duplicate:
+            from dedup import merge_shop
+
+            merge_shop(cursor, shop_id, duplicate[0])
+            current = fetch_row(cursor, shop_id)
+
+    cursor.execute(f'''
+        UPDATE supermarkets SET {", ".join(f"{column} = ?" for column in SYNC_COLUMNS)} WHERE id = ?
+    ''', [values[column] for column in SYNC_COLUMNS] + [shop_id])
+    record_row_change(cursor, current, fetch_row(cursor, shop_id))
+    return True
+
+def apply_tombstone(cursor, uid, deleted_at):
+    """Supprime un magasin supprimé sur un autre nœud ; retourne vrai si la base a changé
+
+    Une version locale vérifiée après la suppression est gardée.
+    """
+    cursor.execute("SELECT id FROM supermarkets WHERE uid = ? AND COALESCE(last_verified, '') <= ?",
+                   (uid, deleted_at))
+    result = cursor.fetchone()
+    if result is None:
+        return False
+    old_row = fetch_row(cursor, result[0])
+    cursor.execute('DELETE FROM supermarkets WHERE id = ?', (result[0],))
+    record_row_change(cursor, old_row=old_row)
+    return True
+
+def check_peer_token(token):
+    """Vrai si l'import entre pairs est activé et que le jeton est le bon"""
+    return bool(SYNC_TOKEN) and token is not None and hmac.compare_digest(token, SYNC_TOKEN)
+
+def _apply_to_bucket(cursor, row, delta):
+    city, cell = bucket_key(row)
+    digest = row_digest(row)
+
+    cursor.execute('SELECT digest, row_count FROM sync_buckets WHERE city = ? AND cell = ?', (city, cell))
+    current = cursor.fetchone()
+    if current:
+        digest = _xor_digests(current[0], digest)
+        count = current[1] + delta
+    else:
+        count = delta
+
+    if count <= 0:
+        cursor.execute('DELETE FROM sync_buckets WHERE city = ? AND cell = ?', (city, cell))
+    else:
+        cursor.execute('''
+            INSERT OR REPLACE INTO sync_buckets (city, cell, digest, row_count)
+            VALUES (?, ?, ?, ?)
+        ''', (city, cell, digest, count))
+
+def record_row_change(cursor, old_row=None, new_row=None):
+    """Met à jour incrémentalement les buckets touchés par une écriture
+
+    Le digest d'un bucket est le XOR des empreintes de ses lignes : retirer
+    l'ancienne version et ajouter la nouvelle coûte O(1), sans relire le bucket.
+    """
+    if old_row:
+        _apply_to_bucket(cursor, old_row, -1)
+    if new_row:
+        _apply_to_bucket(cursor, new_row, 1)
+
 class SyncManager:
     def __init__(self, db_path):
         self.db_path = db_path
-    
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
     def export_changes(self, since_timestamp):
         """Exporter les modifications récentes"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
-        
+
         cursor.execute('''
-            SELECT * FROM supermarkets 
+            SELECT * FROM supermarkets
             WHERE last_verified > ?
         ''', (since_timestamp,))
-        
+
         changes = [dict(row) for row in cursor.fetchall()]
         conn.close()
-        
+
         return {
             'timestamp': datetime.now().isoformat(),
             'changes': changes
         }
-    
+
     def import_changes(self, changes_data):
-        """Importer les modifications d'un autre nœud"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        for change in changes_data['changes']:
-            cursor.execute('''
-                INSERT OR REPLACE INTO supermarkets 
-                (id, name, lat, lon, type, address, status, last_verified)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                change['id'], change['name'], change['lat'], change['lon'],
-                change['type'], change['address'], change['status'], 
-                change['last_verified']
-            ))
-        
+        """Importer les modifications d'un autre nœud ; retourne le nombre de lignes modifiées"""
+        self.ensure_digests()
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        applied = sum(apply_row(cursor, change) for change in changes_data['changes'])
+        conn.commit()
+        conn.close()
+        return applied
+
+    # ===== ARBRE DE HACHAGE (ANTI-ENTROPIE) =====
+
+    def ensure_digests(self):
+        """Crée la table des digests et la remplit si elle est vide"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        setup_sync_schema(cursor)
+        conn.commit()
+
+        cursor.execute('SELECT COUNT(*) FROM sync_buckets')
+        empty = cursor.fetchone()[0] == 0
+        conn.close()
+
+        if empty:
+            self.rebuild_digests()
+
+    def rebuild_digests(self, cities=None):
+        """Recalcule entièrement les buckets (toutes les villes ou une liste)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        setup_sync_schema(cursor)
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'supermarkets'")
+        if not cursor.fetchone():
+            conn.close()
+            return
+
+        query = f'SELECT {", ".join(SYNC_COLUMNS)} FROM supermarkets'
+        if cities is None:
+            cursor.execute('DELETE FROM sync_buckets')
+            cursor.execute(query)
+        else:
+            # Normalisation d'un seul côté, en Python (city_key), pour les deux membres
+            conn.create_function('city_key', 1, city_key, deterministic=True)
+            keys = sorted({city_key(city) for city in cities})
+            placeholders = ', '.join('?' * len(keys))
+            cursor.execute(f'DELETE FROM sync_buckets WHERE city IN ({placeholders})', keys)
+            cursor.execute(f'{query} WHERE city_key(city) IN ({placeholders})', keys)
+
+        buckets = {}
+        for result in cursor.fetchall():
+            row = dict(zip(SYNC_COLUMNS, result))
+            key = bucket_key(row)
+            digest, count = buckets.get(key, (EMPTY_DIGEST, 0))
+            buckets[key] = (_xor_digests(digest, row_digest(row)), count + 1)
+
+        cursor.executemany('''
+            INSERT OR REPLACE INTO sync_buckets (city, cell, digest, row_count)
+            VALUES (?, ?, ?, ?)
+        ''', [(city, cell, digest, count) for (city, cell), (digest, count) in buckets.items()])
+
         conn.commit()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    def get_bucket_digests(self, city):
+        """Niveau 2 : digest de chaque cellule geohash d'une ville"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT cell, digest FROM sync_buckets WHERE city = ?', (city_key(city),))
+        buckets = dict(cursor.fetchall())
+        conn.close()
+        return buckets
+
+    def get_city_digests(self):
+        """Niveau 1 : digest de chaque ville"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT city, cell, digest FROM sync_buckets')
+
+        cities = {}
+        for city, cell, digest in cursor.fetchall():
+            cities.setdefault(city, {})[cell] = digest
+        conn.close()
+
+        return {city: _hash_children(cells) for city, cells in cities.items()}
+
+    def get_root(self):
+        """Racine de l'arbre : identique sur deux nœuds synchronisés"""
+        return _hash_children(self.get_city_digests())
+
+    def get_bucket_rows(self, city, cell):
+        """Niveau 3 : empreinte de chaque ligne d'un bucket, par uid
+
+        Seuls les magasins de la boîte de la cellule (index R*Tree) sont lus ;
+        leur bucket exact est vérifié en Python (ville normalisée, geohash des
+        points en bordure).
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        columns = ', '.join(f's.{column}' for column in SYNC_COLUMNS)
+        if cell:
+            south, north, west, east = geohash_bounds(cell)
+            cursor.execute(f'''
+                SELECT {columns} FROM supermarkets_rtree r JOIN supermarkets s ON s.id = r.id
+                WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+            ''', (south, north, west, east))
+        else:
+            cursor.execute(f'SELECT {columns} FROM supermarkets s WHERE s.lat IS NULL OR s.lon IS NULL')
+
+        key = (city_key(city), cell)
+        rows = {}
+        for result in cursor.fetchall():
+            row = dict(zip(SYNC_COLUMNS, result))
+            if bucket_key(row) == key:
+                rows[row['uid']] = row_digest(row)
+        conn.close()
+
+        return rows
+
+    def export_rows(self, uids):
+        """Exporte les lignes demandées par un autre nœud (par uid)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        rows = []
+        for uid in uids:
+            cursor.execute(f'SELECT {", ".join(SYNC_COLUMNS)} FROM supermarkets WHERE uid = ?', (uid,))
+            result = cursor.fetchone()
+            if result:
+                rows.append(dict(zip(SYNC_COLUMNS, result)))
+        conn.close()
+        return rows
+
+    def reconcile(self, peer, push=True):
+        """Réconcilie ce nœud avec un pair en ne descendant que dans les branches différentes
+
+        `peer` expose les mêmes méthodes que SyncManager (get_root, get_city_digests,
+        get_bucket_digests, get_bucket_rows, export_rows, import_changes), par exemple
+        un autre SyncManager local ou un HttpPeer. En cas de conflit, la ligne dont
+        `last_verified` est la plus récente l'emporte.
+        """
+        stats = {'buckets_compared': 0, 'rows_pulled': 0, 'rows_pushed': 0}
+
+        if self.get_root() == peer.get_root():
+            return stats
+
+        local_cities = self.get_city_digests()
+        remote_cities = peer.get_city_digests()
+
+        to_pull = []
+        to_push = []
+        for city in set(local_cities) | set(remote_cities):
+            if local_cities.get(city) == remote_cities.get(city):
+                continue
+
+            local_buckets = self.get_bucket_digests(city) if city in local_cities else {}
+            remote_buckets = peer.get_bucket_digests(city) if city in remote_cities else {}
+
+            for cell in set(local_buckets) | set(remote_buckets):
+                if local_buckets.get(cell) == remote_buckets.get(cell):
+                    continue
+                stats['buckets_compared'] += 1
+
+                local_rows = self.get_bucket_rows(city, cell) if cell in local_buckets else {}
+                remote_rows = peer.get_bucket_rows(city, cell) if cell in remote_buckets else {}
+
+                for uid in set(local_rows) | set(remote_rows):
+                    if local_rows.get(uid) == remote_rows.get(uid):
+                        continue
+                    if uid not in local_rows:
+                        to_pull.append(uid)
+                    elif uid not in remote_rows:
+                        to_push.append(uid)
+                    else:
+                        # Conflit : départagé plus bas une fois les lignes chargées
+                        to_pull.append(uid)
+                        to_push.append(uid)
+
+        remote = {row['uid']: row for row in peer.export_rows(to_pull)} if to_pull else {}
+        local = {row['uid']: row for row in self.export_rows(to_push)} if to_push else {}
+
+        pulled = [row for uid, row in remote.items() if _newer(row, local.get(uid))]
+        pushed = [row for uid, row in local.items() if _newer(row, remote.get(uid))]
+
+        if pulled:
+            self.import_changes({'changes': pulled})
+        if pushed and push:
+            peer.import_changes({'changes': pushed})
+
+        stats['rows_pulled'] = len(pulled)
+        stats['rows_pushed'] = len(pushed) if push else 0
+        return stats
+
+    # ===== BUNDLES HORS LIGNE =====
+
+    def export_bundle(self, out_path, since=None, peer=None, chat_file='chat_messages.json'):
+        """Écrit un fichier bundle des modifications (voir sync_bundle.py)"""
+        from sync_bundle import export_bundle
+        return export_bundle(self.db_path, out_path, since=since, peer=peer, chat_file=chat_file)
+
+    def import_bundle(self, in_path, chat_file='chat_messages.json'):
+        """Applique un fichier bundle reçu d'un autre nœud"""
+        from sync_bundle import import_bundle
+        return import_bundle(self.db_path, in_path, chat_file=chat_file)
+
+class HttpPeer:
+    """Pair distant joint via les routes /api/sync/* de server.py"""
+
+    def __init__(self, base_url, timeout=30, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.token = token or SYNC_TOKEN
+
+    def _get_digest(self, **params):
+        import requests
+        response = requests.get(f"{self.base_url}/api/sync/digest", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _post(self, path, payload):
+        import requests
+        headers = {'X-Sync-Token': self.token} if self.token else {}
+        response = requests.post(f"{self.base_url}{path}", json=payload, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_root(self):
+        return self._get_digest()['root']
+
+    def get_city_digests(self):
+        return self._get_digest()['cities']
+
+    def get_bucket_digests(self, city):
+        return self._get_digest(city=city)['buckets']
+
+    def get_bucket_rows(self, city, cell):
+        return self._get_digest(city=city, cell=cell)['rows']
+
+    def export_rows(self, uids):
+        return self._post('/api/sync/rows', {'uids': list(uids)})['rows']
+
+    def import_changes(self, changes_data):
+        self._post('/api/sync/import', changes_data)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Synchronisation RescueMap entre nœuds")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    bundle = commands.add_parser('bundle', help="Bundles hors ligne (clé USB)")
+    bundle_commands = bundle.add_subparsers(dest='action', required=True)
+
+    export_parser = bundle_commands.add_parser('export', help="Écrire un bundle")
+    export_parser.add_argument('out', help="Fichier bundle à écrire")
+    export_parser.add_argument('--db', default='rescuemap.db')
+    export_parser.add_argument('--chat', default='chat_messages.json')
+    export_parser.add_argument('--since', help="Timestamp ISO de départ")
+    export_parser.add_argument('--peer', help="Nœud destinataire (utilise son watermark)")
+
+    import_parser = bundle_commands.add_parser('import', help="Appliquer un bundle")
+    import_parser.add_argument('bundle', help="Fichier bundle à lire")
+    import_parser.add_argument('--db', default='rescuemap.db')
+    import_parser.add_argument('--chat', default='chat_messages.json')
+
+    args = parser.parse_args()
+    manager = SyncManager(args.db)
+
+    if args.action == 'export':
+        result = manager.export_bundle(args.out, since=args.since, peer=args.peer, chat_file=args.chat)
+        print(f"📦 Bundle {args.out} écrit: {result['records']} enregistrements en {result['chunks']} chunks")
+    else:
+        result = manager.import_bundle(args.bundle, chat_file=args.chat)
+        print(f"✅ Bundle du nœud {result['node']} appliqué: "
+              f"{result['applied_chunks']}/{result['chunks']} chunks ({result['records']} enregistrements)")
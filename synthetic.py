@@ -0,0 +1,272 @@
+# synthetic.py
+"""Générateur de données synthétiques reproductibles (tests de charge, benchmarks)
+
+Tout est tiré d'un générateur NumPy initialisé par une graine : mêmes
+paramètres, mêmes magasins, mêmes identifiants, d'une exécution à l'autre.
+
+- Villes : les villes connues du serveur, complétées par des villes
+  synthétiques réparties sur la France métropolitaine.
+- Densité : le nombre de magasins d'une ville est proportionnel à sa
+  surface (rayon²) multipliée par un facteur de densité log-normal ; dans
+  une ville, la distance au centre suit une loi exponentielle (centre
+  dense, périphérie clairsemée) tronquée au rayon.
+- Trafic : mises à jour de statut (quelques magasins très consultés, loi de
+  Zipf) et messages de chat horodatés.
+
+    python synthetic.py build bench.db --shops 1000000 --cities 200 --seed 42
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from geo import KM_PER_DEGREE
+
+SHOP_TYPES = np.array(['supermarket', 'convenience', 'hypermarket'])
+SHOP_TYPE_WEIGHTS = np.array([0.5, 0.3, 0.2])
+
+SHOP_CHAINS = {
+    "supermarket": ["Carrefour", "Leclerc", "Intermarché", "Super U", "Casino", "Monoprix"],
+    "hypermarket": ["Carrefour", "Leclerc", "Auchan", "Géant Casino", "Cora", "Hyper U"],
+    "convenience": ["Franprix", "Monop'", "Spar", "Vival", "Proxi", "8 à Huit", "Lidl", "Aldi"]
+}
+DISTRICTS = ["", "Nord", "Sud", "Est", "Ouest", "Centre", "Gare", "République", "Mairie", "Université"]
+
+STATUSES = np.array(['safe', 'danger', 'looted', 'unknown'])
+STATUS_WEIGHTS = np.array([0.55, 0.2, 0.1, 0.15])
+
+CHAT_TEMPLATES = [
+    "{shop} est ouvert, pas de file d'attente",
+    "Rupture d'eau au {shop}",
+    "Attention, zone dangereuse près du {shop}",
+    "{shop} vient d'être réapprovisionné",
+    "Le {shop} est fermé",
+]
+
+# Emprise de la France métropolitaine pour les villes synthétiques
+FRANCE_BBOX = (42.3, 51.1, -4.8, 8.2)
+
+# Identifiants des magasins d'exemple : 10 000 000 par ville, dérivés d'une empreinte stable du nom
+IDS_PER_CITY = 10_000_000
+
+def city_seed(city_name):
+    """Graine stable d'une ville (hash() de Python change à chaque exécution)"""
+    return zlib.crc32(city_name.strip().lower().encode('utf-8'))
+
+def city_id_base(city_name):
+    return (city_seed(city_name) % 100_000 + 1) * IDS_PER_CITY
+
+def build_cities(count, rng, known_cities=None):
+    """Dictionnaire {nom: {lat, lon, radius}} : villes connues puis villes synthétiques"""
+    if known_cities is None:
+        from cities import CITIES as known_cities
+
+    cities = {name: dict(coords) for name, coords in list(known_cities.items())[:count]}
+    extra = count - len(cities)
+    if extra > 0:
+        south, north, west, east = FRANCE_BBOX
+        lats = rng.uniform(south, north, extra)
+        lons = rng.uniform(west, east, extra)
+        radii = np.clip(rng.lognormal(math.log(6), 0.4, extra), 3, 20)
+        for i in range(extra):
+            cities[f"Ville-{i + 1:04d}"] = {"lat": float(lats[i]), "lon": float(lons[i]), "radius": float(radii[i])}
+    return cities
+
+def allocate_shops(cities, total, rng):
+    """Répartit total magasins entre les villes selon surface × densité"""
+    radii = np.array([coords.get('radius', 10) for coords in cities.values()], dtype=np.float64)
+    weights = radii ** 2 * rng.lognormal(0.0, 0.5, len(radii))
+    return rng.multinomial(total, weights / weights.sum())
+
+def city_shops(city_name, city_coords, count, rng, first_id):
+    """Magasins d'une ville sous forme de colonnes NumPy (ids, lats, lons, types, names)"""
+    radius = city_coords.get('radius', 10)
+    distances = np.minimum(rng.exponential(radius / 3, count), radius)
+    bearings = rng.uniform(0, 2 * math.pi, count)
+    lats = city_coords['lat'] + distances * np.cos(bearings) / KM_PER_DEGREE
+    lons = city_coords['lon'] + distances * np.sin(bearings) / (
+        KM_PER_DEGREE * max(math.cos(math.radians(city_coords['lat'])), 1e-6))
+
+    types = rng.choice(SHOP_TYPES, count, p=SHOP_TYPE_WEIGHTS)
+    chain_picks = rng.integers(0, 1 << 30, count)
+    district_picks = rng.integers(0, len(DISTRICTS), count)
+
+    names = []
+    for shop_type, chain_pick, district_pick in zip(types.tolist(), chain_picks.tolist(), district_picks.tolist()):
+        chains = SHOP_CHAINS[shop_type]
+        chain = chains[chain_pick % len(chains)]
+        if shop_type == "hypermarket":
+            names.append(f"{chain} {city_name}")
+        else:
+            names.append(f"{chain} {city_name} {DISTRICTS[district_pick]}".strip())
+
+    ids = first_id + np.arange(count, dtype=np.int64)
+    return {'ids': ids, 'lats': lats, 'lons': lons, 'types': types, 'names': names}
+
+def generate_city_elements(city_name, city_coords, count=None, seed=None):
+    """Magasins d'exemple d'une ville au format des éléments Overpass (marqués 'sample')
+
+    Sans graine, la graine est dérivée du nom de la ville : une ville
+    réinitialisée retrouve les mêmes magasins.
+    """
+    rng = np.random.default_rng(city_seed(city_name) if seed is None else seed)
+    if count is None:
+        count = int(rng.integers(15, 36))
+    shops = city_shops(city_name, city_coords, count, rng, city_id_base(city_name))
+    return [
+        {
+            "type": "node",
+            "id": int(shop_id),
+            "lat": float(lat),
+            "lon": float(lon),
+            "tags": {"name": name, "shop": str(shop_type)},
+            "sample": True
+        }
+        for shop_id, lat, lon, name, shop_type in zip(shops['ids'], shops['lats'], shops['lons'],
+                                                      shops['names'], shops['types'])
+    ]
+
+def generate_dataset(shop_count, city_count, seed=42):
+    """Jeu de données complet : villes et magasins (colonnes concaténées + ville de chaque magasin)"""
+    rng = np.random.default_rng(seed)
+    cities = build_cities(city_count, rng)
+    allocation = allocate_shops(cities, shop_count, rng)
+
+    # Identifiants séquentiels à partir de 1, dans l'ordre des villes
+    columns = {'ids': [], 'lats': [], 'lons': [], 'types': [], 'names': [], 'cities': []}
+    first_id = 1
+    for (city_name, coords), count in zip(cities.items(), allocation.tolist()):
+        shops = city_shops(city_name, coords, count, np.random.default_rng([seed, city_seed(city_name)]), first_id)
+        first_id += count
+        for key in ('ids', 'lats', 'lons', 'types', 'names'):
+            columns[key].append(shops[key])
+        columns['cities'].append([city_name] * count)
+
+    dataset = {key: np.concatenate(values) if key not in ('names', 'cities')
+               else list(itertools.chain.from_iterable(values))
+               for key, values in columns.items()}
+    dataset['city_coords'] = cities
+    return dataset
+
+def generate_status_updates(shop_ids, count, seed=42, start=None, span_hours=72):
+    """Mises à jour de statut (shop_id, status, timestamp) triées par date ; popularité selon Zipf"""
+    rng = np.random.default_rng([seed, 1])
+    shop_ids = np.asarray(shop_ids)
+    start = start or datetime(2024, 1, 1)
+
+    # Rang de popularité Zipf, appliqué à une permutation fixe des magasins
+    ranks = (rng.zipf(1.3, count) - 1) % len(shop_ids)
+    targets = shop_ids[rng.permutation(len(shop_ids))[ranks]]
+    statuses = rng.choice(STATUSES, count, p=STATUS_WEIGHTS)
+    offsets = np.sort(rng.uniform(0, span_hours * 3600, count))
+
+    return [(int(shop_id), str(status), (start + timedelta(seconds=float(offset))).isoformat())
+            for shop_id, status, offset in zip(targets, statuses, offsets)]
+
+def generate_chat_messages(cities, shop_names, count, seed=42, start=None, span_hours=72):
+    """Messages de chat au format de chat_messages.json"""
+    rng = np.random.default_rng([seed, 2])
+    start = start or datetime(2024, 1, 1)
+    city_names = list(cities)
+    city_picks = rng.integers(0, len(city_names), count)
+    shop_picks = rng.integers(0, len(shop_names), count)
+    template_picks = rng.integers(0, len(CHAT_TEMPLATES), count)
+    offsets = np.sort(rng.uniform(0, span_hours * 3600, count))
+
+    return [
+        {
+            'id': i + 1,
+            'user': f"Utilisateur{int(city_pick) % 97 + 1}",
+            'message': CHAT_TEMPLATES[template_pick].format(shop=shop_names[shop_pick]),
+            'city': city_names[city_pick],
+            'timestamp': (start + timedelta(seconds=float(offset))).isoformat()
+        }
+        for i, (city_pick, shop_pick, template_pick, offset) in enumerate(
+            zip(city_picks.tolist(), shop_picks.tolist(), template_picks.tolist(), offsets.tolist()))
+    ]
+
+def write_database(db_path, dataset, status_updates=(), batch_size=50_000):
+    """Écrit un jeu de données dans une base RescueMap (schéma complet, digests inclus)
+
+    Les identifiants générés deviennent les `id` des magasins : les mises à
+    jour de statut les référencent directement.
+    """
+    from database import get_connection, setup_database_schema
+    from sync_manager import SyncManager
+
+    setup_database_schema(db_path)
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+
+    verified = datetime(2024, 1, 1).isoformat()
+    rows = zip(dataset['ids'].tolist(), dataset['names'], dataset['lats'].tolist(), dataset['lons'].tolist(),
+               dataset['types'].tolist(), dataset['cities'], itertools.repeat(verified))
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        cursor.executemany('''
+            INSERT INTO supermarkets (id, name, lat, lon, type, city, last_verified)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+
+    if status_updates:
+        cursor.executemany('''
+            INSERT OR IGNORE INTO status_events (shop_id, city, status, timestamp)
+            SELECT id, city, ?, ? FROM supermarkets WHERE id = ?
+        ''', ((status, timestamp, shop_id) for shop_id, status, timestamp in status_updates))
+
+        # Les mises à jour sont triées par date : la dernière de chaque magasin l'emporte
+        latest = {shop_id: (status, timestamp) for shop_id, status, timestamp in status_updates}
+        cursor.executemany('UPDATE supermarkets SET status = ?, last_verified = ? WHERE id = ?',
+                           ((status, timestamp, shop_id) for shop_id, (status, timestamp) in latest.items()))
+
+    conn.commit()
+    conn.close()
+
+    SyncManager(db_path).rebuild_digests()
+
+def write_chat_file(chat_file, messages):
+    """Écrit les messages au format de chat_messages.json (100 derniers)"""
+    with open(chat_file, 'w', encoding='utf-8') as f:
+        json.dump({'messages': messages[-100:], 'last_updated': datetime.now().isoformat()},
+                  f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Génération de données synthétiques RescueMap")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Créer une base synthétique")
+    build_parser.add_argument('path', help="Base SQLite à créer")
+    build_parser.add_argument('--shops', type=int, default=100_000)
+    build_parser.add_argument('--cities', type=int, default=50)
+    build_parser.add_argument('--seed', type=int, default=42)
+    build_parser.add_argument('--status-updates', type=int, default=10_000)
+    build_parser.add_argument('--chat', type=int, default=100, help="Messages de chat à générer")
+    build_parser.add_argument('--chat-file', default=None, help="Fichier de chat à écrire (ex: chat_messages.json)")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if os.path.exists(args.path):
+            parser.error(f"{args.path} existe déjà")
+
+        start = time.time()
+        print(f"🎲 Génération de {args.shops} magasins sur {args.cities} villes (graine {args.seed})...")
+        dataset = generate_dataset(args.shops, args.cities, args.seed)
+        updates = generate_status_updates(dataset['ids'], args.status_updates, args.seed)
+        write_database(args.path, dataset, updates)
+
+        if args.chat_file:
+            messages = generate_chat_messages(dataset['city_coords'], dataset['names'], args.chat, args.seed)
+            write_chat_file(args.chat_file, messages)
+            print(f"💬 {len(messages[-100:])} messages écrits dans {args.chat_file}")
+
+        print(f"✅ {args.path} créée en {time.time() - start:.1f}s "
+              f"({args.shops} magasins, {args.status_updates} statuts)")
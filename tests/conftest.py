@@ -0,0 +1,138 @@
+# tests/conftest.py
+"""Fixtures communes : bases RescueMap temporaires et services externes locaux (127.0.0.1)"""
+import json
+import os
+import random
+import select
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import find_or_insert_shop
+from migrations import migrate
+from sync_manager import fetch_row, record_row_change
+
+# Ville -> (centre, nombre de magasins, premier osm_id)
+TEST_CITIES = {
+    'Paris': ((48.8566, 2.3522), 19, 1000),
+    'Toulouse': ((43.6045, 1.4440), 23, 2000),
+    'Saint-Étienne': ((45.4397, 4.3872), 7, 3000),
+}
+
+def city_elements(city):
+    """Magasins OSM déterministes d'une ville"""
+    (lat, lon), count, first_id = TEST_CITIES[city]
+    rng = random.Random(city)
+    return [(first_id + i, f'{city} {i}', lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05))
+            for i in range(count)]
+
+def load_cities(db_path, cities):
+    """Charge les villes dans l'ordre donné, comme server.insert_city_supermarkets"""
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    for city in cities:
+        for osm_id, name, lat, lon in city_elements(city):
+            find_or_insert_shop(cursor, city, name, lat, lon, 'supermarket', datetime.now().isoformat(), osm_id)
+    conn.commit()
+    conn.close()
+
+def set_status(db_path, shop_id, status):
+    """Signale un statut sur l'id local, comme server.set_shop_status"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    old_row = fetch_row(cursor, shop_id)
+    cursor.execute('UPDATE supermarkets SET status = ?, last_verified = ? WHERE id = ?',
+                   (status, datetime.now().isoformat(), shop_id))
+    new_row = fetch_row(cursor, shop_id)
+    record_row_change(cursor, old_row, new_row)
+    cursor.execute('INSERT INTO status_events (shop_id, city, status, timestamp) VALUES (?, ?, ?, ?)',
+                   (shop_id, new_row['city'], status, new_row['last_verified']))
+    conn.commit()
+    conn.close()
+    return new_row
+
+def city_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    counts = dict(conn.execute('SELECT city, COUNT(*) FROM supermarket_cities GROUP BY city').fetchall())
+    conn.close()
+    return counts
+
+@pytest.fixture
+def make_node(tmp_path):
+    """Crée une base de nœud peuplée : make_node('a', ['Paris', 'Toulouse'])"""
+    def make(name, cities):
+        db_path = str(tmp_path / f'{name}.db')
+        load_cities(db_path, cities)
+        return db_path
+    return make
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Répond selon server.routes[chemin] = (statut, corps JSON, délai, en-têtes)"""
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        path = urlsplit(self.path).path
+        self.server.requests.append(path)
+        status, body, delay, headers = self.server.routes.get(path, (404, None, 0, {}))
+
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            # Pendant le délai, surveille une fermeture de la connexion par le client
+            readable, _, _ = select.select([self.connection], [], [], min(0.01, deadline - time.monotonic()))
+            if readable and self.connection.recv(1, socket.MSG_PEEK) == b'':
+                self.server.disconnected.append(path)
+                return
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    """Service externe local : stub_server.route('/lent', body, delay=2) puis stub_server.url('/lent')"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.requests = []
+    server.disconnected = []
+    server.route = lambda path, body=None, status=200, delay=0, headers=None: \
+        server.routes.__setitem__(path, (status, body, delay, headers or {}))
+    server.url = lambda path: f'http://127.0.0.1:{server.server_address[1]}{path}'
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def upstream_client(monkeypatch):
+    """Client upstream neuf pour le test, avec des backoffs courts"""
+    import upstream
+
+    monkeypatch.setattr(upstream, 'BACKOFF_BASE', 0.01)
+    monkeypatch.setattr(upstream, '_client', None)
+    yield upstream.get_client()
+    upstream.get_client().close()
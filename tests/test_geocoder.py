@@ -0,0 +1,78 @@
+# tests/test_geocoder.py
+"""Requêtes couvertes du géocodeur contre des services locaux"""
+import asyncio
+import time
+
+import httpx
+
+import geocoder
+
+PARIS = [{'lat': '48.8566', 'lon': '2.3522'}]
+LYON = [{'lat': '45.764', 'lon': '4.8357'}]
+
+def stub_geocoder(stub_server, path):
+    """Service du stub, au format Nominatim"""
+    return (path, lambda city_name: {'url': stub_server.url(path), 'params': {'q': city_name}, 'headers': {}},
+            geocoder.parse_nominatim)
+
+def aresolve(*args, **kwargs):
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return await geocoder.aresolve(client, *args, **kwargs)
+    return asyncio.run(run())
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_hedge_wins_when_first_is_slow(stub_server, upstream_client):
+    stub_server.route('/lent', PARIS, delay=2)
+    stub_server.route('/rapide', LYON)
+    geocoders = [stub_geocoder(stub_server, '/lent'), stub_geocoder(stub_server, '/rapide')]
+
+    for resolve in (geocoder.resolve, aresolve):
+        start = time.monotonic()
+        coordinates = resolve('Lyon', geocoders, hedge_delay=0.05, timeout=5)
+        assert (coordinates['lat'], coordinates['lon']) == (45.764, 4.8357)
+        assert time.monotonic() - start < 1
+
+def test_fast_first_is_not_hedged(stub_server, upstream_client):
+    stub_server.route('/rapide', PARIS)
+    stub_server.route('/secours', LYON)
+    geocoders = [stub_geocoder(stub_server, '/rapide'), stub_geocoder(stub_server, '/secours')]
+
+    assert geocoder.resolve('Paris', geocoders, hedge_delay=0.5)['lat'] == 48.8566
+    assert aresolve('Paris', geocoders, hedge_delay=0.5)['lat'] == 48.8566
+    assert stub_server.requests == ['/rapide', '/rapide']
+
+def test_all_providers_fail(stub_server, upstream_client):
+    stub_server.route('/vide', [])
+    stub_server.route('/absent', status=404)
+    stub_server.route('/panne', status=503)
+    geocoders = [stub_geocoder(stub_server, path) for path in ('/vide', '/absent', '/panne')]
+
+    assert geocoder.resolve('Nulle-Part', geocoders, hedge_delay=0.05, timeout=5) is None
+    assert aresolve('Nulle-Part', geocoders, hedge_delay=0.05, timeout=5) is None
+    # 503 : nouvelles tentatives (MAX_RETRIES) avant d'abandonner
+    assert stub_server.requests.count('/panne') == 2 * (upstream_client.max_retries + 1)
+
+def test_losing_request_is_cancelled(stub_server, upstream_client):
+    stub_server.route('/lent', PARIS, delay=3)
+    stub_server.route('/rapide', LYON)
+    geocoders = [stub_geocoder(stub_server, '/lent'), stub_geocoder(stub_server, '/rapide')]
+
+    assert aresolve('Lyon', geocoders, hedge_delay=0.05, timeout=5)['lat'] == 45.764
+
+    # La requête perdante est annulée : sa connexion est fermée avant la réponse
+    assert wait_for(lambda: stub_server.disconnected == ['/lent'])
+
+def test_timeout_returns_none(stub_server, upstream_client):
+    stub_server.route('/lent', PARIS, delay=2)
+    geocoders = [stub_geocoder(stub_server, '/lent')]
+
+    start = time.monotonic()
+    assert geocoder.resolve('Paris', geocoders, hedge_delay=0.05, timeout=0.3) is None
+    assert aresolve('Paris', geocoders, hedge_delay=0.05, timeout=0.3) is None
+    assert time.monotonic() - start < 1.5
@@ -0,0 +1,39 @@
+# tests/test_migrations.py
+"""Migrations d'une base créée avant le schéma versionné"""
+import sqlite3
+
+from migrations import MIGRATIONS, migrate
+from sync_manager import SyncManager
+
+def test_old_database_with_duplicates(tmp_path):
+    db_path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE supermarkets (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, lat REAL, lon REAL,
+                                   type TEXT, address TEXT, status TEXT DEFAULT 'unknown', last_verified TEXT,
+                                   notes TEXT, city TEXT, osm_id INTEGER)
+    ''')
+    conn.executemany('INSERT INTO supermarkets (name, lat, lon, status, last_verified, city, osm_id) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        ('Lidl', 43.6, 1.44, 'unknown', '2024-01-01', 'Toulouse', 42),
+        ('Lidl', 43.6, 1.44, 'looted', '2024-02-01', 'Blagnac', None),
+        ('Casino', 43.7, 1.5, 'unknown', '2024-01-01', 'Toulouse', None),
+    ])
+    conn.commit()
+    conn.close()
+
+    assert migrate(db_path) == [version for version, _, _ in MIGRATIONS]
+
+    conn = sqlite3.connect(db_path)
+    shops = conn.execute('SELECT id, status, uid FROM supermarkets ORDER BY id').fetchall()
+    cities = conn.execute('SELECT shop_id, city FROM supermarket_cities ORDER BY shop_id, city').fetchall()
+    conn.close()
+    # Le doublon sans osm_id est fusionné (statut le plus récent), les uid sont remplis
+    assert shops[0] == (1, 'looted', 'osm:42')
+    assert shops[1][0] == 3 and shops[1][2].endswith(':3')
+    assert cities == [(1, 'Blagnac'), (1, 'Toulouse'), (3, 'Toulouse')]
+    # Digests recalculés : identiques à une reconstruction complète
+    manager = SyncManager(db_path)
+    root = manager.get_root()
+    manager.rebuild_digests()
+    assert manager.get_root() == root
@@ -0,0 +1,31 @@
+# tests/test_read_model.py
+"""Modèle de lecture : mêmes magasins et mêmes champs que la lecture SQL"""
+import database
+import server
+from read_model import MAGIC, ReadModel
+
+from conftest import set_status
+
+def test_same_shape_as_sql(tmp_path, make_node, monkeypatch):
+    db_path = make_node('a', ['Paris', 'Toulouse'])
+    monkeypatch.setattr(database, 'DB_PATH', db_path)
+    model = ReadModel(str(tmp_path / 'a.readmodel'), db_path)
+
+    # Photographie seule, puis photographie et surplus après un signalement
+    for _ in range(2):
+        expected = server.query_city_supermarkets('Paris')
+        shops = model.city_shops('Paris')
+        assert [set(shop) for shop in shops] == [set(shop) for shop in expected]
+        assert [(shop['uid'], shop['status']) for shop in shops] == \
+            [(shop['uid'], shop['status']) for shop in expected]
+        set_status(db_path, expected[0]['id'], 'looted')
+
+def test_old_format_is_rebuilt(tmp_path, make_node):
+    db_path = make_node('a', ['Paris'])
+    path = tmp_path / 'a.readmodel'
+    path.write_bytes(b'RMREAD01' + b'\0' * 64)
+
+    shops = ReadModel(str(path), db_path).city_shops('Paris')
+
+    assert len(shops) == 19 and all(shop['uid'] for shop in shops)
+    assert path.read_bytes().startswith(MAGIC)
@@ -0,0 +1,33 @@
+# tests/test_server_async.py
+"""Chargement d'une ville par le serveur asynchrone contre un Overpass local"""
+import pytest
+from starlette.testclient import TestClient
+
+import database
+import server_async
+import upstream
+
+from conftest import city_counts, city_elements
+
+@pytest.fixture
+def async_client(tmp_path, monkeypatch, stub_server, upstream_client):
+    """Serveur ASGI sur une base vide, Overpass redirigé vers le stub"""
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'async.db'))
+    monkeypatch.setattr(upstream, 'OVERPASS_URL', stub_server.url('/interpreter'))
+    with TestClient(server_async.app) as client:
+        yield client
+
+def test_load_city_queries_overpass(async_client, stub_server):
+    elements = [{'type': 'node', 'id': osm_id, 'lat': lat, 'lon': lon,
+                 'tags': {'shop': 'supermarket', 'name': name}}
+                for osm_id, name, lat, lon in city_elements('Paris')]
+    stub_server.route('/interpreter', {'elements': elements})
+
+    result = async_client.get('/api/load_city', params={'city': 'Paris'}).json()
+
+    assert result['success'] and result['count'] == len(elements)
+    assert stub_server.requests == ['/interpreter']
+    assert city_counts(database.DB_PATH) == {'Paris': len(elements)}
+    # Des magasins OSM, pas les magasins d'exemple
+    shops = async_client.get('/api/supermarkets', params={'city': 'Paris'}).json()
+    assert sorted(shop['name'] for shop in shops) == sorted(name for _, name, _, _ in city_elements('Paris'))
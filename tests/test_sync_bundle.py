@@ -0,0 +1,135 @@
+# tests/test_sync_bundle.py
+"""Bundles hors ligne : aller-retour, fichier tronqué, reprise, ordres de chargement, suppressions"""
+import sqlite3
+
+import pytest
+
+import server
+import sync_bundle
+from sync_bundle import BundleError
+from sync_manager import SyncManager
+
+from conftest import city_counts, set_status
+
+def shop_names(db_path):
+    conn = sqlite3.connect(db_path)
+    names = dict(conn.execute('SELECT uid, name FROM supermarkets').fetchall())
+    conn.close()
+    return names
+
+def exchange(tmp_path, a, b):
+    """Export croisé puis import de chaque côté"""
+    SyncManager(a).export_bundle(str(tmp_path / 'a.rmb'), chat_file=None)
+    SyncManager(b).export_bundle(str(tmp_path / 'b.rmb'), chat_file=None)
+    SyncManager(a).import_bundle(str(tmp_path / 'b.rmb'), chat_file=None)
+    SyncManager(b).import_bundle(str(tmp_path / 'a.rmb'), chat_file=None)
+
+def test_round_trip_gives_equal_roots(tmp_path, make_node):
+    a = make_node('a', ['Paris', 'Saint-Étienne'])
+    b = make_node('b', ['Toulouse'])
+    set_status(a, 1, 'looted')
+
+    exchange(tmp_path, a, b)
+
+    assert SyncManager(a).get_root() == SyncManager(b).get_root()
+    assert city_counts(a) == city_counts(b) == {'Paris': 19, 'Saint-Étienne': 7, 'Toulouse': 23}
+
+def test_truncated_bundle_raises(tmp_path, make_node):
+    a = make_node('a', ['Paris', 'Toulouse'])
+    b = make_node('b', [])
+    bundle = tmp_path / 'a.rmb'
+    SyncManager(a).export_bundle(str(bundle), chat_file=None)
+    bundle.write_bytes(bundle.read_bytes()[:-40])
+
+    with pytest.raises(BundleError):
+        SyncManager(b).import_bundle(str(bundle), chat_file=None)
+
+def test_interrupted_import_resumes(tmp_path, make_node, monkeypatch):
+    monkeypatch.setattr(sync_bundle, 'CHUNK_RECORDS', 10)
+    a = make_node('a', ['Paris', 'Toulouse'])
+    b = make_node('b', [])
+    bundle = str(tmp_path / 'a.rmb')
+    exported = SyncManager(a).export_bundle(bundle, chat_file=None)
+    assert exported['chunks'] > 2
+
+    # Coupure au milieu du deuxième chunk
+    apply_row = sync_bundle.apply_row
+    calls = []
+    def failing_apply_row(cursor, row):
+        calls.append(row['uid'])
+        if len(calls) > 15:
+            raise KeyboardInterrupt
+        return apply_row(cursor, row)
+    monkeypatch.setattr(sync_bundle, 'apply_row', failing_apply_row)
+    with pytest.raises(KeyboardInterrupt):
+        SyncManager(b).import_bundle(bundle, chat_file=None)
+    monkeypatch.setattr(sync_bundle, 'apply_row', apply_row)
+
+    result = SyncManager(b).import_bundle(bundle, chat_file=None)
+
+    assert result['applied_chunks'] == exported['chunks'] - 1
+    assert SyncManager(a).get_root() == SyncManager(b).get_root()
+    assert shop_names(a) == shop_names(b)
+
+def test_load_order_does_not_overwrite_other_shops(tmp_path, make_node):
+    # Les ids locaux diffèrent : 1 est un magasin de Paris sur a, de Toulouse sur b
+    a = make_node('a', ['Paris', 'Toulouse'])
+    b = make_node('b', ['Toulouse', 'Paris'])
+    names = shop_names(a)
+    looted_a = set_status(a, 1, 'looted')
+    looted_b = set_status(b, 1, 'danger')
+    assert looted_a['city'] == 'Paris' and looted_b['city'] == 'Toulouse'
+
+    exchange(tmp_path, a, b)
+
+    for db_path in (a, b):
+        assert city_counts(db_path) == {'Paris': 19, 'Toulouse': 23}
+        assert shop_names(db_path) == names
+        conn = sqlite3.connect(db_path)
+        statuses = dict(conn.execute("SELECT uid, status FROM supermarkets WHERE status != 'unknown'").fetchall())
+        events = conn.execute('SELECT COUNT(*) FROM status_events').fetchone()[0]
+        conn.close()
+        assert statuses == {looted_a['uid']: 'looted', looted_b['uid']: 'danger'}
+        assert events == 2
+    assert SyncManager(a).get_root() == SyncManager(b).get_root()
+
+def test_incremental_bundle_carries_deletions(tmp_path, make_node):
+    a = make_node('a', ['Paris', 'Toulouse'])
+    b = make_node('b', [])
+    first = SyncManager(a).export_bundle(str(tmp_path / 'full.rmb'), peer='b', chat_file=None)
+    SyncManager(b).import_bundle(str(tmp_path / 'full.rmb'), chat_file=None)
+    assert first['since'] is None
+
+    # Réinitialisation de Paris sur a, puis un seul bundle incrémental
+    conn = sqlite3.connect(a)
+    paris = [row[0] for row in conn.execute("SELECT shop_id FROM supermarket_cities WHERE city = 'Paris'")]
+    server.remove_city_shops(conn.cursor(), 'Paris', paris)
+    conn.commit()
+    conn.close()
+    incremental = SyncManager(a).export_bundle(str(tmp_path / 'inc.rmb'), peer='b', chat_file=None)
+    assert incremental['since'] is not None
+
+    SyncManager(b).import_bundle(str(tmp_path / 'inc.rmb'), chat_file=None)
+
+    assert city_counts(b) == {'Toulouse': 23}
+    assert SyncManager(a).get_root() == SyncManager(b).get_root()
+
+def test_deleted_shop_is_not_recreated_by_older_row(tmp_path, make_node):
+    a = make_node('a', ['Paris'])
+    b = make_node('b', ['Paris'])
+    conn = sqlite3.connect(b)
+    conn.execute("DELETE FROM supermarkets WHERE uid = 'osm:1000'")
+    conn.commit()
+    conn.close()
+    SyncManager(b).rebuild_digests()
+
+    # Le bundle complet de a contient encore le magasin, vérifié avant la suppression
+    SyncManager(a).export_bundle(str(tmp_path / 'a.rmb'), chat_file=None)
+    SyncManager(b).import_bundle(str(tmp_path / 'a.rmb'), chat_file=None)
+    assert 'osm:1000' not in shop_names(b)
+
+    # Dans l'autre sens, la pierre tombale supprime le magasin sur a
+    SyncManager(b).export_bundle(str(tmp_path / 'b.rmb'), chat_file=None)
+    SyncManager(a).import_bundle(str(tmp_path / 'b.rmb'), chat_file=None)
+    assert shop_names(a) == shop_names(b)
+    assert SyncManager(a).get_root() == SyncManager(b).get_root()
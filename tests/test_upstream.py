@@ -0,0 +1,133 @@
+# tests/test_upstream.py
+"""Client upstream : backoff, seau à jetons et disjoncteur contre un service local"""
+import threading
+import time
+
+import pytest
+
+import upstream
+from upstream import CircuitBreaker, CircuitOpenError, TokenBucket, UpstreamClient
+
+# Pas de limitation de débit pour le service local, sauf test dédié
+FAST = {'127.0.0.1': {'rate': 1000.0, 'burst': 1000}}
+
+def make_client(stub_server, policies=FAST, max_retries=0, threshold=2, cooldown=0.2):
+    """Client neuf dont le disjoncteur du stub s'ouvre vite"""
+    client = UpstreamClient(policies=policies, max_retries=max_retries)
+    _, state = client.host_state(stub_server.url('/'))
+    state.breaker = CircuitBreaker(threshold=threshold, cooldown=cooldown)
+    return client, state
+
+def test_backoff_delay_is_bounded(monkeypatch):
+    monkeypatch.setattr(upstream.random, 'uniform', lambda low, high: high)
+    assert upstream.backoff_delay(0) == upstream.BACKOFF_BASE
+    assert upstream.backoff_delay(2) == upstream.BACKOFF_BASE * 4
+    assert upstream.backoff_delay(20) == upstream.BACKOFF_MAX
+    # Retry-After l'emporte sur un backoff plus court, dans la limite de BACKOFF_MAX
+    monkeypatch.setattr(upstream.random, 'uniform', lambda low, high: low)
+    assert upstream.backoff_delay(0, retry_after=1.5) == 1.5
+    assert upstream.backoff_delay(0, retry_after=60) == upstream.BACKOFF_MAX
+
+def test_retries_honour_retry_after(stub_server, monkeypatch):
+    monkeypatch.setattr(upstream, 'BACKOFF_BASE', 0.01)
+    stub_server.route('/panne', status=503, headers={'Retry-After': '0.2'})
+    client, state = make_client(stub_server, max_retries=2, threshold=10)
+
+    start = time.monotonic()
+    response = client.get(stub_server.url('/panne'))
+
+    assert response.status_code == 503
+    assert time.monotonic() - start >= 0.4
+    assert stub_server.requests == ['/panne'] * 3
+    assert state.counters['retries'] == 2 and state.counters['failures'] == 3
+    client.close()
+
+def test_token_bucket_spaces_reservations():
+    bucket = TokenBucket(rate=10.0, burst=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
+
+def test_token_bucket_throttles_requests(stub_server):
+    stub_server.route('/ok', {'ok': True})
+    client, state = make_client(stub_server, policies={'127.0.0.1': {'rate': 20.0, 'burst': 2}})
+
+    start = time.monotonic()
+    for _ in range(6):
+        client.get(stub_server.url('/ok'))
+
+    # 2 jetons de rafale, puis 4 jetons à 20 par seconde
+    assert time.monotonic() - start >= 0.18
+    assert state.counters['throttle_seconds'] > 0
+    client.close()
+
+def test_breaker_opens_then_half_opens_then_closes(stub_server):
+    stub_server.route('/service', status=503)
+    client, state = make_client(stub_server)
+
+    client.get(stub_server.url('/service'))
+    assert state.breaker.state == 'closed'
+    client.get(stub_server.url('/service'))
+    assert state.breaker.state == 'open'
+
+    # Ouvert : refusé sans toucher le réseau
+    with pytest.raises(CircuitOpenError):
+        client.get(stub_server.url('/service'))
+    assert len(stub_server.requests) == 2 and state.counters['rejected'] == 1
+
+    time.sleep(0.25)
+    assert state.breaker.state == 'half-open'
+    stub_server.route('/service', {'ok': True})
+    assert client.get(stub_server.url('/service')).status_code == 200
+    assert state.breaker.state == 'closed'
+    client.close()
+
+def test_failed_probe_reopens(stub_server):
+    stub_server.route('/service', status=503)
+    client, state = make_client(stub_server)
+    client.get(stub_server.url('/service'))
+    client.get(stub_server.url('/service'))
+
+    time.sleep(0.25)
+    client.get(stub_server.url('/service'))
+    assert state.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.get(stub_server.url('/service'))
+    client.close()
+
+def test_half_open_allows_a_single_probe(stub_server):
+    stub_server.route('/service', status=503)
+    client, state = make_client(stub_server, cooldown=0.5)
+    client.get(stub_server.url('/service'))
+    client.get(stub_server.url('/service'))
+    time.sleep(0.55)
+
+    # Essai lent : les appels concurrents sont refusés tant qu'il n'a pas abouti
+    stub_server.route('/service', {'ok': True}, delay=0.3)
+    results = []
+    def call():
+        try:
+            results.append(client.get(stub_server.url('/service')).status_code)
+        except CircuitOpenError:
+            results.append('rejected')
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results, key=str) == [200] + ['rejected'] * 4
+    assert stub_server.requests.count('/service') == 3
+    assert state.breaker.state == 'closed'
+    client.close()
+
+def test_abandoned_probe_is_replaced():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.1)
+    breaker.record_failure()
+    time.sleep(0.15)
+    assert breaker.allow()
+    assert not breaker.allow()
+    # L'essai n'a jamais rendu de résultat (requête annulée) : un autre est permis
+    time.sleep(0.15)
+    assert breaker.allow()
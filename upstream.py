@@ -0,0 +1,312 @@
+# upstream.py
+"""Client HTTP partagé vers les services externes (Nominatim, api-adresse, Overpass)
+
+Une session `requests` (connexions keep-alive) par hôte, un seau à jetons par
+hôte pour respecter les limites de débit, des nouvelles tentatives avec
+backoff exponentiel et gigue, un disjoncteur par hôte et des compteurs.
+
+Les URL de base peuvent être redirigées vers des serveurs locaux (tests,
+benchmarks) avec les variables RESCUEMAP_NOMINATIM_URL, RESCUEMAP_ADRESSE_URL
+et RESCUEMAP_OVERPASS_URL.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+import profiler
+
+NOMINATIM_URL = os.environ.get('RESCUEMAP_NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+ADRESSE_URL = os.environ.get('RESCUEMAP_ADRESSE_URL', 'https://api-adresse.data.gouv.fr/search/')
+OVERPASS_URL = os.environ.get('RESCUEMAP_OVERPASS_URL', 'https://overpass-api.de/api/interpreter')
+
+# Débit autorisé par hôte : jetons par seconde et taille de rafale
+HOST_POLICIES = {
+    'nominatim.openstreetmap.org': {'rate': 1.0, 'burst': 1},   # 1 requête/seconde (règles d'usage)
+    'overpass-api.de': {'rate': 0.5, 'burst': 2},
+    'api-adresse.data.gouv.fr': {'rate': 10.0, 'burst': 10},
+}
+DEFAULT_POLICY = {'rate': 5.0, 'burst': 5}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.5      # secondes
+BACKOFF_MAX = 8.0
+
+# Le disjoncteur s'ouvre après N échecs consécutifs et reste ouvert COOLDOWN secondes
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+class UpstreamError(Exception):
+    """Échec d'un appel à un service externe après les nouvelles tentatives"""
+
+class CircuitOpenError(UpstreamError):
+    """Le disjoncteur de l'hôte est ouvert : appel refusé sans toucher le réseau"""
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Réserve un jeton et retourne le temps d'attente avant de l'utiliser (secondes)
+
+        Le solde peut devenir négatif : les appelants concurrents sont ainsi
+        servis dans l'ordre de réservation, chacun avec sa propre attente.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class CircuitBreaker:
+    """Fermé, ouvert, puis semi-ouvert après `cooldown` : un seul appel d'essai à la fois
+
+    En semi-ouvert, les autres appels sont refusés jusqu'au résultat de
+    l'essai. Un essai sans résultat (requête annulée) est abandonné après
+    `cooldown` secondes et un nouvel essai est autorisé.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Vrai si un appel peut partir (fermé, ou semi-ouvert pour l'unique essai)"""
+        with self.lock:
+            state = self.state
+            if state != 'half-open':
+                return state == 'closed'
+            now = time.monotonic()
+            if self.probe_started is not None and now - self.probe_started < self.cooldown:
+                return False
+            self.probe_started = now
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.failures >= self.threshold or self.opened_at is not None:
+                # Un essai raté en semi-ouvert relance une période complète
+                self.opened_at = time.monotonic()
+
+class HostState:
+    """Session, limiteur, disjoncteur et compteurs d'un hôte"""
+
+    def __init__(self, policy):
+        # requests (et ses dépendances) n'est importé qu'au premier appel externe
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.bucket = TokenBucket(policy['rate'], policy['burst'])
+        self.breaker = CircuitBreaker()
+        self.lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            'rejected': 0,
+            'throttle_seconds': 0.0,
+            'latency_seconds': 0.0,
+        }
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters, breaker=self.breaker.state)
+
+def backoff_delay(attempt, retry_after=None):
+    """Backoff exponentiel avec gigue complète, au moins Retry-After si fourni"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+def _retry_after(headers):
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+class UpstreamClient:
+    def __init__(self, policies=None, max_retries=MAX_RETRIES):
+        self.policies = HOST_POLICIES if policies is None else policies
+        self.max_retries = max_retries
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host_state(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                state = HostState(self.policies.get(urlsplit(url).hostname, DEFAULT_POLICY))
+                self.hosts[host] = state
+            return host, state
+
+    def request(self, method, url, **kwargs):
+        """Requête synchrone avec limitation de débit, nouvelles tentatives et disjoncteur
+
+        Retourne la dernière réponse (éventuellement en erreur HTTP) ou lève
+        UpstreamError si aucune réponse n'a pu être obtenue.
+        """
+        import requests
+
+        host, state = self.host_state(url)
+        error = None
+        response = None
+
+        for attempt in range(self.max_retries + 1):
+            if not state.breaker.allow():
+                state.count('rejected')
+                raise CircuitOpenError(f"Disjoncteur ouvert pour {host}")
+
+            wait = state.bucket.reserve()
+            if wait:
+                state.count('throttle_seconds', wait)
+                time.sleep(wait)
+
+            state.count('requests')
+            start = time.monotonic()
+            try:
+                response = state.session.request(method, url, **kwargs)
+                error = None
+            except requests.RequestException as e:
+                response = None
+                error = e
+            elapsed = time.monotonic() - start
+            state.count('latency_seconds', elapsed)
+            metrics.UPSTREAM_REQUEST_SECONDS.observe(elapsed, host=host)
+            profiler.record_upstream(method, url, response.status_code if response is not None else type(error).__name__, elapsed)
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                state.breaker.record_success()
+                return response
+
+            state.count('failures')
+            state.breaker.record_failure()
+            if attempt == self.max_retries:
+                break
+
+            state.count('retries')
+            time.sleep(backoff_delay(attempt, _retry_after(response.headers) if response is not None else None))
+
+        if response is None:
+            raise UpstreamError(f"{method} {host} a échoué: {error}") from error
+        return response
+
+    async def arequest(self, client, method, url, **kwargs):
+        """Même politique que request(), avec un httpx.AsyncClient partagé"""
+        import httpx
+
+        host, state = self.host_state(url)
+        error = None
+        response = None
+
+        for attempt in range(self.max_retries + 1):
+            if not state.breaker.allow():
+                state.count('rejected')
+                raise CircuitOpenError(f"Disjoncteur ouvert pour {host}")
+
+            wait = state.bucket.reserve()
+            if wait:
+                state.count('throttle_seconds', wait)
+                await asyncio.sleep(wait)
+
+            state.count('requests')
+            start = time.monotonic()
+            try:
+                response = await client.request(method, url, **kwargs)
+                error = None
+            except httpx.HTTPError as e:
+                response = None
+                error = e
+            elapsed = time.monotonic() - start
+            state.count('latency_seconds', elapsed)
+            metrics.UPSTREAM_REQUEST_SECONDS.observe(elapsed, host=host)
+            profiler.record_upstream(method, url, response.status_code if response is not None else type(error).__name__, elapsed)
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                state.breaker.record_success()
+                return response
+
+            state.count('failures')
+            state.breaker.record_failure()
+            if attempt == self.max_retries:
+                break
+
+            state.count('retries')
+            await asyncio.sleep(backoff_delay(attempt, _retry_after(response.headers) if response is not None else None))
+
+        if response is None:
+            raise UpstreamError(f"{method} {host} a échoué: {error}") from error
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self):
+        """Compteurs par hôte (requêtes, échecs, attentes, état du disjoncteur)"""
+        with self.lock:
+            hosts = dict(self.hosts)
+        return {host: state.snapshot() for host, state in hosts.items()}
+
+    def close(self):
+        with self.lock:
+            for state in self.hosts.values():
+                state.session.close()
+            self.hosts.clear()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Client partagé par tout le processus"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UpstreamClient()
+        return _client
+
+def get(url, **kwargs):
+    return get_client().get(url, **kwargs)
+
+def post(url, **kwargs):
+    return get_client().post(url, **kwargs)